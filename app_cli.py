@@ -141,7 +141,7 @@ async def st_main():
         # Get bot response
         resp = await chatbot.chat(user_input)
         op = f"""
-        Recommended product: \n{resp.output.recommended.model_dump_json()}
+        Recommended product: \n{resp.output.recommended.model_dump_json() if resp.output.recommended else None}
         \n{resp.output.message}\n Agent Flow : {resp.output.flow}
         """
         st.session_state.messages.append({"role": "assistant", "content": op})
@@ -2,8 +2,18 @@ from typing import List
 import html
 import asyncio
 from pydantic_models import Product
-from pydantic_ai_agents import Chatbot
+from pydantic_ai_agents import Chatbot, get_chat_metrics
 import pydantic_ai_agents
+from browser_pool import get_browser_pool
+from scrape_cache import get_facet_cache, get_product_cache
+from prefetch import prefetch_stats
+from llm_cache import get_llm_cache
+from waits import get_wait_stats
+from facets import facet_stats
+from candidate_pool import pool_stats
+from tracing import send_json
+from scheduler import get_scheduler, SchedulerBusy
+from contextlib import asynccontextmanager
 import json
 import fastapi
 import uvicorn
@@ -17,7 +27,12 @@ from fastapi import FastAPI, WebSocket
 logging.basicConfig(stream=sys.stderr, level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await get_browser_pool().close()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -35,24 +50,24 @@ async def ws_endpoint(ws: WebSocket):
     
     async def handle_chat(user_query: id):
         try:
-            resp = await chatbot.chat(user_query)
-            await ws.send_json({
-                'type': 'response',
-                'message': resp.output.message,
-                'products': [p.model_dump() for p in resp.output.products if p],
-                'recc': resp.output.recommended.model_dump(),
-                'flow': resp.output.flow,
-                'steps': resp.output.steps
-            })
+            # steps & products are pushed as they happen, the full response last
+            async for event in chatbot.chat_stream(user_query, session_id=str(user_id)):
+                await send_json(ws, event)
             logger.info('Sending ackChat ...')
-            await ws.send_json({    
+            await send_json(ws, {    
                 "type": "ackChat",
                 "message": "Chat complete"
             })
             logger.info('Sent ackChat !')                
+        except SchedulerBusy as e:
+            logger.error(f'Rejected chat of {user_id}: {e}')
+            await send_json(ws, {
+                "type": "busy",
+                "message": f"{e}"
+            })
         except Exception as e:
             logger.error(f'chat oopsie: {e}')
-            await ws.send_json({
+            await send_json(ws, {
             "type": "error",
             "message": f"{e}"
         })
@@ -67,7 +82,14 @@ async def ws_endpoint(ws: WebSocket):
             elif msg['type'] == 'prompt_response':
                 prompt_id = msg.get('prompt_id')
                 isRec = chatbot.coach.set_userResp(msg['content'], prompt_id)
-                await ws.send_json({
+                await send_json(ws, {
+                    "type": "ackPromptUser",
+                    "message": "Response received" if isRec else "No matching prompt :("
+                })
+            elif msg['type'] == 'prompt_form_response':
+                # all filter answers of a prompt_form at once: {filter name: [options] | {'range': [low, high]} | text}
+                isRec = chatbot.coach.set_userResp(msg.get('answers') or {}, msg.get('prompt_id'))
+                await send_json(ws, {
                     "type": "ackPromptUser",
                     "message": "Response received" if isRec else "No matching prompt :("
                 })
@@ -79,6 +101,22 @@ async def ws_endpoint(ws: WebSocket):
     finally:
         await ws.close()
 
+@app.get('/metrics')
+async def metrics():
+    """Chat latency, scheduler queues, browser pool, scrape cache counters & scraper wait times"""
+    return {
+        'chat': get_chat_metrics().stats(),
+        'scheduler': get_scheduler().stats(),
+        'browser_pool': get_browser_pool().stats(),
+        'facet_cache': get_facet_cache().stats(),
+        'product_cache': get_product_cache().stats(),
+        'prefetch': prefetch_stats(),
+        'llm_cache': get_llm_cache().stats(),
+        'waits': get_wait_stats().stats(),
+        'facets': facet_stats(),
+        'candidates': pool_stats(),
+    }
+
 # @app.get('/')
 # async def home():
 #     """Home Page Frontend"""
@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import logging
+from typing import List, Optional, Dict, Any
+
+# fixture site instead of flipkart, throwaway caches, the stub model called every time
+from fixture_site import FixtureServer
+fixture_server = FixtureServer().start()
+os.environ['SHOP_SITES'] = fixture_server.base_url
+os.environ.setdefault('SHOP_CACHE_DIR', tempfile.mkdtemp(prefix='bench_load_'))
+os.environ.setdefault('SHOP_LLM_CACHE', '0')
+
+import uvicorn
+import websockets
+from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart, ToolCallPart, ToolReturnPart, UserPromptPart
+from pydantic_ai.models.function import FunctionModel, AgentInfo
+import app_gui
+import pydantic_ai_agents
+from site_adapters import FixtureAdapter, register_adapter
+
+logging.disable(logging.INFO)
+
+CLIENTS = 10
+CHATS = 2                   # chats per client, one after the other
+QUERY = 'phone'
+LAG_INTERVAL = 0.05         # s, event loop lag probe period
+SESSION_TIMEOUT = 120.0     # s
+# scripted replies: the first prompt (prompt_user0) & the filter form answers by filter name
+FIRST_REPLY = 'black, 128 gb'
+FILTER_REPLIES = {'INTERNAL STORAGE': '128 gb', 'COLOR': 'black', 'SIM TYPE': 'dual sim'}
+TOOL_SEQUENCE = ['get_pro_class', 'prompt_user0', 'rephrase_query', 'get_best_site', 'get_site_filters', 'trim_site_filters',
+                 'prompt_user1', 'get_candidates']
+NO_PRODUCT = {'price': 0, 'name': '-', 'url': '', 'image': None, 'review': None, 'details': []}
+
+def stub_model(messages: List[ModelMessage], info: AgentInfo) -> ModelResponse:
+    """Deterministic stand-in for Gemini: walks the shopping tools in order & answers gen_agent prompts with canned outputs"""
+    parts = [part for message in messages for part in message.parts]
+    if info.function_tools:
+        done = [part for part in parts if isinstance(part, ToolReturnPart)]
+        if len(done) < len(TOOL_SEQUENCE):
+            return ModelResponse(parts=[ToolCallPart(TOOL_SEQUENCE[len(done)], {})])
+        candidates = [p.model_dump(mode='json') for p in done[-1].content or []] if done[-1].tool_name == 'get_candidates' else []
+        result = {'products': candidates, 'recommended': candidates[0] if candidates else NO_PRODUCT,
+                  'message': None if candidates else 'No products found !'}
+        return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, result)])
+    prompt = ' '.join(str(part.content) for part in parts if isinstance(part, UserPromptPart))
+    if info.output_tools:
+        properties = info.output_tools[0].parameters_json_schema.get('properties', {})
+        if 'category' in properties:
+            return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, {'category': 'electronics', 'type': 'smartphone'})])
+        return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, {'response': []})])
+    if 'Rephrase' in prompt:
+        return ModelResponse(parts=[TextPart('phone black 128 gb')])
+    return ModelResponse(parts=[TextPart('Which storage size and colour would you like?')])
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+def rss_mib() -> float:
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith('VmRSS')) / 1024
+
+def form_answers(filters: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Scripted free text answers for the filters of a prompt_form, the rest skipped"""
+    return {f['name']: FILTER_REPLIES[f['name']] for f in filters if f['name'] in FILTER_REPLIES}
+
+async def client_session(url: str, query: str) -> Dict[str, Any]:
+    """One chat over a fresh websocket, answering every prompt from the script"""
+    result = {'ok': False, 'first_product': None, 'total': None, 'events': 0, 'error': None}
+    async with websockets.connect(url, max_size=None) as ws:
+        start = time.perf_counter()
+        await ws.send(json.dumps({'type': 'chat', 'content': query}))
+        while True:
+            event = json.loads(await ws.recv())
+            result['events'] += 1
+            if event['type'] == 'prompt':
+                await ws.send(json.dumps({'type': 'prompt_response', 'prompt_id': event['prompt_id'], 'content': FIRST_REPLY}))
+            elif event['type'] == 'prompt_form':
+                await ws.send(json.dumps({'type': 'prompt_form_response', 'prompt_id': event['prompt_id'], 'answers': form_answers(event['filters'])}))
+            elif event['type'] == 'product' and result['first_product'] is None:
+                result['first_product'] = time.perf_counter() - start
+            elif event['type'] == 'response':
+                result['ok'] = True
+            elif event['type'] in ('error', 'busy'):
+                result['error'] = f"{event['type']}: {event['message']}"
+                break
+            elif event['type'] == 'ackChat':
+                break
+        result['total'] = time.perf_counter() - start
+    return result
+
+async def client(url: str, chats: int, query: str) -> List[Dict[str, Any]]:
+    results = []
+    for _ in range(chats):
+        try:
+            results.append(await asyncio.wait_for(client_session(url, query), SESSION_TIMEOUT))
+        except Exception as e:
+            results.append({'ok': False, 'first_product': None, 'total': None, 'events': 0, 'error': f'{type(e).__name__}: {e}'})
+    return results
+
+class ServerThread:
+    """app_gui.app on its own event loop, probing that loop's lag"""
+
+    def __init__(self):
+        self.server = uvicorn.Server(uvicorn.Config(app_gui.app, host='127.0.0.1', port=0, log_level='warning', ws_max_size=2 ** 24))
+        self.loop = asyncio.new_event_loop()
+        self.lags: List[float] = []
+        self.thread = threading.Thread(target=self.loop.run_until_complete, args=(self.serve(),), daemon=True)
+
+    async def serve(self) -> None:
+        asyncio.get_running_loop().create_task(self.probe())
+        await self.server.serve()
+
+    async def probe(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.lags.append(time.perf_counter() - start - LAG_INTERVAL)
+
+    def start(self) -> str:
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        port = self.server.servers[0].sockets[0].getsockname()[1]
+        return f'ws://127.0.0.1:{port}/ws/chat'
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+async def load(url: str, clients: int, chats: int, query: str) -> List[Dict[str, Any]]:
+    runs = await asyncio.gather(*(client(url, chats, query) for _ in range(clients)))
+    return [result for run in runs for result in run]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Concurrent /ws/chat sessions against a stub LLM & the fixture site')
+    parser.add_argument('--clients', type=int, default=CLIENTS)
+    parser.add_argument('--chats', type=int, default=CHATS)
+    parser.add_argument('--query', default=QUERY)
+    args = parser.parse_args()
+
+    register_adapter(FixtureAdapter('fixture', fixture_server.base_url))
+    pydantic_ai_agents.override_model(FunctionModel(stub_model))
+    server = ServerThread()
+    url = server.start()
+    rss_before = rss_mib()
+    start = time.perf_counter()
+    try:
+        results = asyncio.run(load(url, args.clients, args.chats, args.query))
+    finally:
+        wall = time.perf_counter() - start
+        server.stop()
+        fixture_server.stop()
+    rss_after = rss_mib()
+
+    ok = [r for r in results if r['ok']]
+    first = [r['first_product'] for r in ok if r['first_product'] is not None]
+    total = [r['total'] for r in ok]
+    fmt = lambda v: f'{v:.3f}s' if v is not None else '-'
+    print(f'{args.clients} clients x {args.chats} chats: {len(ok)}/{len(results)} ok in {wall:.1f}s -> {len(ok) / wall:.2f} sessions/s')
+    print(f'time to first product  p50 {fmt(percentile(first, 0.5))}  p95 {fmt(percentile(first, 0.95))}')
+    print(f'end to end             p50 {fmt(percentile(total, 0.5))}  p95 {fmt(percentile(total, 0.95))}  max {fmt(max(total, default=None))}')
+    print(f'event loop lag         p95 {fmt(percentile(server.lags, 0.95))}  max {fmt(max(server.lags, default=None))}')
+    print(f'memory                 {rss_before:.0f} -> {rss_after:.0f} MiB (+{rss_after - rss_before:.0f})')
+    errors = {}
+    for r in results:
+        if r['error']:
+            errors[r['error'][:120]] = errors.get(r['error'][:120], 0) + 1
+    for error, count in errors.items():
+        print(f'{count} x {error}')
+    sys.exit(0 if len(ok) == len(results) else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import sys
+import time
+import random
+import logging
+from typing import List
+from pydantic_models import UserFilter
+from records import ProductRecord
+import numpy as np
+from ranking import Ranker, price_budget, _tokens, PRIOR_RATING, _quantity_pattern
+from filter_matcher import parse_range, UNITS
+
+logging.disable(logging.INFO)
+
+SIZES = (100, 1000, 10000, 100000)
+REPEAT = 5          # best of
+QUERY = 'black phone 128 gb under 30k'
+FILTERS = [UserFilter(name='INTERNAL STORAGE', type='multiselect', selection=['128 - 255.9 GB', '256 GB & Above']),
+           UserFilter(name='RAM', type='multiselect', selection=['8 GB']),
+           UserFilter(name='COLOR', type='multiselect', selection=['Black'])]
+
+def candidates(n: int, seed: int = 0) -> List[ProductRecord]:
+    rng = random.Random(seed)
+    return [ProductRecord(
+        name=f'Phone {i} ({rng.choice(["Black", "Blue", "Green"])}, {rng.choice([64, 128, 256])} GB)',
+        price=rng.randint(5000, 150000),
+        url=f'https://www.flipkart.com/phone-{i}/p/itm{i:012x}',
+        rating=round(rng.uniform(1, 5), 1),
+        num_ratings=rng.choice([0, 3, 40, 900, 25000]),
+        details=[f'{rng.choice([4, 6, 8, 12])} GB RAM | 128 GB ROM', '6.1 inch Display', '48MP + 12MP Rear Camera'],
+    ) for i in range(n)]
+
+def python_scores(ranker: Ranker, records: List[ProductRecord], query: str, user_filters: List[UserFilter]) -> List[float]:
+    """Reference: the same scores one candidate at a time in plain python"""
+    budget = price_budget(query, user_filters)
+    prices = [r.price for r in records]
+    rated = [(r.rating, r.num_ratings) for r in records if r.num_ratings > 0]
+    mean = sum(rating * votes for rating, votes in rated) / sum(votes for _, votes in rated) if rated else PRIOR_RATING
+    groups = [[r if (r := parse_range(o)) and r[2] else _tokens(o) for o in f.selection or [] if _tokens(o)]
+              for f in user_filters if 'PRICE' not in f.name.upper()]
+    groups = [group for group in groups if group]
+    terms = _tokens(query)
+    bases = tuple(sorted({o[2] for group in groups for o in group if isinstance(o, tuple) and o[2] != '★'}))
+    quantity = _quantity_pattern(bases) if bases else None
+    w = ranker.weights
+    totals = []
+    for r in records:
+        if budget:
+            low, high = budget
+            off = (low - r.price) / max(low, 1.0) if r.price < low else (r.price - high) / max(high, 1.0) if r.price > high else 0.0
+            price = min(1.0, max(0.0, 1.0 - off))
+        else:
+            price = 1.0 - (r.price - min(prices)) / (max(prices) - min(prices)) if max(prices) > min(prices) else 1.0
+        votes = max(r.num_ratings, 0)
+        rating = (ranker.prior_votes * mean + r.rating * votes) / (ranker.prior_votes + votes) / 5.0
+        text = _tokens(' '.join([r.name, *r.details]))
+        found = [(float(m.group(1)) * UNITS[m.group(2)][1], UNITS[m.group(2)][0]) for m in quantity.finditer(' '.join([r.name, *r.details]).lower())] if quantity else []
+        met = lambda o: (o[0] <= r.rating <= o[1] if o[2] == '★' else any(u == o[2] and o[0] - 1e-9 <= v <= o[1] + 1e-9 for v, u in found)) \
+            if isinstance(o, tuple) else o <= text
+        filters = sum(any(met(option) for option in group) for group in groups) / len(groups) if groups else 1.0
+        overlap = len(terms & text) / len(terms) if terms else 1.0
+        totals.append(w['price'] * price + w['rating'] * rating + w['filters'] * filters + w['query'] * overlap)
+    return totals
+
+def best(fn, repeat: int = REPEAT) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+if __name__ == '__main__':
+    ranker = Ranker()
+    print(f'weights: {ranker.weights}')
+    for n in [int(arg) for arg in sys.argv[1:]] or SIZES:
+        records = candidates(n)
+        ranked = ranker.rank(records, QUERY, FILTERS)
+        reference = python_scores(ranker, records, QUERY, FILTERS)
+        assert np.allclose(ranker.scores(records, QUERY, FILTERS)['total'], reference), 'numpy & python scores differ'
+        # deterministic: the same input ranks the same way every time
+        assert [r.url for r in ranker.rank(records, QUERY, FILTERS)] == [r.url for r in ranked]
+        repeat = 1 if n >= 100000 else REPEAT
+        numpy_s = best(lambda: ranker.rank(records, QUERY, FILTERS), repeat)
+        python_s = best(lambda: sorted(zip(python_scores(ranker, records, QUERY, FILTERS), range(n)), key=lambda x: -x[0]), repeat)
+        print(f'{n:>7} candidates  numpy {numpy_s * 1e3:9.2f} ms ({numpy_s / n * 1e6:5.2f} us/candidate)  '
+              f'python {python_s * 1e3:9.2f} ms ({python_s / n * 1e6:5.2f} us/candidate)  top: {ranked[0].name} ₹{ranked[0].price}')
@@ -0,0 +1,79 @@
+import sys
+import json
+import time
+import random
+import logging
+from typing import List, Dict, Any, Callable
+from pydantic_models import Product, ProductReview
+from records import ProductRecord, records_from_raw, to_products, encode_json
+
+logging.disable(logging.INFO)
+
+SIZES = (1000, 100000)
+REPEAT = 3          # best of
+
+def raw_items(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Extracted product tiles as EXTRACT_JS returns them"""
+    rng = random.Random(seed)
+    items = []
+    for i in range(n):
+        rated = rng.random() < 0.9
+        items.append({
+            'href': f'https://www.flipkart.com/phone-{i}/p/itm{i:012x}?pid=MOB{i:012X}&lid=LST{i}&marketplace=FLIPKART',
+            'name': f'Phone {i} ({rng.choice(["Black", "Blue", "Green"])}, {rng.choice([64, 128, 256])} GB)',
+            'price': f'₹{rng.randint(5000, 150000):,}',
+            'image': f'https://rukminim2.flixcart.com/image/312/312/phone-{i}.jpeg',
+            'rating': f'{rng.uniform(1, 5):.1f}' if rated else None,
+            'count': f'{rng.randint(1, 500000):,} Ratings & {rng.randint(1, 50000):,} Reviews' if rated else None,
+            'highlights': [f'{rng.choice([4, 6, 8, 12])} GB RAM | 128 GB ROM', '6.1 inch Super Retina XDR Display', '48MP + 12MP Rear Camera'],
+        })
+    return items
+
+def pydantic_from_raw(raws: List[Dict[str, Any]]) -> List[Product]:
+    """The previous products_from_raw: a Product & ProductReview model_validate (with their before validators) per item"""
+    import re
+    products = []
+    for raw in raws:
+        if not all(raw.get(key) for key in ('name', 'price', 'href')):
+            continue
+        try:
+            counts = re.findall(r'[\d,]+', raw['count']) if raw.get('rating') and raw.get('count') else []
+            num_rat, num_rev = (counts + ['-1', '-1'])[:2]
+            prod_rev = ProductReview.model_validate({'ratings': raw.get('rating') or 0.0, 'num_ratings': num_rat, 'num_reviews': num_rev})
+            products.append(Product.model_validate({
+                'name': raw['name'], 'price': raw['price'], 'url': raw['href'], 'image': raw.get('image'),
+                'review': prod_rev, 'details': raw.get('highlights') or []
+            }))
+        except Exception:
+            pass
+    return products
+
+def best(fn: Callable, repeat: int = REPEAT) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def bench(n: int) -> None:
+    raws = raw_items(n)
+    products = pydantic_from_raw(raws)
+    records = records_from_raw(raws)
+    # same items, same values as the pydantic path
+    assert [r.to_dict() for r in records] == [p.model_dump(mode='json') for p in products], 'records differ from Products'
+
+    rows = [
+        ('parse', 'pydantic Product', best(lambda: pydantic_from_raw(raws))),
+        ('parse', 'ProductRecord', best(lambda: records_from_raw(raws))),
+        ('serialize', 'model_dump + json.dumps', best(lambda: json.dumps({'type': 'response', 'products': [p.model_dump(mode='json') for p in products]}))),
+        ('serialize', 'records encode_json', best(lambda: encode_json({'type': 'response', 'products': records}))),
+        ('boundary', 'to_products (once)', best(lambda: to_products(records))),
+    ]
+    print(f'{n} items')
+    for stage, path, seconds in rows:
+        print(f'  {stage:<10} {path:<26} {seconds * 1e3:9.1f} ms  {seconds / n * 1e6:7.2f} us/item')
+
+if __name__ == '__main__':
+    for n in [int(arg) for arg in sys.argv[1:]] or SIZES:
+        bench(n)
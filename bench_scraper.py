@@ -0,0 +1,237 @@
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import logging
+from urllib.parse import urlsplit
+from typing import List, Optional, Dict, Any, Callable
+
+# keep the benchmark away from the real scrape caches
+os.environ.setdefault('SHOP_CACHE_DIR', tempfile.mkdtemp(prefix='bench_scraper_'))
+from playwright.async_api import async_playwright
+from browser_pool import BrowserPool, BROWSER_ARGS
+from fixture_site import FixtureServer, FIXTURE_DIR
+from site_adapters import FixtureAdapter
+import site_scraper
+
+logging.disable(logging.INFO)
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'flipkart')
+FLIPKART = 'https://www.flipkart.com'
+QUERY = 'iphone 15'
+PRODUCTS = 8            # product pages recorded / fetched per search
+ITERATIONS = 20         # runs of every operation per mode
+CONCURRENCY = 4         # leases in pooled mode
+REGRESSION = 1.25       # p50 slower than baseline by this factor fails the run
+RSS_INTERVAL = 0.2      # s between Chromium RSS samples
+
+SCRIPT_RE = re.compile(r'<script\b[^>]*>.*?</script>', re.S | re.I)
+
+def snapshot_html(html: str) -> str:
+    """Static copy of a rendered page: scripts dropped (the DOM is already rendered) & site links made local"""
+    return SCRIPT_RE.sub('', html).replace(FLIPKART, '')
+
+async def record(query: str = QUERY, products: int = PRODUCTS, out: str = SNAPSHOT_DIR) -> None:
+    """Snapshot the live search page & its top product pages into `out` once (needs network)"""
+    os.makedirs(os.path.join(out, 'pages'), exist_ok=True)
+    routes = {}
+
+    async def save(page: Any, route: str, name: str) -> None:
+        with open(os.path.join(out, name), 'w') as f:
+            f.write(snapshot_html(await page.content()))
+        routes[route] = name
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=BROWSER_ARGS)
+        page = await (await browser.new_context()).new_page()
+        search_url, _ = site_scraper.build_search_url(FLIPKART, query)
+        await page.goto(search_url)
+        await page.wait_for_selector('div.DOjaWF.gdgoEp')
+        await save(page, '/search', 'search.html')
+        links = await site_scraper.get_pro_links(FLIPKART, page)
+        for idx, link in enumerate(links[:products]):
+            await page.goto(link)
+            await page.wait_for_selector(site_scraper.PRODUCT_PAGE_SPEC['ready'])
+            await save(page, urlsplit(link).path, f'pages/product_{idx}.html')
+        await browser.close()
+    with open(os.path.join(out, 'manifest.json'), 'w') as f:
+        json.dump({'site': 'flipkart', 'query': query, 'recorded': time.time(), 'routes': routes}, f, indent=1)
+    print(f'Recorded {len(routes)} pages for {query} into {out}')
+
+def chromium_rss() -> Optional[float]:
+    """MiB resident in the Chromium processes started by this process (Linux /proc only)"""
+    if not os.path.isdir('/proc'):
+        return None
+    parents, names, rss = {}, {}, {}
+    for pid in filter(str.isdigit, os.listdir('/proc')):
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                status = dict(line.split(':', 1) for line in f if ':' in line)
+        except OSError:
+            continue
+        parents[int(pid)] = int(status['PPid'])
+        names[int(pid)] = status['Name'].strip()
+        rss[int(pid)] = int(status.get('VmRSS', '0 kB').split()[0])
+    total = 0
+    for pid in parents:
+        ancestor = parents.get(pid)
+        while ancestor and ancestor != os.getpid():
+            ancestor = parents.get(ancestor)
+        if ancestor and ('chrom' in names[pid].lower() or 'headless' in names[pid].lower()):
+            total += rss[pid]
+    return total / 1024
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+def workload(site: str, base_url: str, query: str, product_urls: List[str], top_k: int) -> Dict[str, Callable]:
+    """The scraper operations benchmarked: name -> async fn(page, i)"""
+    if site == 'flipkart':
+        return {
+            'get_filters': lambda page, i: site_scraper.get_filters(page, base_url, query, use_cache=False),
+            'get_pro_links': lambda page, i: site_scraper.search_pro_links(page, base_url, query, None),
+            'get_product_page': lambda page, i: site_scraper.get_product_page(product_urls[i % len(product_urls)], page, use_cache=False),
+            'get_filtered_products': lambda page, i: site_scraper.get_filtered_products(page, base_url, query, None, top_k=top_k, use_cache=False),
+        }
+    adapter = FixtureAdapter('fixture', base_url)
+
+    async def filtered_products(page: Any, i: int) -> List[Any]:
+        links = await adapter.search(page, query)
+        return await site_scraper.fetch_product_pages(page.context, links[:top_k], fetch_page=adapter.get_product, use_cache=False)
+
+    return {
+        'get_filters': lambda page, i: adapter.get_filters(page, query),
+        'get_pro_links': lambda page, i: adapter.search(page, query),
+        'get_product_page': lambda page, i: adapter.get_product(product_urls[i % len(product_urls)], page, use_cache=False),
+        'get_filtered_products': filtered_products,
+    }
+
+async def sample_rss(peak: Dict[str, float]) -> None:
+    while True:
+        peak['rss'] = max(peak['rss'], chromium_rss() or 0.0)
+        await asyncio.sleep(RSS_INTERVAL)
+
+async def run_op(name: str, op: Callable, iterations: int, acquire: Callable, concurrency: int) -> Dict[str, Any]:
+    """Run `op` `iterations` times, `concurrency` at a time, each on a page from `acquire`"""
+    timings, empty = [], 0
+    peak = {'rss': 0.0}
+    sampler = asyncio.create_task(sample_rss(peak))
+    gate = asyncio.Semaphore(concurrency)
+
+    async def once(i: int) -> None:
+        nonlocal empty
+        async with gate, acquire() as page:
+            start = time.perf_counter()
+            result = await op(page, i)
+            timings.append(time.perf_counter() - start)
+            empty += not result
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(once(i) for i in range(iterations)))
+    finally:
+        sampler.cancel()
+    wall = time.perf_counter() - start
+    return {'op': name, 'n': len(timings), 'empty': empty, 'p50': percentile(timings, 0.5), 'p95': percentile(timings, 0.95),
+            'throughput': len(timings) / wall if wall else 0.0, 'rss_mib': peak['rss']}
+
+async def bench(site: str, root: str, modes: List[str], iterations: int, concurrency: int, top_k: int) -> List[Dict[str, Any]]:
+    results = []
+    with FixtureServer(root=root) as server:
+        base_url = server.base_url
+        query = server.manifest.get('query', QUERY)
+        if site == 'flipkart':
+            product_urls = [base_url + route for route in server.routes if route != '/search']
+        else:
+            product_urls = [f'{base_url}/p/{name[:-5]}' for name in sorted(os.listdir(os.path.join(root, 'products')))]
+        ops = workload(site, base_url, query, product_urls, top_k)
+
+        if 'single' in modes:
+            # the original setup: one browser, one context, one page, one thing at a time
+            context_man, playwright, browser, context, page = await site_scraper.playwright_enter()
+
+            class SinglePage:
+                async def __aenter__(self):
+                    return page
+
+                async def __aexit__(self, *exc):
+                    return False
+
+            try:
+                for name, op in ops.items():
+                    results.append({'mode': 'single', **await run_op(name, op, iterations, SinglePage, 1)})
+            finally:
+                await site_scraper.playwright_exit(context_man)
+
+        if 'pooled' in modes:
+            pool = BrowserPool(max_leases=concurrency)
+
+            class PooledPage:
+                async def __aenter__(self):
+                    self.lease = await pool.acquire()
+                    return self.lease.page
+
+                async def __aexit__(self, *exc):
+                    await self.lease.release()
+                    return False
+
+            try:
+                for name, op in ops.items():
+                    results.append({'mode': 'pooled', **await run_op(name, op, iterations, PooledPage, concurrency)})
+            finally:
+                await pool.close()
+    return results
+
+def report(results: List[Dict[str, Any]], baseline: Optional[List[Dict[str, Any]]] = None) -> bool:
+    """Print the results (& the change against a baseline run) - False when an operation regressed"""
+    old = {(r['mode'], r['op']): r for r in baseline or []}
+    ok = True
+    print(f"{'mode':<7} {'operation':<22} {'n':>4} {'empty':>5} {'p50 ms':>9} {'p95 ms':>9} {'ops/s':>7} {'rss MiB':>8}  vs baseline")
+    for r in results:
+        change = ''
+        if (r['mode'], r['op']) in old and old[(r['mode'], r['op'])]['p50']:
+            ratio = r['p50'] / old[(r['mode'], r['op'])]['p50']
+            change = f'x{ratio:.2f}' + (' REGRESSION' if ratio > REGRESSION else '')
+            ok &= ratio <= REGRESSION
+        print(f"{r['mode']:<7} {r['op']:<22} {r['n']:>4} {r['empty']:>5} {r['p50'] * 1e3:>9.1f} {r['p95'] * 1e3:>9.1f} "
+              f"{r['throughput']:>7.2f} {r['rss_mib']:>8.0f}  {change}")
+    return ok
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Offline scraper benchmark against recorded pages')
+    parser.add_argument('command', choices=['record', 'run'])
+    parser.add_argument('--query', default=QUERY, help='record: search query to snapshot')
+    parser.add_argument('--site', choices=['auto', 'flipkart', 'fixture'], default='auto',
+                        help='flipkart: recorded snapshots, fixture: fixtures/site, auto: snapshots when recorded')
+    parser.add_argument('--snapshots', default=SNAPSHOT_DIR)
+    parser.add_argument('--modes', default='single,pooled')
+    parser.add_argument('--iterations', type=int, default=ITERATIONS)
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--top-k', type=int, default=PRODUCTS)
+    parser.add_argument('--save', help='write the results as json')
+    parser.add_argument('--baseline', help='json of an earlier run to compare p50s against')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        asyncio.run(record(args.query, args.top_k, args.snapshots))
+        return
+    site = args.site
+    if site == 'auto':
+        site = 'flipkart' if os.path.exists(os.path.join(args.snapshots, 'manifest.json')) else 'fixture'
+    root = args.snapshots if site == 'flipkart' else FIXTURE_DIR
+    results = asyncio.run(bench(site, root, args.modes.split(','), args.iterations, args.concurrency, args.top_k))
+    print(f'site: {site} ({root})')
+    baseline = json.load(open(args.baseline)) if args.baseline else None
+    ok = report(results, baseline)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
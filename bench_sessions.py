@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+import tracemalloc
+import logging
+
+# the agents are only built here, never run - no real key needed
+os.environ.setdefault('GOOGLE_API_KEY', 'bench')
+from pydantic_ai_agents import Chatbot, build_agents, get_agents
+
+logging.disable(logging.INFO)
+
+SESSIONS = 200
+
+def old_session():
+    """What a connection cost before: both agents & all their tools rebuilt for every Chatbot"""
+    return build_agents(), Chatbot.CoachChatbot()
+
+def new_session():
+    return Chatbot()
+
+def bench(name: str, make_session, sessions: int) -> None:
+    timings = []
+    alive = []
+    for _ in range(sessions):
+        start = time.perf_counter()
+        alive.append(make_session())
+        timings.append(time.perf_counter() - start)
+    # memory in a separate pass - tracing slows the setup down
+    alive.clear()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(sessions):
+        alive.append(make_session())
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    timings.sort()
+    print(f'{name:<8} setup p50 {timings[len(timings) // 2] * 1e3:8.3f} ms  p95 {timings[int(len(timings) * 0.95)] * 1e3:8.3f} ms  '
+          f'memory {used / sessions / 1024:8.1f} KiB/session  ({sessions} sessions)')
+
+if __name__ == '__main__':
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else SESSIONS
+    bench('before', old_session, sessions)
+    get_agents()    # built once per process, outside the measurement
+    bench('after', new_session, sessions)
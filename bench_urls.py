@@ -0,0 +1,79 @@
+import sys
+import time
+import random
+import logging
+from typing import List, Dict, Any, Callable, Optional
+from urllib.parse import urlsplit, parse_qs
+from product_urls import product_key, is_product_link, product_links
+
+logging.disable(logging.INFO)
+
+SIZES = (1000, 10000, 100000)
+LIST_MAX = 20000        # the list dedup is quadratic, skipped above this many links
+REPEAT = 3              # best of
+BASE_URL = 'https://www.flipkart.com'
+
+def links(n: int, seed: int = 0) -> List[str]:
+    """Results page hrefs: products recurring across pages & queries with fresh tracking params, plus pagination / facet links"""
+    rng = random.Random(seed)
+    products = max(1, n // 3)
+    hrefs = []
+    for i in range(n):
+        if rng.random() < 0.1:
+            hrefs.append(f'/search?q=phone+{rng.randint(0, 50)}&otracker=search&page={rng.randint(2, 40)}')
+            continue
+        p = rng.randrange(products)
+        hrefs.append(f'/phone-{p}-black-128-gb/p/itm{p:013x}?pid=MOB{p:013X}&lid=LSTMOB{p:013X}{rng.randint(0, 9)}&marketplace=FLIPKART'
+                     f'&q=phone&store=tyy%2F4io&srno=s_{rng.randint(1, 40)}_{rng.randint(1, 24)}&otracker=search&fm=Search'
+                     f'&iid={rng.getrandbits(64):016x}.MOB{p:013X}.SEARCH&ppt=sp&ppn=sp&ssid={rng.getrandbits(60):015x}&qH={rng.getrandbits(64):016x}')
+    return hrefs
+
+def list_links(base_url: str, hrefs: List[Optional[str]]) -> List[str]:
+    """The previous get_pro_links: length heuristic & a `not in` scan of the list per link, keyed on the full url"""
+    out = []
+    for link in hrefs:
+        if link and 'page=' not in link and 'search?' not in link and len(link) > 150:
+            link = base_url + link
+            if link not in out:
+                out.append(link)
+    return out[1:]
+
+def parse_qs_key(url: str) -> str:
+    """The previous product_id / canonical_url pair, on urlsplit + parse_qs (no site in the key)"""
+    parts = urlsplit(url.strip())
+    pid = parse_qs(parts.query).get('pid')
+    if pid and pid[0]:
+        return f'pid:{pid[0].upper()}'
+    for segment in parts.path.split('/'):
+        if segment.startswith('itm') and len(segment) > 3:
+            return f'itm:{segment}'
+    return parts.path
+
+def best(fn: Callable, repeat: int = REPEAT) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def bench(n: int) -> None:
+    hrefs = links(n)
+    absolute = [BASE_URL + href for href in hrefs]
+    distinct = product_links(BASE_URL, hrefs)
+    assert len(distinct) == len({product_key(url) for url in absolute if is_product_link(url)})
+    rows = [
+        ('keys', 'urlsplit + parse_qs', best(lambda: [parse_qs_key(url) for url in absolute])),
+        ('keys', 'product_key', best(lambda: [product_key(url) for url in absolute])),
+        ('dedup', 'ProductIndex (product_links)', best(lambda: product_links(BASE_URL, hrefs))),
+    ]
+    if n <= LIST_MAX:
+        previous = list_links(BASE_URL, hrefs)
+        rows.append(('dedup', f'list scan ({len(previous)} "distinct")', best(lambda: list_links(BASE_URL, hrefs), 1)))
+    print(f'{n} links, {len(distinct)} distinct products')
+    for stage, path, seconds in rows:
+        print(f'  {stage:<6} {path:<32} {seconds * 1e3:10.1f} ms  {seconds / n * 1e6:8.2f} us/link')
+
+if __name__ == '__main__':
+    for n in [int(arg) for arg in sys.argv[1:]] or SIZES:
+        bench(n)
@@ -0,0 +1,347 @@
+import asyncio
+import time
+import weakref
+import logging
+import sys
+from contextlib import asynccontextmanager
+from typing import List, Optional, Dict, Any, Iterable
+from collections import Counter
+from urllib.parse import urlsplit
+from playwright.async_api import async_playwright
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BROWSER_ARGS = ["--no-sandbox", "--disable-setuid-sandbox", "--disable-dev-shm-usage"]
+DEFAULT_TIMEOUT = 15000         # ms, for all waits & navigations
+MAX_LEASES = 4                  # max concurrently leased contexts
+IDLE_TTL = 300.0                # s, idle contexts (and finally the browser) are closed after this
+MAX_HOLD = 600.0                # s, leases held longer than this are treated as leaked & reclaimed
+MAX_USES = 50                   # contexts are recycled after this many leases
+REAP_INTERVAL = 30.0            # s
+HEALTH_TIMEOUT = 2.0            # s
+# the scraper only reads text & attributes (img src), never the rendered pixels
+BLOCK_RESOURCE_TYPES = ('image', 'media', 'font')
+DENY_DOMAINS = (
+    'google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'googlesyndication.com', 'adservice.google.com',
+    'facebook.net', 'facebook.com', 'hotjar.com', 'clarity.ms', 'criteo.com', 'criteo.net', 'branch.io', 'sentry.io',
+)
+
+class RequestPolicy:
+    """Request interception for pooled contexts: block by resource type & domain, count blocked requests per navigation
+    - allow_domains (optional): when set, every other third party domain is blocked too
+    """
+
+    def __init__(self, block_types: Iterable[str] = BLOCK_RESOURCE_TYPES, deny_domains: Iterable[str] = DENY_DOMAINS,
+                 allow_domains: Optional[Iterable[str]] = None):
+        self.block_types = set(block_types)
+        self.deny_domains = tuple(deny_domains)
+        self.allow_domains = tuple(allow_domains) if allow_domains else None
+        self.blocked = Counter()
+        self.allowed = 0
+        self.navigations = 0
+        self.navigation_blocked = 0
+        # page -> blocked requests of its current navigation, weak so closed & collected pages drop out
+        self._per_page: 'weakref.WeakKeyDictionary[Any, int]' = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def _matches(host: str, domains: Iterable[str]) -> bool:
+        return any(host == d or host.endswith('.' + d) for d in domains)
+
+    def should_block(self, url: str, resource_type: str) -> Optional[str]:
+        """Reason for blocking the request or None"""
+        if resource_type in self.block_types:
+            return resource_type
+        host = (urlsplit(url).hostname or '').lower()
+        if not host:
+            return None
+        if self._matches(host, self.deny_domains):
+            return 'denied_domain'
+        if self.allow_domains and not self._matches(host, self.allow_domains):
+            return 'not_allowed_domain'
+        return None
+
+    async def handle(self, route: Any) -> None:
+        request = route.request
+        reason = self.should_block(request.url, request.resource_type)
+        if reason:
+            self.blocked[reason] += 1
+            try:
+                page = request.frame.page
+            except Exception:
+                page = None
+            if page is not None and page in self._per_page:
+                self._per_page[page] += 1
+                self.navigation_blocked += 1
+            await route.abort()
+        else:
+            self.allowed += 1
+            await route.continue_()
+
+    def begin(self, page: Any) -> None:
+        """Start counting the blocked requests of a new navigation of the page"""
+        self.navigations += 1
+        self._per_page[page] = 0
+
+    def blocked_on(self, page: Any) -> int:
+        """Blocked requests of the page's current navigation so far"""
+        return self._per_page.get(page, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'blocked': dict(self.blocked), 'blocked_total': sum(self.blocked.values()), 'allowed': self.allowed,
+                'navigations': self.navigations,
+                'blocked_per_navigation': self.navigation_blocked / self.navigations if self.navigations else 0.0}
+
+class LeaseReclaimed(RuntimeError):
+    """The lease was held past MAX_HOLD & its context closed by the pool"""
+
+class BrowserLease:
+    """A reusable BrowserContext/Page pair handed out by the BrowserPool
+    - once reclaimed by the pool, `page` & `context` raise LeaseReclaimed instead of failing inside playwright
+    """
+
+    def __init__(self, pool: 'BrowserPool', context: Any, page: Any):
+        self.pool = pool
+        self._context = context
+        self._page = page
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.acquired_at: Optional[float] = None
+        self.uses = 0
+        self.active = False
+        self.reclaimed = False
+
+    @property
+    def context(self) -> Any:
+        if self.reclaimed:
+            raise LeaseReclaimed(f'{self} was reclaimed after {self.pool.max_hold}s')
+        return self._context
+
+    @property
+    def page(self) -> Any:
+        if self.reclaimed:
+            raise LeaseReclaimed(f'{self} was reclaimed after {self.pool.max_hold}s')
+        return self._page
+
+    async def release(self) -> None:
+        await self.pool.release(self)
+
+    def __repr__(self) -> str:
+        return f'BrowserLease(uses={self.uses}, active={self.active}, reclaimed={self.reclaimed})'
+
+class BrowserPool:
+    """Process-wide pool: one long lived Playwright & Browser, a bounded set of reusable leases"""
+
+    def __init__(self, max_leases: int = MAX_LEASES, idle_ttl: float = IDLE_TTL, max_hold: float = MAX_HOLD,
+                 max_uses: int = MAX_USES, headless: bool = True, reap_interval: float = REAP_INTERVAL,
+                 policy: Optional[RequestPolicy] = None):
+        self.max_leases = max_leases
+        self.idle_ttl = idle_ttl
+        self.max_hold = max_hold
+        self.max_uses = max_uses
+        self.headless = headless
+        self.reap_interval = reap_interval
+        self.policy = policy if policy is not None else RequestPolicy()
+        self._sem = asyncio.Semaphore(max_leases)
+        self._lock = asyncio.Lock()
+        self._idle: List[BrowserLease] = []
+        self._active: set[BrowserLease] = set()
+        self._pending = 0       # acquires past the semaphore that don't hold their lease yet - the browser must stay up for them
+        self._context_man: Any = None
+        self._playwright: Any = None
+        self._browser: Any = None
+        self._reaper: Optional[asyncio.Task] = None
+        self._last_activity = time.monotonic()
+        self.launches = 0
+        self.recycled = 0       # unhealthy or worn out contexts replaced - idle evictions & shutdowns are not recycles
+        self.reclaimed = 0
+        self.evicted = 0
+
+    @property
+    def browser(self) -> Any:
+        return self._browser
+
+    async def start(self) -> None:
+        async with self._lock:
+            if self._browser and self._browser.is_connected():
+                return
+            if self._context_man:
+                await self._shutdown()
+            self._context_man = async_playwright()
+            self._playwright = await self._context_man.__aenter__()
+            self._browser = await self._playwright.chromium.launch(headless=self.headless, args=BROWSER_ARGS)
+            self.launches += 1
+            logger.info(f'Browser pool launched chromium (launch #{self.launches})')
+            if not self._reaper or self._reaper.done():
+                self._reaper = asyncio.create_task(self._reap())
+
+    async def acquire(self, timeout: Optional[float] = None) -> BrowserLease:
+        """Wait for a free slot & hand out a healthy lease"""
+        if timeout:
+            await asyncio.wait_for(self._sem.acquire(), timeout)
+        else:
+            await self._sem.acquire()
+        self._pending += 1
+        try:
+            await self.start()
+            lease = None
+            while self._idle:
+                candidate = self._idle.pop()
+                if await self._is_healthy(candidate):
+                    lease = candidate
+                    break
+                self.recycled += 1
+                await self._discard(candidate)
+            if lease is None:
+                lease = await self._new_lease()
+        except BaseException:
+            self._sem.release()
+            raise
+        finally:
+            self._pending -= 1
+        lease.active = True
+        lease.uses += 1
+        lease.acquired_at = lease.last_used = self._last_activity = time.monotonic()
+        self._active.add(lease)
+        return lease
+
+    async def release(self, lease: BrowserLease) -> None:
+        """Return a lease to the pool - unhealthy or worn out contexts are recycled"""
+        if not lease.active:
+            if lease.reclaimed:
+                logger.info(f'Release of reclaimed lease {lease} ignored')
+            return
+        lease.active = False
+        self._active.discard(lease)
+        lease.last_used = self._last_activity = time.monotonic()
+        try:
+            if lease.uses < self.max_uses and await self._is_healthy(lease):
+                await self._close_leaked_pages(lease)
+                self._idle.append(lease)
+            else:
+                self.recycled += 1
+                await self._discard(lease)
+        finally:
+            self._sem.release()
+
+    @asynccontextmanager
+    async def lease(self, timeout: Optional[float] = None):
+        lease = await self.acquire(timeout)
+        try:
+            yield lease
+        finally:
+            await self.release(lease)
+
+    async def close(self) -> None:
+        if self._reaper:
+            self._reaper.cancel()
+            self._reaper = None
+        async with self._lock:
+            await self._shutdown()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'max_leases': self.max_leases,
+            'active': len(self._active),
+            'idle': len(self._idle),
+            'launches': self.launches,
+            'recycled': self.recycled,
+            'reclaimed': self.reclaimed,
+            'evicted': self.evicted,
+            'requests': self.policy.stats() if self.policy else None,
+        }
+
+    async def _new_lease(self) -> BrowserLease:
+        context = await self._browser.new_context()
+        if self.policy:
+            await context.route('**/*', self.policy.handle)
+        page = await context.new_page()
+        page.set_default_timeout(DEFAULT_TIMEOUT)
+        page.set_default_navigation_timeout(DEFAULT_TIMEOUT)
+        return BrowserLease(self, context, page)
+
+    async def _is_healthy(self, lease: BrowserLease) -> bool:
+        try:
+            if not (self._browser and self._browser.is_connected()) or lease._page.is_closed():
+                return False
+            await asyncio.wait_for(lease._page.evaluate('1'), HEALTH_TIMEOUT)
+            return True
+        except Exception as e:
+            logger.info(f'Unhealthy lease {lease}: {e}')
+            return False
+
+    async def _close_leaked_pages(self, lease: BrowserLease) -> None:
+        for page in list(lease._context.pages):
+            if page is not lease._page:
+                try:
+                    await page.close()
+                except Exception as e:
+                    logger.error(f'Could not close leaked page: {e}')
+
+    async def _discard(self, lease: BrowserLease) -> None:
+        try:
+            await lease._context.close()
+        except Exception as e:
+            logger.info(f'Context already gone: {e}')
+
+    async def _reap(self) -> None:
+        """Evict idle contexts, reclaim leaked leases & shut the browser down when nobody uses it"""
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                now = time.monotonic()
+                for lease in list(self._active):
+                    if lease.acquired_at and now - lease.acquired_at > self.max_hold:
+                        logger.error(f'Reclaiming leaked lease {lease}')
+                        await self._reclaim(lease)
+                for lease in list(self._idle):
+                    if now - lease.last_used > self.idle_ttl:
+                        self._idle.remove(lease)
+                        self.evicted += 1
+                        await self._discard(lease)
+                if self._unused(now):
+                    async with self._lock:
+                        # re-checked under the start() lock: an acquire may have come in meanwhile
+                        if self._unused(time.monotonic()):
+                            logger.info('Browser pool idle, closing chromium')
+                            self._reaper = None
+                            await self._shutdown()
+                            return
+            except Exception as e:
+                logger.error(f'Browser pool reaper oopsie: {e}')
+
+    def _unused(self, now: float) -> bool:
+        return (not self._active and not self._idle and not self._pending and self._browser is not None
+                and now - self._last_activity > self.idle_ttl)
+
+    async def _reclaim(self, lease: BrowserLease) -> None:
+        """Take a leaked lease back: its context is closed & the holder's later page use / release fail cleanly"""
+        lease.active = False
+        lease.reclaimed = True
+        self._active.discard(lease)
+        self.reclaimed += 1
+        try:
+            await self._discard(lease)
+        finally:
+            self._sem.release()
+
+    async def _shutdown(self) -> None:
+        for lease in self._idle:
+            await self._discard(lease)
+        self._idle.clear()
+        try:
+            if self._browser:
+                await self._browser.close()
+            if self._context_man:
+                await self._context_man.__aexit__(None, None, None)
+        except Exception as e:
+            logger.error(f'Error while closing browser pool: {e}')
+        self._context_man, self._playwright, self._browser = None, None, None
+
+_pool: Optional[BrowserPool] = None
+
+def get_browser_pool() -> BrowserPool:
+    global _pool
+    if _pool is None:
+        _pool = BrowserPool()
+    return _pool
@@ -0,0 +1,111 @@
+import os
+import asyncio
+import logging
+import sys
+from typing import Optional, Dict, Any, Tuple, Callable
+from product_urls import ProductIndex
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CANDIDATE_BUDGET = int(os.environ.get('SHOP_CANDIDATE_BUDGET', 40))     # product links one search may fetch, all sites & result pages together
+
+POOL_STATS = {'offered': 0, 'duplicates': 0, 'over_budget': 0, 'passed': 0, 'rejected': 0, 'surplus': 0, 'early_stops': 0}
+
+def pool_stats() -> Dict[str, Any]:
+    return dict(POOL_STATS)
+
+class CandidateBudget:
+    """Product links a whole search may fetch - shared by every site & result page, one link per product id"""
+
+    def __init__(self, budget: int = CANDIDATE_BUDGET):
+        self.budget = budget
+        self.taken = 0
+        self.index = ProductIndex()
+
+    @property
+    def exhausted(self) -> bool:
+        return self.taken >= self.budget
+
+    def take(self, link: str) -> bool:
+        if link in self.index:
+            POOL_STATS['duplicates'] += 1
+            return False
+        if self.exhausted:
+            POOL_STATS['over_budget'] += 1
+            return False
+        self.index.add(link)
+        self.taken += 1
+        return True
+
+class CandidatePool:
+    """One site's stream of candidate links: result pages offer() links as they are read, product fetch workers next() them
+    - links are deduplicated by product id & counted against the (shared) budget
+    - once `wanted` products passed (accept()), workers stop taking links & crawlers stop reading pages; products of fetches
+      still in flight then are surplus & not accepted, so a pool never yields more than `wanted`
+    - passes (optional): `(product) -> bool`, products failing it don't count
+    """
+
+    def __init__(self, wanted: int, budget: Optional[CandidateBudget] = None, passes: Optional[Callable] = None):
+        self.wanted = wanted
+        self.budget = budget or CandidateBudget()
+        self.passes = passes
+        self.offered = 0
+        self.passed = 0
+        self.closed = False
+        self._links: asyncio.Queue = asyncio.Queue()
+        self._changed = asyncio.Event()
+
+    @property
+    def enough(self) -> bool:
+        return self.passed >= self.wanted
+
+    @property
+    def stopped(self) -> bool:
+        """Nothing more worth offering"""
+        return self.enough or self.budget.exhausted
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def offer(self, link: str) -> bool:
+        if self.enough or not self.budget.take(link):
+            return False
+        self._links.put_nowait((self.offered, link))
+        self.offered += 1
+        POOL_STATS['offered'] += 1
+        self._notify()
+        return True
+
+    def close(self) -> None:
+        """No more links are coming"""
+        self.closed = True
+        self._notify()
+
+    def accept(self, product: Any) -> bool:
+        """Count a fetched product - False when it fails `passes` or the pool already has `wanted` products"""
+        if self.enough:
+            POOL_STATS['surplus'] += 1
+            return False
+        if self.passes and not self.passes(product):
+            POOL_STATS['rejected'] += 1
+            return False
+        self.passed += 1
+        POOL_STATS['passed'] += 1
+        if self.passed == self.wanted and (not self.closed or not self._links.empty()):
+            POOL_STATS['early_stops'] += 1
+            logger.info(f'{self.wanted} candidates found after {self.offered} links, stopping early')
+        self._notify()
+        return True
+
+    async def next(self) -> Optional[Tuple[int, str]]:
+        """(offer index, link) to fetch next - None once there are enough products or no more links will come"""
+        while True:
+            if self.enough:
+                return None
+            if not self._links.empty():
+                return self._links.get_nowait()
+            if self.closed:
+                return None
+            await self._changed.wait()
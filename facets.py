@@ -0,0 +1,220 @@
+import time
+import logging
+import sys
+from urllib.parse import urlsplit, parse_qsl, urlencode, quote_plus
+from typing import List, Optional, Dict, Any, Tuple
+from pydantic_models import UserFilter
+from waits import section_expanded, option_ready, grid_signature, network, results_settled, EXPANDED_SELECTOR
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Sidebar filter name -> flipkart `facets.<key>[]` url parameter. Other filters get their key learned from one click (learn_facet_key)
+FACET_PARAM_KEYS = {
+    'BRAND': 'brand',
+    'RAM': 'ram',
+    'INTERNAL STORAGE': 'internal_storage',
+    'CUSTOMER RATINGS': 'rating',
+    'SIM TYPE': 'type',
+    'NETWORK TYPE': 'network_type',
+    'OPERATING SYSTEM': 'operating_system',
+    'PROCESSOR BRAND': 'processor_brand',
+    'SCREEN SIZE': 'screen_size',
+    'PRIMARY CAMERA': 'primary_camera',
+    'SECONDARY CAMERA': 'secondary_camera',
+    'BATTERY CAPACITY': 'battery_capacity',
+    'DISCOUNT': 'discount_range_v1',
+    'COLOR': 'color',
+    'COLOUR': 'color',
+    'SIZE': 'size',
+    'IDEAL FOR': 'ideal_for',
+}
+LEARNED_FACET_KEYS: Dict[str, str] = {}     # filter name -> key, learned this process
+FAILED_FACET_KEYS: Dict[str, float] = {}    # filter name -> when learning its key last failed (negative cache)
+FACET_LEARN_RETRY = 6 * 3600.0              # s, a filter whose key could not be learned is clicked instead until then
+FACET_STATS = {'applied': 0, 'reloads': 0, 'learned': 0, 'learn_failed': 0, 'clicked': 0, 'reclicked': 0, 'verified': 0, 'missing': 0}
+
+SECTION_SELECTOR = 'section._2OLUF3'
+SECTION_NAME_SELECTOR = 'div.fxf7w6.rgHxCQ'
+SECTION_TOGGLE_SELECTOR = 'svg.ukzDZP'
+OPTION_SELECTOR = 'div.ewzVkT._3DvUAf'
+
+# one round trip: click every wanted, unchecked option of the (expanded) sections - {name: [values]}
+CLICK_OPTIONS_JS = """
+([sections, nameSel, optionSel, wanted]) => {
+    const clicked = [];
+    for (const section of document.querySelectorAll(sections)) {
+        const name = (section.querySelector(nameSel)?.innerText || '').trim().toUpperCase();
+        const values = (wanted[name] || []).map(v => v.toLowerCase());
+        for (const option of section.querySelectorAll(optionSel)) {
+            const label = (option.innerText || '').trim();
+            const box = option.querySelector('input[type=checkbox]');
+            if (values.includes(label.toLowerCase()) && !(box && box.checked)) {
+                (box || option).click();
+                clicked.push([name, label]);
+            }
+        }
+    }
+    return clicked;
+}
+"""
+# selected options per section from the page state - {name: [labels]}
+CHECKED_OPTIONS_JS = """
+([sections, nameSel, optionSel]) => {
+    const checked = {};
+    for (const section of document.querySelectorAll(sections)) {
+        const name = (section.querySelector(nameSel)?.innerText || '').trim().toUpperCase();
+        for (const option of section.querySelectorAll(optionSel)) {
+            const box = option.querySelector('input[type=checkbox]');
+            if (box && box.checked) {
+                (checked[name] = checked[name] || []).push((option.innerText || '').trim());
+            }
+        }
+    }
+    return checked;
+}
+"""
+
+def facet_stats() -> Dict[str, Any]:
+    return {**FACET_STATS, 'learned_keys': dict(LEARNED_FACET_KEYS), 'unlearnable': sorted(FAILED_FACET_KEYS)}
+
+def learnable(name: str) -> bool:
+    """Whether learning the filter's key is worth a click - not after a recent failure"""
+    failed = FAILED_FACET_KEYS.get(name.strip().upper())
+    return failed is None or time.time() - failed > FACET_LEARN_RETRY
+
+def facet_key(name: str) -> Optional[str]:
+    name = name.strip().upper()
+    return FACET_PARAM_KEYS.get(name) or LEARNED_FACET_KEYS.get(name)
+
+def url_facets(url: str) -> Dict[str, List[str]]:
+    """Facets applied by a search url: key -> values (the `p[]=facets.<key>[]=<value>` parameters)"""
+    facets: Dict[str, List[str]] = {}
+    for name, param in parse_qsl(urlsplit(url).query):
+        if name != 'p[]' or not param.startswith('facets.'):
+            continue
+        for facet, value in parse_qsl(param):
+            key = facet[len('facets.'):].removesuffix('[]')
+            facets.setdefault(key, []).append(value)
+    return facets
+
+class FacetPlan:
+    """The final facet set for a search, computed before the page is touched
+    - params: url facet parameters for every filter with a known key
+    - unmapped: filters without a key, to learn or click
+    - learnable: the unmapped filters whose key learning didn't fail recently
+    """
+
+    def __init__(self, user_filters: List[UserFilter] | None = None):
+        self.filters = [f for f in user_filters or [] if f.selection]
+        self.params: List[Tuple[str, str]] = []
+        self.unmapped: List[UserFilter] = []
+        for user_filter in self.filters:
+            key = facet_key(user_filter.name)
+            if not key:
+                self.unmapped.append(user_filter)
+                continue
+            for value in user_filter.selection:
+                self.params.append(('p[]', f'facets.{key}%5B%5D={quote_plus(value)}'))
+        self.learnable = [f for f in self.unmapped if learnable(f.name)]
+
+    def url(self, base_url: str, search_query: str) -> str:
+        return f"{base_url.rstrip('/')}/search?{urlencode([('q', search_query)] + self.params)}"
+
+    def wanted(self) -> Dict[str, List[str]]:
+        return {f.name.strip().upper(): list(f.selection) for f in self.filters}
+
+    def in_url(self, url: str) -> bool:
+        """Whether the url already carries every keyed facet of the plan (e.g. after learning clicks applied them)"""
+        have = {key: {value.lower() for value in values} for key, values in url_facets(url).items()}
+        for user_filter in self.filters:
+            key = facet_key(user_filter.name)
+            if key and any(value.lower() not in have.get(key, set()) for value in user_filter.selection):
+                return False
+        return True
+
+async def find_section(page: Any, name: str) -> Optional[Any]:
+    """The sidebar section of a filter, expanded"""
+    sections = page.locator(SECTION_SELECTOR)
+    for i in range(await sections.count()):
+        section = sections.nth(i)
+        label = section.locator(SECTION_NAME_SELECTOR)
+        if await label.count() < 1 or (await label.first.inner_text()).strip().upper() != name.strip().upper():
+            continue
+        if await section.locator(EXPANDED_SELECTOR).count() < 1:
+            await section.locator(SECTION_TOGGLE_SELECTOR).first.click()
+            await section_expanded(section)
+        return section
+    return None
+
+def _learn_failed(user_filter: UserFilter) -> None:
+    FAILED_FACET_KEYS[user_filter.name.strip().upper()] = time.time()
+    FACET_STATS['learn_failed'] += 1
+    logger.info(f'No facet key for {user_filter.name}, clicking it for the next {FACET_LEARN_RETRY / 3600:.0f}h')
+
+async def learn_facet_key(page: Any, user_filter: UserFilter) -> Optional[str]:
+    """Click one wanted option of a filter & read its facet key off the url change - one reload, once per filter name & process
+    - a failure is remembered (FAILED_FACET_KEYS), so later searches click the filter right away instead of trying again
+    """
+    section = await find_section(page, user_filter.name)
+    if section is None:
+        _learn_failed(user_filter)
+        return None
+    for wanted in user_filter.selection or []:
+        option = section.locator(OPTION_SELECTOR, has_text=wanted).first
+        if not await option_ready(option):
+            continue
+        before_facets = url_facets(page.url)
+        before, started = await grid_signature(page), network(page).mark()
+        await option.click()
+        await results_settled(page, before, started)
+        FACET_STATS['reloads'] += 1
+        new_keys = [key for key in url_facets(page.url) if key not in before_facets]
+        if len(new_keys) == 1:
+            LEARNED_FACET_KEYS[user_filter.name.strip().upper()] = new_keys[0]
+            FACET_STATS['learned'] += 1
+            logger.info(f'Learned facet key {new_keys[0]} for {user_filter.name}')
+            return new_keys[0]
+        break
+    _learn_failed(user_filter)
+    return None
+
+async def click_batch(page: Any, user_filters: List[UserFilter]) -> List[List[str]]:
+    """Expand the filters' sections, click all their wanted options in one evaluate & wait for the results once"""
+    for user_filter in user_filters:
+        await find_section(page, user_filter.name)
+    wanted = {f.name.strip().upper(): list(f.selection or []) for f in user_filters}
+    before, started = await grid_signature(page), network(page).mark()
+    clicked = await page.evaluate(CLICK_OPTIONS_JS, [SECTION_SELECTOR, SECTION_NAME_SELECTOR, OPTION_SELECTOR, wanted])
+    if clicked:
+        await results_settled(page, before, started)
+        FACET_STATS['reloads'] += 1
+        FACET_STATS['clicked'] += len(clicked)
+    return clicked
+
+async def applied_facets(page: Any, plan: FacetPlan) -> Dict[str, Any]:
+    """Check the plan against the page state: url facets for keyed filters, checked options for the rest"""
+    in_url = {key: {value.lower() for value in values} for key, values in url_facets(page.url).items()}
+    try:
+        checked = await page.evaluate(CHECKED_OPTIONS_JS, [SECTION_SELECTOR, SECTION_NAME_SELECTOR, OPTION_SELECTOR])
+    except Exception:
+        checked = {}
+    applied, missing = {}, []
+    for name, values in plan.wanted().items():
+        key = facet_key(name)
+        have = in_url.get(key, set()) | {label.lower() for label in checked.get(name, [])}
+        applied[name] = [value for value in values if value.lower() in have]
+        missing += [(name, value) for value in values if value.lower() not in have]
+    FACET_STATS['verified'] += not missing
+    FACET_STATS['missing'] += len(missing)
+    return {'applied': applied, 'missing': missing}
+
+async def reclick_missing(page: Any, plan: FacetPlan, check: Dict[str, Any]) -> Dict[str, Any]:
+    """Click the options the check found missing once more - CLICK_OPTIONS_JS fires all clicks in one tick & the SPA may drop some"""
+    missing: Dict[str, List[str]] = {}
+    for name, value in check['missing']:
+        missing.setdefault(name, []).append(value)
+    retry = [UserFilter(name=f.name, type=f.type, selection=missing[f.name.strip().upper()]) for f in plan.filters if f.name.strip().upper() in missing]
+    clicked = await click_batch(page, retry)
+    FACET_STATS['reclicked'] += len(clicked)
+    return await applied_facets(page, plan) if clicked else check
@@ -0,0 +1,269 @@
+import re
+import math
+from difflib import SequenceMatcher
+from typing import List, Optional, Tuple, Dict, Any
+from pydantic_models import UserFilter
+
+MATCH_CONFIDENCE = 0.75     # answers matched below this are left to the LLM
+FUZZY_CAP = 0.7             # similarity alone never reaches MATCH_CONFIDENCE: 'anything' ~ 'nothing' is no match
+MAX_PROMPT_FILTERS = 8      # filters the user is asked about
+# relevance prior of the filters that decide most purchases (see filter_relevance)
+KEY_FILTERS = {'PRICE': 1.0, 'BRAND': 1.0, 'RAM': 0.5, 'INTERNAL STORAGE': 0.5, 'CUSTOMER RATINGS': 0.5, 'SIZE': 0.5, 'COLOR': 0.25, 'COLOUR': 0.25}
+
+INF = math.inf
+# unit -> (base unit, factor)
+UNITS = {
+    'tb': ('gb', 1024.0), 'gb': ('gb', 1.0), 'mb': ('gb', 1 / 1024), 'kb': ('gb', 1 / 1024 ** 2),
+    'ghz': ('ghz', 1.0), 'mhz': ('ghz', 1 / 1000),
+    'mah': ('mah', 1.0),
+    'mp': ('mp', 1.0),
+    'inch': ('inch', 1.0), 'inches': ('inch', 1.0), 'in': ('inch', 1.0), '"': ('inch', 1.0), 'cm': ('inch', 1 / 2.54),
+    'hz': ('hz', 1.0),
+    'kg': ('kg', 1.0), 'g': ('kg', 1 / 1000),
+    'l': ('l', 1.0), 'litre': ('l', 1.0), 'litres': ('l', 1.0), 'ml': ('l', 1 / 1000),
+    'w': ('w', 1.0), 'ton': ('ton', 1.0),
+    '★': ('★', 1.0), 'star': ('★', 1.0), 'stars': ('★', 1.0),
+    'rs': ('rs', 1.0), '₹': ('rs', 1.0),
+}
+_UNIT_RE = '|'.join(sorted((re.escape(u) for u in UNITS), key=len, reverse=True))
+_NUM = r'(\d+(?:[.,]\d+)*)'
+_LOWER = re.compile(r'\b(?:below|under|less than|upto|up to|max|at most|<)\s*', re.I)
+_UPPER = re.compile(r'(?:\babove\b|\bor more\b|\bplus\b|\bat least\b|\bmin\b|\bminimum\b|>|\+|&\s*above|and above)', re.I)
+_NEGATION = re.compile(r"\b(?:not|no|except|excluding|without|avoid|but|never|don'?t want|do not want)\b", re.I)
+# 'anything but apple': the options other than the rejected ones
+ANY_ANSWERS = {'any', 'anything', 'everything', 'all', 'any brand', 'anyone', 'whatever'}
+# words naming the spec a quantity in a query belongs to ('8gb ram', 'storage 256gb'), beyond the filter names themselves
+SPEC_WORDS = {'ram', 'rom', 'storage', 'memory', 'battery', 'display', 'screen', 'camera', 'processor', 'refresh', 'weight', 'capacity'}
+# spec word -> the filter name token it stands for
+SPEC_SYNONYMS = {'rom': 'storage', 'screen': 'display'}
+# filter name tokens too generic to tie a quantity to the filter
+_GENERIC_NAME_TOKENS = {'size', 'type', 'range', 'capacity', 'and', 'internal'}
+SKIP_ANSWERS = {'', '.', 'skip', 'any', 'all', 'no', 'none', 'no preference', 'dont care', "don't care", 'whatever', 'na', 'n/a'}
+
+def _number(text: str) -> float:
+    return float(text.replace(',', ''))
+
+def _values(text: str) -> List[Tuple[float, Optional[str]]]:
+    """Numbers in the text with their unit converted to the base unit"""
+    values = []
+    for m in re.finditer(_NUM + r'\s*(' + _UNIT_RE + r')?(?![a-z])', text.lower()):
+        value, unit = _number(m.group(1)), m.group(2)
+        if unit:
+            base, factor = UNITS[unit]
+            values.append((value * factor, base))
+        else:
+            values.append((value, None))
+    # '4 - 6 GB': the unit written once applies to every number
+    units = {unit for _, unit in values if unit}
+    if len(units) == 1:
+        unit = units.pop()
+        values = [(value, unit) for value, _ in values]
+    return values
+
+def parse_range(text: str) -> Optional[Tuple[float, float, Optional[str]]]:
+    """Numeric interval of an option or answer: '1.5 - 1.9 GHz', '256 GB & Above', 'Less than 900 MHz', '4★ & above', '8 GB'"""
+    values = _values(text)
+    if not values:
+        return None
+    unit = values[0][1]
+    nums = [value for value, _ in values]
+    if len(nums) >= 2 and re.search(r'\d\s*(?:-|–|to)\s*(?:rs\.?\s*|₹\s*)?\d', text.lower()):
+        return min(nums[:2]), max(nums[:2]), unit
+    if _LOWER.search(text):
+        return -INF, nums[0], unit
+    if _UPPER.search(text):
+        return nums[0], INF, unit
+    return nums[0], nums[0], unit
+
+def _overlaps(a: Tuple[float, float], b: Tuple[float, float]) -> bool:
+    return a[0] <= b[1] and b[0] <= a[1]
+
+def _tightest(matched: Dict[str, Tuple[float, float, Optional[str]]]) -> Dict[str, Tuple[float, float, Optional[str]]]:
+    """For a single value: bounded options containing it, else the narrowest open ended one ('4' -> '4★ & above', not '3★ & above')"""
+    bounded = {o: r for o, r in matched.items() if math.isfinite(r[0]) and math.isfinite(r[1])}
+    if bounded:
+        return bounded
+    upward = {o: r for o, r in matched.items() if math.isinf(r[1])}
+    if upward:
+        best = max(r[0] for r in upward.values())
+        return {o: r for o, r in upward.items() if r[0] == best}
+    best = min(r[1] for r in matched.values())
+    return {o: r for o, r in matched.items() if r[1] == best}
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+def _text_score(answer: str, option: str) -> float:
+    """How well a free text answer names an option: token containment, falling back to fuzzy string similarity"""
+    answer_tokens, option_tokens = set(_tokens(answer)), set(_tokens(option))
+    if not answer_tokens or not option_tokens:
+        return 0.0
+    containment = len(answer_tokens & option_tokens) / len(answer_tokens)
+    fuzzy = SequenceMatcher(None, ' '.join(_tokens(answer)), ' '.join(_tokens(option))).ratio()
+    return max(containment, min(fuzzy, FUZZY_CAP))
+
+def _split_answer(answer: str) -> List[str]:
+    parts = re.split(r'\s*(?:,|/|;|\bor\b|\band\b|\|)\s*', answer.strip())
+    return [part for part in parts if part]
+
+def _match_parts(options: List[str], answer: str) -> Tuple[List[str], float]:
+    """Options named by an answer (no negation) & the confidence of the weakest part"""
+    chosen: List[str] = []
+    confidence = 1.0
+    # keep '1.5 - 1.9 ghz' whole but split 'black, blue' / 'dual sim or single sim'
+    parts = [answer] if re.search(r'\d\s*(?:-|–|to)\s*\d', answer) else _split_answer(answer)
+    for part in parts:
+        wanted = parse_range(part)
+        if wanted and not re.search(r'[a-z]{3,}', re.sub(_UNIT_RE + r'|below|under|less than|above|more|at least|at most|upto|up to|plus|and|or', '', part.lower())):
+            matched = {}
+            for option in options:
+                have = parse_range(option)
+                if have and (not wanted[2] or not have[2] or wanted[2] == have[2]) and _overlaps(wanted[:2], have[:2]):
+                    matched[option] = have
+            if matched and wanted[0] == wanted[1]:
+                matched = _tightest(matched)
+            if matched:
+                chosen += list(matched)
+                confidence = min(confidence, 0.9 if wanted[2] else 0.8)
+                continue
+        scored = sorted(((_text_score(part, option), option) for option in options), reverse=True)
+        best = scored[0][0] if scored else 0.0
+        if best < 0.5:
+            confidence = min(confidence, best)
+            continue
+        chosen += [option for score, option in scored if score >= best - 0.05 and score >= 0.5]
+        confidence = min(confidence, best)
+    return list(dict.fromkeys(chosen)), confidence
+
+def match_answer(user_filter: UserFilter, answer: str) -> Tuple[Optional[UserFilter], float]:
+    """Map a free text answer onto the filter's options
+    - numbers (with optional units & comparators) select every option whose interval overlaps the answer
+    - words select options by token containment / fuzzy similarity
+    - options after a negation ('apple but not samsung', 'anything except apple') are rejected, never selected;
+      'anything but X' selects every other option, an answer that only rejects gets confidence 0 so the LLM decides what it means
+    - similarity alone stays below MATCH_CONFIDENCE (FUZZY_CAP), so near misses go to the LLM
+    Returns the filter narrowed to the matched options (None when nothing matched or the answer means 'skip') & a confidence
+    """
+    answer = (answer or '').strip()
+    options = user_filter.selection or []
+    if answer.lower() in SKIP_ANSWERS or not options:
+        return None, 1.0
+    negation = _NEGATION.search(answer)
+    wanted = answer[:negation.start()].strip(' ,;') if negation else answer
+    if negation:
+        rejected, rejected_confidence = _match_parts(options, answer[negation.end():].strip(' ,;'))
+        if ' '.join(_tokens(wanted)) in ANY_ANSWERS:
+            chosen, confidence = ([o for o in options if o not in rejected], rejected_confidence) if rejected else ([], 0.0)
+        else:
+            chosen, confidence = _match_parts(options, wanted) if wanted else ([], 0.0)
+            chosen = [option for option in chosen if option not in rejected]
+    else:
+        chosen, confidence = _match_parts(options, wanted)
+    if not chosen:
+        return None, 0.0
+    return UserFilter(name=user_filter.name, type=user_filter.type, selection=chosen), confidence
+
+def form_answer(user_filter: UserFilter, answer: Any) -> Tuple[Optional[UserFilter], Optional[str]]:
+    """Map one structured prompt_form answer onto the filter - no LLM parse needed
+    - a list of options (or {'selection': [...]}): the filter narrowed to those of its own options
+    - {'range': [low, high]}: the filter narrowed to its options overlapping the range (facets are applied by option), None when none do
+    - a string is free text: returned as is for match_answer (& the LLM)
+    """
+    if isinstance(answer, str):
+        return None, answer.strip() or None
+    if isinstance(answer, dict) and answer.get('range'):
+        low, high = (list(answer['range']) + [None, None])[:2]
+        if low is None and high is None:
+            return None, None
+        wanted = (-INF if low is None else float(low), INF if high is None else float(high))
+        chosen = [option for option in user_filter.selection or [] if (have := parse_range(option)) and _overlaps(wanted, have[:2])]
+        if not chosen:
+            return None, None
+        return UserFilter(name=user_filter.name, type=user_filter.type, selection=chosen, range=(low, high)), None
+    if isinstance(answer, dict):
+        answer = answer.get('selection')
+    if not isinstance(answer, list):
+        return None, None
+    options = {option.lower(): option for option in user_filter.selection or []}
+    chosen = list(dict.fromkeys(options[value.strip().lower()] for value in answer if isinstance(value, str) and value.strip().lower() in options))
+    if not chosen:
+        return None, None
+    return UserFilter(name=user_filter.name, type=user_filter.type, selection=chosen), None
+
+def _name_words(site_filter: UserFilter) -> set:
+    return {SPEC_SYNONYMS.get(t, t) for t in _tokens(site_filter.name)} - _GENERIC_NAME_TOKENS
+
+def _query_quantities(query: str, spec_words: set) -> List[Tuple[float, str, Optional[str]]]:
+    """Numbers with a unit in the query & the spec word they belong to: '8gb ram' / 'ram 8gb' -> (8.0, 'gb', 'ram'), '256gb' -> (256.0, 'gb', None)
+    - the word after the quantity wins, the word before only counts when no other quantity claims it ('8gb ram 256gb storage')
+    """
+    items = [(m.group(1), m.group(2), None) if m.group(1) else (None, None, m.group(3))
+             for m in re.finditer(_NUM + r'\s*(' + _UNIT_RE + r')?(?![a-z])|([a-z]+)', query.lower())]
+    quantities = []
+    for i, (number, unit, _) in enumerate(items):
+        if number is None or not unit:
+            continue
+        after = items[i + 1][2] if i + 1 < len(items) else None
+        before = items[i - 1][2] if i >= 1 and not (i >= 2 and items[i - 2][0] is not None) else None
+        word = next((SPEC_SYNONYMS.get(w, w) for w in (after, before) if w and w in spec_words), None)
+        base, factor = UNITS[unit]
+        quantities.append((_number(number) * factor, base, word))
+    return quantities
+
+def _covers(site_filter: UserFilter, value: float, unit: str) -> bool:
+    """Whether the filter has an option of that unit containing the value - & the value is inside the range the filter covers ('256gb' is no RAM size)"""
+    ranges = [r for o in site_filter.selection or [] if (r := parse_range(o)) and r[2] == unit]
+    bounds = [b for r in ranges for b in r[:2] if math.isfinite(b)]
+    return bool(bounds) and min(bounds) / 2 <= value <= max(bounds) * 2 and any(r[0] <= value <= r[1] for r in ranges)
+
+def match_query(user_filter: UserFilter, query: str, site_filters: Optional[List[UserFilter]] = None) -> Optional[UserFilter]:
+    """Options the search query already pins down (e.g. 'black' or '256gb' in 'iphone black 256gb')
+    - a quantity only goes to the filter its spec word names ('8gb ram' -> RAM), without one only to the single filter of
+      `site_filters` (default: just this one) that covers it - ambiguous quantities are left for the prompt
+    """
+    options = user_filter.selection or []
+    query_tokens = set(_tokens(query))
+    chosen = [o for o in options if _tokens(o) and set(_tokens(o)) <= query_tokens and not all(t.isdigit() for t in _tokens(o))]
+    site_filters = site_filters or [user_filter]
+    spec_words = SPEC_WORDS.union(*(_name_words(f) for f in site_filters))
+    for value, unit, word in _query_quantities(query, spec_words):
+        if word:
+            if word not in _name_words(user_filter):
+                continue
+        elif [f for f in site_filters if _covers(f, value, unit)] != [user_filter]:
+            continue
+        if not _covers(user_filter, value, unit):
+            continue
+        for option in options:
+            have = parse_range(option)
+            if have and have[2] == unit and have[0] <= value <= have[1]:
+                chosen.append(option)
+    chosen = list(dict.fromkeys(chosen))
+    return UserFilter(name=user_filter.name, type=user_filter.type, selection=chosen) if chosen else None
+
+def filter_relevance(site_filter: UserFilter, query: str) -> float:
+    """How much a filter matters for the query: its name or option words in the query, plus a prior for the filters that decide most purchases"""
+    query_tokens = set(_tokens(query))
+    name_tokens = set(_tokens(site_filter.name))
+    score = 2.0 if name_tokens & query_tokens else 0.0
+    option_hits = [len(set(t) & query_tokens) / len(t) for o in site_filter.selection or [] if (t := [w for w in _tokens(o) if not w.isdigit()])]
+    score += max(option_hits, default=0.0)
+    return score + KEY_FILTERS.get(site_filter.name.strip().upper(), 0.0)
+
+def trim_filters(site_filters: List[UserFilter], query: str, max_filters: int = MAX_PROMPT_FILTERS) -> Tuple[List[UserFilter], List[UserFilter]]:
+    """Filters worth asking the user about & filters the query already answers
+    - filters with a single option are dropped
+    - filters answered by the query are returned as ready to apply user filters instead of being asked
+    - the rest are ranked by filter_relevance (site order breaks ties) & the top `max_filters` are kept
+    """
+    ask, answered = [], []
+    for site_filter in site_filters or []:
+        if not site_filter.selection or len(site_filter.selection) < 2:
+            continue
+        from_query = match_query(site_filter, query, site_filters)
+        if from_query:
+            answered.append(from_query)
+        else:
+            ask.append(site_filter)
+    ask = sorted(ask, key=lambda f: -filter_relevance(f, query))[:max_filters]
+    return ask, answered
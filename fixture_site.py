@@ -0,0 +1,77 @@
+import os
+import json
+import time
+import threading
+import logging
+import sys
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from urllib.parse import urlsplit
+from typing import Optional
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'site')
+
+class FixtureServer:
+    """Local stand-in for a shopping site, serving a fixture directory over HTTP from a background thread
+    - /search?...    -> search.html (query & filter params are ignored)
+    - /p/<slug>?...  -> products/<slug>.html
+    - anything else  -> the file of that path, if present
+    - a manifest.json in root (recorded snapshots, see bench_scraper.py) maps url paths to files first
+    - delay: seconds added to every response, to simulate slow sites
+    """
+
+    def __init__(self, root: str = FIXTURE_DIR, host: str = '127.0.0.1', port: int = 0, delay: float = 0.0):
+        self.root = root
+        self.delay = delay
+        manifest = os.path.join(root, 'manifest.json')
+        self.manifest = json.load(open(manifest)) if os.path.exists(manifest) else {}
+        self.routes = self.manifest.get('routes', {})
+        server = self
+
+        class Handler(SimpleHTTPRequestHandler):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, directory=server.root, **kwargs)
+
+            def translate_path(self, path: str) -> str:
+                route = urlsplit(path).path
+                if route in server.routes:
+                    route = '/' + server.routes[route]
+                elif route.rstrip('/') == '/search':
+                    route = '/search.html'
+                elif route.startswith('/p/'):
+                    route = f"/products/{route[3:].strip('/')}.html"
+                return super().translate_path(route)
+
+            def do_GET(self):
+                if server.delay:
+                    time.sleep(server.delay)
+                super().do_GET()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FixtureServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f'Fixture site serving {self.root} on {self.base_url}')
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> 'FixtureServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,105 @@
+import os
+import json
+import hashlib
+import logging
+import sys
+from typing import Optional, Dict, Any, Tuple
+import pydantic
+from pydantic_ai import Agent
+from pydantic_ai.usage import RunUsage
+from scrape_cache import SqliteCache, CACHE_DIR, normalize_query
+from tracing import span
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.environ.get('SHOP_LLM_CACHE', '1') != '0'
+LLM_CACHE_SEMANTIC = os.environ.get('SHOP_LLM_CACHE_SEMANTIC', '0') == '1'   # also match prompts with the same token set
+LLM_TTL = 3 * 24 * 3600.0       # s
+LLM_MAX_ENTRIES = 20000
+LLM_MAX_BYTES = 64 * 1024 * 1024
+
+class LlmCache(SqliteCache):
+    """gen_agent outputs keyed by model, output schema & normalized prompt
+    - semantic: a second key from the prompt's normalized token set, so 'black iphone 256 gb' reuses 'iphone black 256gb'
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: float = LLM_TTL, max_entries: int = LLM_MAX_ENTRIES, max_bytes: int = LLM_MAX_BYTES,
+                 semantic: bool = LLM_CACHE_SEMANTIC):
+        super().__init__(path or os.path.join(CACHE_DIR, 'shop_cache.sqlite'), 'llm', ttl, max_entries, max_bytes)
+        self.semantic = semantic
+        self.semantic_hits = 0
+        self.tokens_saved = 0
+        self._schemas: Dict[Any, str] = {}
+
+    def schema(self, output_type: Any) -> str:
+        if output_type not in self._schemas:
+            self._schemas[output_type] = json.dumps(pydantic.TypeAdapter(output_type).json_schema(), sort_keys=True)
+        return self._schemas[output_type]
+
+    def keys(self, model_id: str, output_type: Any, prompt: str, semantic: bool = False) -> Tuple[str, Optional[str]]:
+        """Exact key (whitespace normalized prompt) & the semantic one, if enabled"""
+        base = f'{model_id}|{self.schema(output_type)}|'
+        exact = hashlib.sha256((base + ' '.join(prompt.split())).encode()).hexdigest()
+        if not (semantic and self.semantic):
+            return exact, None
+        return exact, 'sem:' + hashlib.sha256((base + normalize_query(prompt)).encode()).hexdigest()
+
+    def get(self, model_id: str, output_type: Any, prompt: str, semantic: bool = False) -> Optional[Tuple[Any, int]]:
+        """Cached output & the tokens the original call used"""
+        exact, similar = self.keys(model_id, output_type, prompt, semantic)
+        for key in (exact, similar):
+            raw = self.get_raw(key) if key else None
+            if raw is not None:
+                entry = json.loads(raw)
+                self.hits += 1
+                self.semantic_hits += key is similar
+                self.tokens_saved += entry['tokens']
+                return pydantic.TypeAdapter(output_type).validate_python(entry['output']), entry['tokens']
+        self.misses += 1
+        return None
+
+    def put(self, model_id: str, output_type: Any, prompt: str, output: Any, tokens: int, semantic: bool = False) -> None:
+        raw = json.dumps({'output': pydantic.TypeAdapter(output_type).dump_python(output, mode='json'), 'tokens': tokens})
+        for key in self.keys(model_id, output_type, prompt, semantic):
+            if key:
+                self.put_raw(key, raw)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), 'semantic_hits': self.semantic_hits, 'tokens_saved': self.tokens_saved}
+
+_llm_cache: Optional[LlmCache] = None
+
+def get_llm_cache() -> LlmCache:
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LlmCache()
+    return _llm_cache
+
+async def cached_run(agent: Agent, user_prompt: str, output_type: Any = str, usage: Optional[RunUsage] = None,
+                     semantic: bool = False, **kwargs: Any) -> Any:
+    """agent.run(...).output through the LLM cache
+    - hits cost no request; the tokens they saved are added to `usage.details` (llm_cache_hits, llm_cache_tokens_saved)
+    - semantic: allow token set matches for this prompt (only with SHOP_LLM_CACHE_SEMANTIC=1)
+    """
+    if not LLM_CACHE_ENABLED:
+        with span('llm.gen_agent', cache='off'):
+            return (await agent.run(user_prompt=user_prompt, output_type=output_type, usage=usage, **kwargs)).output
+    cache = get_llm_cache()
+    model_id = f'{agent.model.system}:{agent.model.model_name}'
+    with span('llm.gen_agent', model=model_id) as run:
+        hit = cache.get(model_id, output_type, user_prompt, semantic)
+        if hit:
+            output, tokens = hit
+            if usage is not None:
+                usage.details['llm_cache_hits'] = usage.details.get('llm_cache_hits', 0) + 1
+                usage.details['llm_cache_tokens_saved'] = usage.details.get('llm_cache_tokens_saved', 0) + tokens
+            logger.info(f'LLM cache hit ({tokens} tokens saved)')
+            run.set(cache='hit', tokens_saved=tokens)
+            return output
+        before = usage.total_tokens if usage is not None else 0
+        res = await agent.run(user_prompt=user_prompt, output_type=output_type, usage=usage, **kwargs)
+        tokens = res.usage().total_tokens - before
+        run.set(cache='miss', tokens=tokens)
+        cache.put(model_id, output_type, user_prompt, res.output, tokens, semantic)
+        return res.output
@@ -0,0 +1,79 @@
+import asyncio
+import time
+import logging
+import sys
+from typing import List, Optional, Dict, Any, Tuple
+from pydantic_models import SearchSpecs, UserFilter
+from records import ProductRecord
+from site_adapters import search_sites
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PREFETCH_STATS = {'started': 0, 'cancelled': 0, 'used': 0, 'missed': 0, 'hidden_seconds': 0.0}
+
+def prefetch_stats() -> Dict[str, Any]:
+    return {**PREFETCH_STATS, 'hidden_seconds': round(PREFETCH_STATS['hidden_seconds'], 3)}
+
+def search_key(sites: List[str], query: str, user_filters: List[UserFilter] | None = None) -> Tuple:
+    """What a search depends on - prefetched results are only reused for the very same key"""
+    filters = tuple(sorted((f.name, tuple(sorted(f.selection or [])), tuple(f.range or ())) for f in user_filters or []))
+    return tuple(site.rstrip('/') for site in sites), ' '.join(query.lower().split()), filters
+
+class Prefetcher:
+    """Speculative search of one chat session, run while the user is busy answering prompts
+    - start(): search (results page + top product pages) for the latest query & filters, cancelling work a refinement made obsolete
+    - take(): products of a matching search, waiting for it to finish, & the seconds of it hidden behind the prompts
+    - a search that is never taken still warms the facet & product caches
+    """
+
+    def __init__(self, top_k: int = 10):
+        self.top_k = top_k
+        self.key: Optional[Tuple] = None
+        self.task: Optional[asyncio.Task] = None
+        self.started = 0.0
+        self.finished: Optional[float] = None
+
+    def start(self, sites: List[str], query: str, user_filters: List[UserFilter] | None = None) -> None:
+        key = search_key(sites, query, user_filters)
+        if not query or (key == self.key and self.task):
+            return
+        self.cancel()
+        self.key, self.started, self.finished = key, time.monotonic(), None
+        specs = SearchSpecs(query=query, sites=list(sites), user_filters=user_filters)
+        self.task = asyncio.create_task(self._run(specs))
+        PREFETCH_STATS['started'] += 1
+        logger.info(f'Prefetching {query} {[f.name for f in user_filters or []]} on {sites}')
+
+    async def _run(self, specs: SearchSpecs) -> List[ProductRecord]:
+        products = await search_sites(specs.sites, specs, specs.query, top_k=self.top_k)
+        self.finished = time.monotonic()
+        logger.info(f'Prefetched {len(products)} products for {specs.query} in {self.finished - self.started:.2f}s')
+        return products
+
+    def cancel(self) -> None:
+        if self.task and not self.task.done():
+            self.task.cancel()
+            PREFETCH_STATS['cancelled'] += 1
+            logger.info(f'Cancelled obsolete prefetch {self.key}')
+        self.task, self.key = None, None
+
+    async def take(self, sites: List[str], query: str, user_filters: List[UserFilter] | None = None) -> Tuple[Optional[List[ProductRecord]], float]:
+        if not self.task or self.key != search_key(sites, query, user_filters):
+            if self.task:
+                PREFETCH_STATS['missed'] += 1
+            self.cancel()
+            return None, 0.0
+        asked = time.monotonic()
+        task, self.task, self.key = self.task, None, None
+        try:
+            products = await task
+        except Exception as e:
+            logger.error(f'Prefetch failed: {e}')
+            return None, 0.0
+        # only the part of the search that ran before it was needed is hidden
+        hidden = max(0.0, min(self.finished or asked, asked) - self.started)
+        PREFETCH_STATS['used'] += 1
+        PREFETCH_STATS['hidden_seconds'] += hidden
+        logger.info(f'Prefetch hit: {len(products)} products, {hidden:.2f}s hidden')
+        return products, hidden
@@ -0,0 +1,112 @@
+import re
+from functools import lru_cache
+from typing import Optional, Dict, List, Iterable, Tuple
+from urllib.parse import urljoin, unquote_plus, quote_plus
+
+# `pid` identifies the product - every other query parameter (iid, ssid, qH, otracker, ...) is per-session tracking
+_PID = re.compile(r'(?:^|&)pid=([^&]+)')
+_ITM = re.compile(r'(?:^|/)(itm[^/]+)')
+# second level labels under which a site registers one level deeper (amazon.co.in, not co.in)
+_SECOND_LEVEL = {'co', 'com', 'net', 'org', 'gov', 'ac', 'edu'}
+
+@lru_cache(maxsize=1024)
+def registrable_host(netloc: str) -> str:
+    """Site part of a host: 'www.flipkart.com' / 'dl.flipkart.com' -> 'flipkart.com', 'www.amazon.co.in' -> 'amazon.co.in', ports & ips kept bare"""
+    host = netloc.rpartition('@')[2].lower()
+    host = host.rsplit(':', 1)[0] if host.count(':') == 1 else host
+    labels = host.split('.')
+    if len(labels) <= 2 or labels[-1].isdigit():
+        return host
+    keep = 3 if labels[-2] in _SECOND_LEVEL and len(labels[-1]) == 2 else 2
+    return '.'.join(labels[-keep:])
+
+def _identify(url: str) -> Tuple[Optional[str], str, str]:
+    """(product id, canonical url, path) from one pass over the url - no urlsplit / parse_qs
+    - ids are qualified by the registrable host ('flipkart.com|pid:X'), so equal pids of two sites never collide
+    """
+    head, _, query = url.strip().partition('#')[0].partition('?')
+    scheme, sep, rest = head.partition('//')
+    site = ''
+    if sep and (not scheme or scheme[:-1].isalpha() and scheme[-1] == ':'):
+        netloc, slash, path = rest.partition('/')
+        origin, path = f'{scheme.lower()}//{netloc.lower()}' if netloc or scheme else '', slash + path
+        site = f'{registrable_host(netloc)}|' if netloc else ''
+    else:
+        origin, path = '', head
+    pid = None
+    if 'pid=' in query:
+        match = _PID.search(query)
+        if match:
+            pid = match.group(1)
+            pid = unquote_plus(pid) if '%' in pid or '+' in pid else pid
+    canonical = f'{origin}{path}?pid={quote_plus(pid)}' if pid else origin + path
+    if pid:
+        return f'{site}pid:{pid.upper()}', canonical, path
+    match = _ITM.search(path) if 'itm' in path else None
+    return (f'{site}itm:{match.group(1)}' if match else None), canonical, path
+
+def product_id(url: str) -> Optional[str]:
+    """Canonical product id: the `pid=` parameter, else the `itm...` id from the path, qualified by the site ('flipkart.com|pid:X')"""
+    return _identify(url)[0]
+
+def canonical_url(url: str) -> str:
+    """Product url with tracking parameters & fragment stripped"""
+    return _identify(url)[1]
+
+def product_key(url: str) -> str:
+    """Dedup & cache key: the product id, else the canonical url"""
+    pid, canonical, _ = _identify(url)
+    return pid or canonical
+
+def _is_product(pid: Optional[str], path: str) -> bool:
+    return pid is not None and not path.rstrip('/').endswith('/search')
+
+def is_product_link(url: str) -> bool:
+    """Whether a results page link points at a product page (not a search, pagination or facet link)"""
+    pid, _, path = _identify(url)
+    return _is_product(pid, path)
+
+class ProductIndex:
+    """Product links keyed by product id - O(1) dedup across result pages & queries, kept apart per site
+    - the first link seen for a product wins, stored as its canonical url
+    """
+
+    def __init__(self, urls: Iterable[str] = ()):
+        self._urls: Dict[str, str] = {}
+        self.duplicates = 0
+        for url in urls:
+            self.add(url)
+
+    def add(self, url: str) -> bool:
+        """False when the product is already indexed"""
+        pid, canonical, _ = _identify(url)
+        return self._add(pid or canonical, canonical)
+
+    def _add(self, key: str, canonical: str) -> bool:
+        if key in self._urls:
+            self.duplicates += 1
+            return False
+        self._urls[key] = canonical
+        return True
+
+    def __contains__(self, url: str) -> bool:
+        return product_key(url) in self._urls
+
+    def __len__(self) -> int:
+        return len(self._urls)
+
+    def links(self) -> List[str]:
+        """Canonical product urls in the order they were first seen"""
+        return list(self._urls.values())
+
+def product_links(base_url: str, hrefs: Iterable[Optional[str]]) -> List[str]:
+    """Distinct product links among the hrefs of a results page, absolute & canonical, in page order"""
+    index = ProductIndex()
+    for href in hrefs:
+        if href:
+            href = href.strip()
+            link = base_url + href if href.startswith('/') and not href.startswith('//') else urljoin(base_url + '/', href)
+            pid, canonical, path = _identify(link)
+            if _is_product(pid, path):
+                index._add(pid, canonical)
+    return index.links()
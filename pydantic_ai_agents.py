@@ -1,10 +1,26 @@
 import asyncio
+import os
+import uuid
+import time
 import pydantic
+from collections import deque
 from types import NoneType
-from typing import List, Optional, Annotated, Literal, Dict, Any, Tuple
+from typing import List, Optional, Annotated, Literal, Dict, Any, Tuple, AsyncIterator
 # from google import genai # type: ignore
 from pydantic_ai import Agent, RunContext, UsageLimits
-from site_scraper import get_filters, get_filtered_products, get_products, playwright_enter, playwright_exit
+from pydantic_ai.models import Model
+from site_scraper import get_filters, get_filtered_products, get_products, refresh_facets_in_background
+from site_adapters import get_adapter, search_sites
+from query_rules import analyze_query
+from filter_matcher import trim_filters, match_answer, form_answer, MATCH_CONFIDENCE
+from prefetch import Prefetcher
+from scheduler import get_scheduler, ScheduledModel
+from llm_cache import cached_run
+from records import ProductRecord, to_products
+from ranking import get_ranker, price_budget
+from tracing import span, traced, timing_summary, current_summary, send_json
+from browser_pool import get_browser_pool
+from scrape_cache import get_facet_cache
 from pydantic_models import Product, ProductClass, ProductReview, UserFilter, ShopResult, ShopDeps, SearchSpecs
 from dotenv import load_dotenv
 import json
@@ -18,6 +34,411 @@ logger = logging.getLogger(__name__)
 
 MODEL_ID = 'google-gla:gemini-2.5-flash-lite'
 MAX_RETRIES = 3
+# sites searched for candidates (site adapters registered in site_adapters), best site first
+SITES = [site for site in os.environ.get('SHOP_SITES', 'https://www.flipkart.com').split(',') if site]
+LATENCY_WINDOW = 200    # recent chats kept for the latency percentiles
+USAGE_LIMITS = UsageLimits(request_limit=20, total_tokens_limit=25000)
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+class ChatMetrics:
+    """Latency of recent chats - time to first product is the headline number, total time is secondary"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.chats = 0
+        self.first_product: deque = deque(maxlen=window)
+        self.total: deque = deque(maxlen=window)
+
+    def record(self, first_product: Optional[float], total: float) -> None:
+        self.chats += 1
+        if first_product is not None:
+            self.first_product.append(first_product)
+        self.total.append(total)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'chats': self.chats,
+            'first_product_p50': _percentile(list(self.first_product), 0.5),
+            'first_product_p95': _percentile(list(self.first_product), 0.95),
+            'total_p50': _percentile(list(self.total), 0.5),
+            'total_p95': _percentile(list(self.total), 0.95),
+        }
+
+_chat_metrics: Optional[ChatMetrics] = None
+
+def get_chat_metrics() -> ChatMetrics:
+    global _chat_metrics
+    if _chat_metrics is None:
+        _chat_metrics = ChatMetrics()
+    return _chat_metrics
+
+async def emit(deps: ShopDeps, event: Dict[str, Any]) -> None:
+    """Send a streaming event to the session's listener, if any - a broken listener never fails the agent"""
+    if not deps.on_event:
+        return
+    try:
+        await deps.on_event(event)
+    except Exception as e:
+        logger.error(f'Could not stream {event.get("type")} event: {e}')
+
+async def add_step(deps: ShopDeps, step: str) -> None:
+    deps.flow.append(step)
+    await emit(deps, {'type': 'step', 'step': step, 'steps': deps.steps})
+
+def build_agents(model_id: str | Model = MODEL_ID, max_retries: int = MAX_RETRIES) -> Tuple[Agent[ShopDeps, ShopResult], Agent[NoneType, str]]:
+    """The shopping agent with its tools & the general purpose agent
+    - stateless: everything per session (coach, top_k, query, specs ...) comes in through ShopDeps
+    - model_id: a model name or a Model instance (e.g. a stub for load tests)
+    """
+    shop_agent = Agent[ShopDeps, ShopResult](
+        model=ScheduledModel(model_id),
+        output_type=ShopResult,
+        deps_type=ShopDeps,
+        retries=max_retries, 
+    )
+
+    gen_agent = Agent[NoneType, str](
+        model=ScheduledModel(model_id),
+        output_type=str,
+        deps_type=NoneType,
+        retries=max_retries, 
+    )
+
+    @shop_agent.system_prompt
+    def sys_prompt0():
+        return """
+        You are a shopping agent specialising in helping users find the most suitable product. 
+        Use the following tools to assist you in your task:
+        - get_pro_class: Extract the product category & type from the user's query.
+        - prompt_user0: Prompt the user for further details about the product.
+        - rephrase_query : Generate a very concise product search query - combining original query & user provided details
+        - get_best_site: Find the best website to search for the product.
+        - get_site_filters: Retrieve all the available filters on the best site for the product.
+        - trim_site_filters: Filter out & get only the relevant & user demanded filters for the site.
+        - prompt_user1: Prompt the user for further details about the product using the available filters
+        - get_candidates : Return the best candidates found for the product 
+
+        You may use prompt_user0, rephrase_query & prompt_user1 tool calls more than once as needed but use the rest of the tools only once. 
+        Example workflow: 
+        user query -> get_pro_class(user_query) -> prompt_user0(product_class) -> rephrase_query(query) -> get_best_site(product_class) -> get_site_filters(product_class, best_site) -> trim_site_filters(site_filters)-> prompt_user1(filtered_site_filters, product_class) -> get_candidates(user_filters, search_query) -> final answer
+        The candidates come back already ranked best first & are added to the final answer for you - the final answer only needs a short message.
+        """
+
+    @gen_agent.system_prompt
+    def sys_prompt1() -> str:
+        return """
+        You are general question answering agent . Follow the given user's instruction religiously !
+        """
+    @shop_agent.tool
+    @traced('tool.get_pro_class')
+    async def get_pro_class(context: RunContext[ShopDeps]) -> None:
+        """
+        Get the product type & category from the user's query
+        - Use to retrieve the product category & type from the user's query
+        """
+        # logger.info(f'node get_pro_class , deps: {context.deps}')
+        context.deps.steps += 1
+        query = context.deps.query
+        analysis = analyze_query(query)
+        if analysis.class_is_local:
+            context.deps.search_specs.pro_class = analysis.pro_class
+            context.deps.local_steps.append('get_pro_class')
+        else:
+            res = await cached_run(gen_agent,
+                user_prompt= f"""You are an agent specialising in identifying a products class, type & category. 
+                Return output in the specified pydantic base model format. Input Query: {query}""",
+                usage = context.usage,
+                usage_limits = USAGE_LIMITS,
+                output_type=ProductClass,
+                semantic=True
+            )
+            context.deps.search_specs.pro_class = res
+        # print(f'Pro class: {context.deps.search_specs.pro_class}')
+        # print(f'Model: {context.model}')
+        step = f'Step {context.deps.steps}: get_pro_class{" (local)" if analysis.class_is_local else ""} -> {context.deps.search_specs.pro_class}'
+        await add_step(context.deps, step)
+        logger.info(step)
+        # return context.deps.search_specs.pro_class
+
+    @shop_agent.tool
+    @traced('tool.rephrase_query')
+    async def rephrase_query(context: RunContext[ShopDeps]) -> None:
+        """
+        Rephrase the user query for more better & efficient searching . 
+        Combine original user prompt along with the additional details provided by the user to create a single coherant query.
+        - Use if the query is too short or vague 
+        - Use if user has provided new information
+        """
+        # logger.info(f'node rephrase_query , deps: {context.deps}')
+        context.deps.steps += 1
+        query = context.deps.query
+        analysis = analyze_query(query)
+        if analysis.query_is_local:
+            context.deps.query = analysis.query
+            context.deps.local_steps.append('rephrase_query')
+        else:
+            res = await cached_run(gen_agent,
+                user_prompt=f"""
+                Rephrase the original query & the provided details : {query}.
+                Simple return the rephrased query. 
+                The result should be short & include all of the necessary keywords.
+                You can discard irrelevant details for a more concise query . 
+                Keep in mind this query will be used for searching products for the users !
+                Remove all punctuation & keeo the query less than 7 words
+                """,
+                usage = context.usage,
+                usage_limits = USAGE_LIMITS,
+                semantic=True
+            )
+            context.deps.query = res
+        if context.deps.prefetcher:
+            context.deps.prefetcher.start(context.deps.search_specs.sites or SITES, context.deps.query, context.deps.search_specs.user_filters)
+        step = f'Step {context.deps.steps}: rephrase_query{" (local)" if analysis.query_is_local else ""} -> {query} => {context.deps.query}'
+        await add_step(context.deps, step)
+        logger.info(step)
+        # return res.output
+
+    @shop_agent.tool 
+    @traced('tool.prompt_user0')
+    async def prompt_user0(context: RunContext[ShopDeps]) -> None:
+        """Prompt the user for further details about the product
+        - Use to get details from the user about their ideal & needed product.
+        - Useful for generating a more specific search query.
+        - Useful for understanding how to filter products better.
+          """
+        context.deps.steps += 1
+        query = context.deps.query
+        pro_class = context.deps.search_specs.pro_class
+        res = await cached_run(gen_agent,
+            user_prompt=f"""
+        Prompt user to get more details about the particular product they wish to purchase - their specifications, qualities
+        Tune your questions based on the product type & category
+        - Use to generate a prompt to the users that answers all the relevant questions needed to search for the ideal product
+        Product Class : {pro_class}
+        User query: {query} 
+        """,
+            deps=None,
+            usage=context.usage,
+            usage_limits=USAGE_LIMITS
+        )
+        user_prompt = res
+        # logger.info(f'node prompt_user0 , deps: {context.deps}')
+        # qE = input(user_prompt + "\nAnswer: ")
+        # search for the query as it stands while the user types
+        if context.deps.prefetcher:
+            context.deps.prefetcher.start(context.deps.search_specs.sites or SITES, analyze_query(query).query or query)
+        qE = await context.deps.coach.prompt_user(user_prompt)
+        if qE:
+            context.deps.query += ' ' + qE
+            context.deps.og_query += ' ' + qE
+        else:
+            raise
+        step = f'Step {context.deps.steps}: prompt_user0 -> {context.deps.query}'
+        await add_step(context.deps, step)
+        logger.info(step)
+        # return qE
+
+    @shop_agent.tool
+    @traced('tool.get_best_site')
+    async def get_best_site(context: RunContext[ShopDeps]) -> None:
+        """Get the best & most suitable website for searching the users product"""
+        # logger.info(f'node get_best_site , deps: {context.deps}')
+        context.deps.steps += 1
+        pro_class = context.deps.search_specs.pro_class
+        # best_site = await search_agent.run(f"Find the best website to search for {pro_class.category} of type {pro_class.type}. Just return the domain name without any prefixes or suffixes.", usage=context.usage, deps=context.deps.search_deps)
+        best_site = SITES[0]
+        context.deps.search_specs.site = best_site
+        context.deps.search_specs.sites = list(SITES)
+        step = f'Step {context.deps.steps}: get_best_site -> {best_site}'
+        await add_step(context.deps, step)
+        logger.info(step)
+        # return best_site
+
+    @shop_agent.tool
+    @traced('tool.get_site_filters')
+    async def get_site_filters(context: RunContext[ShopDeps]) -> None:
+        """Retrieve all the available filters on the best site for the product
+        - Use to retrieve all the available filters for the product on the site 
+        - This can then be later used to retrieve user preferences for filtering the products
+        """
+        # logger.info(f'node get_site_filters , deps: {context.deps}')
+        context.deps.steps += 1
+        site, query, pro_class = context.deps.search_specs.site, context.deps.query, context.deps.search_specs.pro_class
+        # filters = await search_agent.run(f"Retrieve all the filters available on {context.deps.search_specs.site}", usage=context.usage, deps=context.deps.search_deps)
+        # a facet cache hit needs no browser at all - the one lookup; on a miss the adapter scrapes with refresh=True (store only)
+        cached, stale = get_facet_cache().get(site, query, pro_class)
+        if cached is not None:
+            context.deps.search_specs.site_filters = cached
+            if stale:
+                # another query of the same product class: served now, this query's own facets scraped for next time
+                refresh_facets_in_background(site, query, pro_class,
+                                             lambda page: get_adapter(site).get_filters(page, query, pro_class=pro_class, refresh=True))
+        else:
+            # the lease is only held while scraping, never while the user answers prompts
+            async with get_scheduler().browser.slot():
+                async with get_browser_pool().lease() as lease:
+                    context.deps.search_specs.site_filters = await get_adapter(site).get_filters(lease.page, query, pro_class=pro_class, refresh=True)
+        step = f'Step {context.deps.steps}: get_site_filters -> {len(context.deps.search_specs.site_filters) if context.deps.search_specs.site_filters else 0}'
+        await add_step(context.deps, step)
+        logger.info(step + f'\n{context.deps.search_specs.site_filters}')
+        # return context.deps.search_specs.site_filters
+
+    @shop_agent.tool
+    @traced('tool.trim_site_filters')
+    async def trim_site_filters(context: RunContext[ShopDeps]) -> None:
+        context.deps.steps += 1
+        site_filters = context.deps.search_specs.site_filters or []
+        # single option filters are dropped & filters the query already answers become user filters right away
+        filtered_site_filters, answered = trim_filters(site_filters, context.deps.query)
+        context.deps.search_specs.filtered_site_filters = filtered_site_filters
+        if answered:
+            context.deps.search_specs.user_filters = answered
+        context.deps.local_steps.append('trim_site_filters')
+        step = f'Step {context.deps.steps}: trim_site_filters (local) {len(site_filters)} -> {len(filtered_site_filters)}, {len(answered)} answered by the query'
+        await add_step(context.deps, step)
+        logger.info(step + f'\nTrimmed User filters: \n{filtered_site_filters}\nFrom query: {answered}')
+
+    @shop_agent.tool 
+    @traced('tool.prompt_user1')
+    async def prompt_user1(context: RunContext[ShopDeps]) -> None:
+        """Prompt the user for how to apply filters 
+        - Using the previously fetched site filters available - get exact user preferences on how to filter the products
+        - Store these user filters in a structured form such that these can be applied while searching for products
+        """
+        # logger.info(f'node prompt_user1 , deps: {context.deps}')
+        context.deps.steps += 1
+        filters = context.deps.search_specs.filtered_site_filters if context.deps.search_specs.filtered_site_filters else context.deps.search_specs.site_filters
+        if filters:
+            res = ''
+            # filters pinned down by the query (trim_site_filters) or an earlier prompt_user1
+            resolved = {f.name: f for f in context.deps.search_specs.user_filters or []}
+            if context.deps.prefetcher:
+                context.deps.prefetcher.start(context.deps.search_specs.sites or SITES, context.deps.query, list(resolved.values()) or None)
+            # every filter in one form & one reply, instead of a round trip per filter
+            answers = await context.deps.coach.prompt_form(filters) or {}
+            for filter in filters:
+                # picked options map straight onto the filter, only free text answers need matching
+                user_filter, ans = form_answer(filter, answers.get(filter.name))
+                if user_filter:
+                    resolved[user_filter.name] = user_filter
+                    continue
+                if not ans:
+                    continue
+                user_filter, confidence = match_answer(filter, ans)
+                if confidence >= MATCH_CONFIDENCE:
+                    if user_filter:
+                        resolved[user_filter.name] = user_filter
+                elif ans and ans != '.':
+                    res += f'Filter: {filter}, Answer:{ans}\n'
+            if not res:
+                context.deps.search_specs.user_filters = list(resolved.values())
+                context.deps.local_steps.append('prompt_user1')
+                step = f'Step {context.deps.steps}: prompt_user1 (local) -> {len(resolved)}'
+                await add_step(context.deps, step)
+                logger.info(step + f'\nUser filters: \n{list(resolved.values())}')
+                return
+            # only the answers the matcher could not resolve go to the LLM
+            list_user_filter_schema = pydantic.TypeAdapter(List[UserFilter]).json_schema()
+            # logger.info(f'User Filter response:{res}\nlist_user_filter_schema: {list_user_filter_schema}')
+            user_filters = await cached_run(gen_agent,
+                user_prompt=f"""
+                You are an specialised agent that takes in different user preferences & filters for a product - compiles & captures the user intent &
+                return output in the specified pydantic base model format.
+                The Filters are listed one by one with the format => Filter: name type all_possible values Answer: User answer 
+                STRICTLY , IF THE USER GIVES NO ANSWER FOR A FILTER - COMPLETELY SKIP THAT FILTER !!!
+                Pay special attention to the text after Answer: & select the appropriate choices from the selection or range given at the start for each filter.
+                
+                EXAMPLE:
+                Input :
+                Filter: name='CLOCK SPEED' type='multiselect' selection=['1.5 - 1.9 GHz', '2 - 2.5 GHz', '2.2 - 2.4 GHz', '2.5 GHz Above', 'Below 1.5 GHz', 'Less than 900 MHz'] range=None, Answer: 1 
+                Explanation : For the above Filter , the user has given their preferred value - match it with the appropriate present value & return the result . If no values match - skip the particular filter
+                Output: UserFilter(name='CLOCK SPEED', type='multiselect', selection=['Below 1.5 GHz', 'Less than 900 MHz'], range=None)]) 
+
+                Input Query: {res} 
+                """,
+                usage = context.usage,
+                usage_limits = USAGE_LIMITS,
+                output_type=List[UserFilter]
+            )
+            # logger.info(f'Gen User filters: {user_filters}')
+            resolved.update({f.name: f for f in user_filters or []})
+            context.deps.search_specs.user_filters = list(resolved.values())
+            step = f'Step {context.deps.steps}: prompt_user1 -> {len(resolved)}'
+            await add_step(context.deps, step)
+            logger.info(step + f'\nUser filters: \n{list(resolved.values())}')
+            # return user_filters.output
+
+    @shop_agent.tool
+    @traced('tool.get_candidates')
+    async def get_candidates(context: RunContext[ShopDeps]) -> List[Product] | None:
+        """Get a list of filtered candidate products matching the user's query
+        - Final Output 
+        - use search query enriched with user details & rephrase_query along with user provided filters to get the final eligible candidates
+        - End the user request & return them the relevant desired products
+          """
+        # logger.info(f'node get_candidates , deps: {context.deps}')
+        context.deps.steps += 1
+        specs, search_query = context.deps.search_specs, context.deps.query
+        sites = specs.sites or [specs.site]
+
+        async def on_product(product: ProductRecord) -> None:
+            if context.deps.first_product_after is None:
+                context.deps.first_product_after = time.monotonic() - context.deps.started
+                logger.info(f'First product after {context.deps.first_product_after:.2f}s')
+            await emit(context.deps, {'type': 'product', 'product': product.to_dict()})
+
+        products, hidden = await context.deps.prefetcher.take(sites, search_query, specs.user_filters) if context.deps.prefetcher else (None, 0.0)
+        if products is not None:
+            context.deps.prefetch_hidden = hidden
+            for product in products:
+                await on_product(product)
+        else:
+            products = await search_sites(sites, specs, search_query, top_k=context.deps.top_k, on_product=on_product)
+        if not products and specs.user_filters:
+            logger.info('Running fallback search without filters')
+            products = await search_sites(sites, specs.model_copy(update={'user_filters': None}), search_query, top_k=context.deps.top_k, on_product=on_product)
+        # ranked locally - the order & the recommended product (the first) no longer come from the LLM
+        # the rephrased query has the budget stripped ('under 60k' is no search term), the user's own words still carry it
+        budget = price_budget(search_query, specs.user_filters) or price_budget(context.deps.og_query, specs.user_filters)
+        ranked = get_ranker().rank(products or [], search_query, specs.user_filters, budget)
+        # the scrape pipeline works on records, pydantic validation happens once here for the agent & ShopResult
+        products = to_products(ranked)
+        context.deps.candidates = products
+        step = f'Step {context.deps.steps}: get_candidates{f" (prefetched, {hidden:.1f}s hidden)" if hidden else ""} -> {len(products) if products else 0}'
+        # logger.info(f'Products: {products}')
+        await add_step(context.deps, step)
+        logger.info(step + f'\nProduct:\n{products}')
+        return products
+
+    @shop_agent.output_validator
+    def val_op(context:RunContext[ShopDeps], op: ShopResult) -> ShopResult:
+        logger.info(f'pre op: {op}')
+        op.flow = context.deps.flow
+        op.steps = context.deps.steps
+        op.local_steps = context.deps.local_steps
+        op.time_to_first_product = context.deps.first_product_after
+        op.prefetch_hidden = context.deps.prefetch_hidden
+        op.products = context.deps.candidates if context.deps.candidates else []
+        op.recommended = op.products[0] if op.products else None
+        return op
+    logger.info(f'Agents built for {model_id} !')
+    return shop_agent, gen_agent
+
+_agents: Dict[Tuple[str, int], Tuple[Agent[ShopDeps, ShopResult], Agent[NoneType, str]]] = {}
+
+def get_agents(model_id: str = MODEL_ID, max_retries: int = MAX_RETRIES) -> Tuple[Agent[ShopDeps, ShopResult], Agent[NoneType, str]]:
+    """Agents shared by every session of the process, built on first use"""
+    if (model_id, max_retries) not in _agents:
+        _agents[(model_id, max_retries)] = build_agents(model_id, max_retries)
+    return _agents[(model_id, max_retries)]
+
+def override_model(model: Model, model_id: str = MODEL_ID, max_retries: int = MAX_RETRIES) -> None:
+    """Serve the sessions of `model_id` with another model - a stub for load tests, no API key needed"""
+    _agents[(model_id, max_retries)] = build_agents(model, max_retries)
 
 class Chatbot:
 
@@ -31,20 +452,14 @@ class Chatbot:
         def set_ws(self, ws: WebSocket):
             self.ws = ws
 
-        async def prompt_user(self, prompt: str, prompt_id: Optional[str] = None, timeout: Optional[float] = None) -> Optional[str]:
-            if not prompt_id:
-                prompt_id = str(id(prompt) + int(asyncio.get_event_loop().time()*1000))
+        async def _ask(self, message: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+            """Send a prompt message & wait for the reply to its prompt_id - any number of prompts can be pending at once"""
+            prompt_id = message['prompt_id']
             event = asyncio.Event()
             self._prompt_waiters[prompt_id] = (event, {'response': None})
-            # self.userResponseEvent = asyncio.Event()
-            # async def ws_prompt(prompt: str) -> None:
             if self.ws: 
                 logger.info('WS present !')
-                await self.ws.send_json({
-                    'type': 'prompt',
-                    'prompt_id': prompt_id,
-                    'question': prompt
-                })
+                await send_json(self.ws, message)
             else:
                 logger.info('No WS :(') 
             try:
@@ -58,15 +473,34 @@ class Chatbot:
                 return None
             _, data = self._prompt_waiters.pop(prompt_id)
             return data.get('response')
-            # await ws_prompt(prompt)
-            # self.userResp = None
-            # return await self._wait4resp()
+
+        async def prompt_user(self, prompt: str, prompt_id: Optional[str] = None, timeout: Optional[float] = None) -> Optional[str]:
+            # self.userResponseEvent = asyncio.Event()
+            # async def ws_prompt(prompt: str) -> None:
+            return await self._ask({
+                'type': 'prompt',
+                'prompt_id': prompt_id or uuid.uuid4().hex,
+                'question': prompt
+            }, timeout)
+
+        async def prompt_form(self, filters: List[UserFilter], prompt_id: Optional[str] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+            """Ask about all filters at once
+            - sends {'type': 'prompt_form', 'prompt_id', 'question', 'filters': [UserFilter]}
+            - the reply's answers: filter name -> picked options | {'range': [low, high]} | free text, skipped filters left out
+            """
+            answers = await self._ask({
+                'type': 'prompt_form',
+                'prompt_id': prompt_id or uuid.uuid4().hex,
+                'question': 'Pick how the results should be filtered - leave a filter empty to skip it !',
+                'filters': [f.model_dump(mode='json') for f in filters]
+            }, timeout)
+            return answers if isinstance(answers, dict) else {}
 
         # async def _wait4resp(self):
         #     await self.userResponseEvent.wait()
         #     return self.userResp
         
-        def set_userResp(self, userResp: str, prompt_id: Optional[str] = None) -> bool:
+        def set_userResp(self, userResp: Any, prompt_id: Optional[str] = None) -> bool:
             if prompt_id and prompt_id in self._prompt_waiters:
                 event, data = self._prompt_waiters[prompt_id]
                 data['response'] = userResp
@@ -83,294 +517,92 @@ class Chatbot:
     usage_limits: UsageLimits
     shop_agent: Agent[ShopDeps, ShopResult]
     gen_agent: Agent[None, str]
-    context_man : Any = None
-    playwright: Any = None
-    browser: Any = None
-    context: Any = None
-    page: Any = None 
     coach: CoachChatbot
 
     def __init__(self, model_id: str = MODEL_ID, max_retries: int = MAX_RETRIES, top_k: int = 10, ws: Optional[WebSocket] = None):
         self.model_id = model_id
+        self.top_k = top_k
         self.max_retries = max_retries
-        self.usage_limits = UsageLimits(request_limit=20, total_tokens_limit=25000)
+        self.usage_limits = USAGE_LIMITS
         self.coach = self.CoachChatbot()
         self.coach.set_ws(ws)
 
-        self.shop_agent = Agent[ShopDeps, ShopResult](
-            model=MODEL_ID,
-            output_type=ShopResult,
-            deps_type=ShopDeps,
-            retries=MAX_RETRIES, 
-        )
-
-        self.gen_agent = Agent[NoneType, str](
-            model=MODEL_ID,
-            output_type=str,
-            deps_type=NoneType,
-            retries=MAX_RETRIES, 
-        )
-    
-        @self.shop_agent.system_prompt
-        def sys_prompt0():
-            return """
-            You are a shopping agent specialising in helping users find the most suitable product. 
-            Use the following tools to assist you in your task:
-            - get_pro_class: Extract the product category & type from the user's query.
-            - prompt_user0: Prompt the user for further details about the product.
-            - rephrase_query : Generate a very concise product search query - combining original query & user provided details
-            - get_best_site: Find the best website to search for the product.
-            - get_site_filters: Retrieve all the available filters on the best site for the product.
-            - trim_site_filters: Filter out & get only the relevant & user demanded filters for the site.
-            - prompt_user1: Prompt the user for further details about the product using the available filters
-            - get_candidates : Return the best candidates found for the product 
-
-            You may use prompt_user0, rephrase_query & prompt_user1 tool calls more than once as needed but use the rest of the tools only once. 
-            Example workflow: 
-            user query -> get_pro_class(user_query) -> prompt_user0(product_class) -> rephrase_query(query) -> get_best_site(product_class) -> get_site_filters(product_class, best_site) -> trim_site_filters(site_filters)-> prompt_user1(filtered_site_filters, product_class) -> get_candidates(user_filters, search_query) -> final answer
-            """
+        self.shop_agent, self.gen_agent = get_agents(model_id, max_retries)
+        logger.info('Chatbot initialised !')
 
-        @self.gen_agent.system_prompt
-        def sys_prompt1() -> str:
-            return """
-            You are general question answering agent . Follow the given user's instruction religiously !
-            """
-        @self.shop_agent.tool
-        async def get_pro_class(context: RunContext[ShopDeps]) -> None:
-            """
-            Get the product type & category from the user's query
-            - Use to retrieve the product category & type from the user's query
-            """
-            # logger.info(f'node get_pro_class , deps: {context.deps}')
-            context.deps.steps += 1
-            query = context.deps.query
-            res = await self.gen_agent.run(
-                user_prompt= f"""You are an agent specialising in identifying a products class, type & category. 
-                Return output in the specified pydantic base model format. Input Query: {query}""",
-                usage = context.usage,
-                usage_limits = self.usage_limits,
-                output_type=ProductClass
-            )
-            context.deps.search_specs.pro_class = res.output
-            # print(f'Pro class: {context.deps.search_specs.pro_class}')
-            # print(f'Model: {context.model}')
-            step = f'Step {context.deps.steps}: get_pro_class -> {context.deps.search_specs.pro_class}'
-            context.deps.flow.append(step)
-            logger.info(step)
-            # return context.deps.search_specs.pro_class
-
-        @self.shop_agent.tool
-        async def rephrase_query(context: RunContext[ShopDeps]) -> None:
-            """
-            Rephrase the user query for more better & efficient searching . 
-            Combine original user prompt along with the additional details provided by the user to create a single coherant query.
-            - Use if the query is too short or vague 
-            - Use if user has provided new information
-            """
-            # logger.info(f'node rephrase_query , deps: {context.deps}')
-            context.deps.steps += 1
-            query = context.deps.query
-            res = await self.gen_agent.run(
-                user_prompt=f"""
-                Rephrase the original query & the provided details : {query}.
-                Simple return the rephrased query. 
-                The result should be short & include all of the necessary keywords.
-                You can discard irrelevant details for a more concise query . 
-                Keep in mind this query will be used for searching products for the users !
-                Remove all punctuation & keeo the query less than 7 words
-                """
-            )
-            context.deps.query = res.output
-            step = f'Step {context.deps.steps}: rephrase_query -> {query} => {res.output}'
-            context.deps.flow.append(step)
-            logger.info(step)
-            # return res.output
-
-        @self.shop_agent.tool 
-        async def prompt_user0(context: RunContext[ShopDeps]) -> None:
-            """Prompt the user for further details about the product
-            - Use to get details from the user about their ideal & needed product.
-            - Useful for generating a more specific search query.
-            - Useful for understanding how to filter products better.
-              """
-            context.deps.steps += 1
-            query = context.deps.query
-            pro_class = context.deps.search_specs.pro_class
-            res = await self.gen_agent.run(
-                user_prompt=f"""
-            Prompt user to get more details about the particular product they wish to purchase - their specifications, qualities
-            Tune your questions based on the product type & category
-            - Use to generate a prompt to the users that answers all the relevant questions needed to search for the ideal product
-            Product Class : {pro_class}
-            User query: {query} 
-            """,
-                deps=None,
-                usage=context.usage,
-                usage_limits=self.usage_limits
-            )
-            user_prompt = res.output
-            # logger.info(f'node prompt_user0 , deps: {context.deps}')
-            # qE = input(user_prompt + "\nAnswer: ")
-            qE = await self.coach.prompt_user(user_prompt)
-            if qE:
-                context.deps.query += ' ' + qE
-            else:
-                raise
-            step = f'Step {context.deps.steps}: prompt_user0 -> {context.deps.query}'
-            context.deps.flow.append(step)
-            logger.info(step)
-            # return qE
-
-        @self.shop_agent.tool
-        async def get_best_site(context: RunContext[ShopDeps]) -> None:
-            """Get the best & most suitable website for searching the users product"""
-            # logger.info(f'node get_best_site , deps: {context.deps}')
-            context.deps.steps += 1
-            pro_class = context.deps.search_specs.pro_class
-            # best_site = await search_agent.run(f"Find the best website to search for {pro_class.category} of type {pro_class.type}. Just return the domain name without any prefixes or suffixes.", usage=context.usage, deps=context.deps.search_deps)
-            best_site = 'https://www.flipkart.com'
-            context.deps.search_specs.site = best_site
-            step = f'Step {context.deps.steps}: get_best_site -> {best_site}'
-            context.deps.flow.append(step)
-            logger.info(step)
-            # return best_site
-
-        @self.shop_agent.tool
-        async def get_site_filters(context: RunContext[ShopDeps]) -> None:
-            """Retrieve all the available filters on the best site for the product
-            - Use to retrieve all the available filters for the product on the site 
-            - This can then be later used to retrieve user preferences for filtering the products
-            """
-            # logger.info(f'node get_site_filters , deps: {context.deps}')
-            context.deps.steps += 1
-            context.deps.context_man, context.deps.playwright, context.deps.browser, context.deps.context, context.deps.page = await playwright_enter()
-            # filters = await search_agent.run(f"Retrieve all the filters available on {context.deps.search_specs.site}", usage=context.usage, deps=context.deps.search_deps)
-            context.deps.search_specs.site_filters = await get_filters(context.deps.page, context.deps.search_specs.site, context.deps.query)
-            step = f'Step {context.deps.steps}: get_site_filters -> {len(context.deps.search_specs.site_filters) if context.deps.search_specs.site_filters else 0}'
-            context.deps.flow.append(step)
-            logger.info(step + f'\n{context.deps.search_specs.site_filters}')
-            # return context.deps.search_specs.site_filters
-
-        @self.shop_agent.tool
-        async def trim_site_filters(context: RunContext[ShopDeps]) -> None:
-            context.deps.steps += 1
-            filtered_site_filters = await self.gen_agent.run(
-            user_prompt=f"""
-            You are an specialised agent that takes in a list of UserFilters[name, type, selection, range] & 
-            returns a list of UserFilter only containing relevant filters based on their attributes & the user query. 
-            EXCLUDE Filters that only have 1 option in their selection !
-            EXCLUDE Filters whose values users has already given in {context.deps.query} !
-            Using user query, additional information provided by the user & the product - select the most important filters
-            
-            Filters availble: {context.deps.search_specs.site_filters}
-            Input User Query: {context.deps.og_query}
-            User specified product features: {context.deps.query} 
-            """,
-            usage = context.usage,
-            usage_limits = self.usage_limits,
-            output_type=List[UserFilter])
-
-            context.deps.search_specs.filtered_site_filters = filtered_site_filters.output
-            step = f'Step {context.deps.steps}: trim_site_filters {len(context.deps.search_specs.site_filters)} -> {len(filtered_site_filters.output) if filtered_site_filters.output else 0}'
-            context.deps.flow.append(step)
-            logger.info(step + f'\nTrimmed User filters: \n{filtered_site_filters.output}')
-
-        @self.shop_agent.tool 
-        async def prompt_user1(context: RunContext[ShopDeps]) -> None:
-            """Prompt the user for how to apply filters 
-            - Using the previously fetched site filters available - get exact user preferences on how to filter the products
-            - Store these user filters in a structured form such that these can be applied while searching for products
-            """
-            # logger.info(f'node prompt_user1 , deps: {context.deps}')
-            context.deps.steps += 1
-            filters = context.deps.search_specs.filtered_site_filters if context.deps.search_specs.filtered_site_filters else context.deps.search_specs.site_filters
-            if filters:
-                res = ''
-                for filter in filters:
-                    user_prompt = f" describe how {filter} should be used: \nleave blank to skip !"
-                    # res += f'Filter: {filter}, Answer:{input(user_prompt + "Answer: ")}\n'
-                    ans = (await self.coach.prompt_user(user_prompt)).strip()
-                    if ans and ans != '.':
-                        res += f'Filter: {filter}, Answer:{ans}\n'
-                list_user_filter_schema = pydantic.TypeAdapter(List[UserFilter]).json_schema()
-                # logger.info(f'User Filter response:{res}\nlist_user_filter_schema: {list_user_filter_schema}')
-                user_filters = await self.gen_agent.run(
-                    user_prompt=f"""
-                    You are an specialised agent that takes in different user preferences & filters for a product - compiles & captures the user intent &
-                    return output in the specified pydantic base model format.
-                    The Filters are listed one by one with the format => Filter: name type all_possible values Answer: User answer 
-                    STRICTLY , IF THE USER GIVES NO ANSWER FOR A FILTER - COMPLETELY SKIP THAT FILTER !!!
-                    Pay special attention to the text after Answer: & select the appropriate choices from the selection or range given at the start for each filter.
-                    
-                    EXAMPLE:
-                    Input :
-                    Filter: name='CLOCK SPEED' type='multiselect' selection=['1.5 - 1.9 GHz', '2 - 2.5 GHz', '2.2 - 2.4 GHz', '2.5 GHz Above', 'Below 1.5 GHz', 'Less than 900 MHz'] range=None, Answer: 1 
-                    Explanation : For the above Filter , the user has given their preferred value - match it with the appropriate present value & return the result . If no values match - skip the particular filter
-                    Output: UserFilter(name='CLOCK SPEED', type='multiselect', selection=['Below 1.5 GHz', 'Less than 900 MHz'], range=None)]) 
-
-                    Input Query: {res} 
-                    """,
-                    usage = context.usage,
-                    usage_limits = self.usage_limits,
-                    output_type=List[UserFilter]
-                )
-                # logger.info(f'Gen User filters: {user_filters}')
-                context.deps.search_specs.user_filters = user_filters.output
-                step = f'Step {context.deps.steps}: prompt_user1 -> {len(user_filters.output) if user_filters.output else 0}'
-                context.deps.flow.append(step)
-                logger.info(step + f'\nUser filters: \n{user_filters.output}')
-                # return user_filters.output
-
-        @self.shop_agent.tool
-        async def get_candidates(context: RunContext[ShopDeps]) -> List[Product] | None:
-            """Get a list of filtered candidate products matching the user's query
-            - Final Output 
-            - use search query enriched with user details & rephrase_query along with user provided filters to get the final eligible candidates
-            - End the user request & return them the relevant desired products
-              """
-            # logger.info(f'node get_candidates , deps: {context.deps}')
-            context.deps.steps += 1
-            best_site, search_query, user_filters = context.deps.search_specs.site, context.deps.query, context.deps.search_specs.user_filters
-            # if user_filters:
-            products = await get_filtered_products(context.deps.page, best_site, search_query, user_filters, top_k=top_k)
-            if products and len(products) > 0:
-                context.deps.candidates = products
-            else:
-                logger.info('Running fallback get_products')
-                products = await get_filtered_products(context.deps.page, best_site, search_query, None, top_k=top_k)                
-            step = f'Step {context.deps.steps}: get_candidates -> {len(products) if products else 0}'
-            # logger.info(f'Products: {products}')
-            await playwright_exit(context.deps.context_man)
-            context.deps.context_man, context.deps.playwright, context.deps.browser, context.deps.context, context.deps.page = None, None, None, None, None
-            context.deps.flow.append(step)
-            logger.info(step + f'\nProduct:\n{products}')
-            return products
-
-        @self.shop_agent.output_validator
-        def val_op(context:RunContext[ShopDeps], op: ShopResult) -> ShopResult:
-            logger.info(f'pre op: {op}')
-            op.flow = context.deps.flow
-            op.steps = context.deps.steps
-            op.products = context.deps.candidates if context.deps.candidates else []
-            return op
+    async def chat(self, user_query: str, searchspecs: Optional[SearchSpecs] = None, on_event: Any = None, session_id: Optional[str] = None) -> Any:
+        """Run the shopping agent for one query
+        - on_event: async callback receiving {'type': 'step'}, {'type': 'product'} & {'type': 'queue'} events while the agent runs
+        - session_id: connection the work is scheduled fairly for, defaults to this chatbot
+        - raises SchedulerBusy when the server is over its backlog
+        """
+        # a fresh SearchSpecs per call - the agent mutates it, so a shared default would leak filters between sessions
+        shop_deps = ShopDeps(og_query=user_query, query=user_query, llm=None , model_id=MODEL_ID, search_specs=searchspecs or SearchSpecs(), candidates=[],
+                             on_event=on_event, started=time.monotonic(), prefetcher=Prefetcher(top_k=self.top_k),
+                             coach=self.coach, top_k=self.top_k)
 
-        logger.info('Chatbot initialised !')
+        async def on_queued(stage: str, position: int) -> None:
+            await emit(shop_deps, {'type': 'queue', 'stage': stage, 'position': position})
 
-    async def chat(self, user_query: str, searchspecs: SearchSpecs = SearchSpecs()) -> Any:
-        shop_deps = ShopDeps(query=user_query, llm=None , model_id=MODEL_ID, search_specs=searchspecs, candidates=[]) 
-        res = await self.shop_agent.run(user_query, deps=shop_deps)
+        scheduler = get_scheduler()
+        with scheduler.session(session_id or str(id(self)), on_queued), span('chat', session=session_id or str(id(self))) as chat_span:
+            summary = current_summary.get()
+            scheduler.admit()
+            try:
+                res = await self.shop_agent.run(user_query, deps=shop_deps)
+            finally:
+                shop_deps.prefetcher.cancel()
+            usage = res.usage()
+            chat_span.set(input_tokens=usage.input_tokens, output_tokens=usage.output_tokens, requests=usage.requests)
+        total = time.monotonic() - shop_deps.started
+        get_chat_metrics().record(shop_deps.first_product_after, total)
+        res.output.timings = {'total': round(total, 3), **timing_summary(summary)}
         logger.info(f'Final Answer: \n\n{res}')
+        first_product = f'{shop_deps.first_product_after:.2f}s' if shop_deps.first_product_after is not None else '-'
+        logger.info(f'Time to first product: {first_product}, total: {total:.2f}s\nTimings: {res.output.timings}')
         # for i, product in enumerate(res.output.products):
         #     logger.info(f'Product {i}: \n - Name: {product.name} \n - Price: {product.price} \n - Review: {product.review} \n - Link: {product.url}')
         logger.info(f'Recommended product: {res.output.recommended} \n{res.output.message} \nAgent Workflow: {res.output.flow}')
+        logger.info(f'Answered locally: {res.output.local_steps}')
         logger.info(f'Usage: {res.usage()}')
         return res
 
+    @staticmethod
+    def response_event(res: Any) -> Dict[str, Any]:
+        """The final 'response' event of a chat"""
+        return {
+            'type': 'response',
+            'message': res.output.message,
+            'products': [p.model_dump(mode='json') for p in res.output.products if p],
+            'recc': res.output.recommended.model_dump(mode='json') if res.output.recommended else None,
+            'flow': res.output.flow,
+            'steps': res.output.steps,
+            'local_steps': res.output.local_steps,
+            'time_to_first_product': res.output.time_to_first_product,
+            'prefetch_hidden': res.output.prefetch_hidden,
+            'timings': res.output.timings,
+        }
+
+    async def chat_stream(self, user_query: str, searchspecs: Optional[SearchSpecs] = None, session_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """chat() as a stream of events: 'step's & 'product's as they happen, then the final 'response'
+        - errors of the agent run are raised after the events streamed so far
+        """
+        events: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(self.chat(user_query, searchspecs or SearchSpecs(), on_event=events.put, session_id=session_id))
+        task.add_done_callback(lambda _: events.put_nowait(None))
+        try:
+            while (event := await events.get()) is not None:
+                yield event
+            yield self.response_event(await task)
+        finally:
+            if not task.done():
+                task.cancel()
+
 async def main():
+    chatbot = Chatbot()
     while True:
         user_query = input('What do you want to SHOP today !!!\n')
         searchspecs = SearchSpecs()
-        chatbot = Chatbot()
         await chatbot.chat(user_query, searchspecs)
 
 if __name__ == "__main__":
@@ -94,17 +94,22 @@ class SearchSpecs(BaseModel):
     pro_class : Annotated[ProductClass ,Field(description="The category/type of the product")] = ProductClass()
     query: Annotated[str, Field(description="The user's query for the product")] = ''
     site: Annotated[str, Field(description="The best website to search for the product")] = ''
+    sites: Annotated[List[str], Field(description="All websites searched for the product, best site first")] = []
     site_filters: Annotated[Optional[List[UserFilter]], Field(description="A list of filters available on the site")] = None
     filtered_site_filters: Annotated[Optional[List[UserFilter]], Field(description="A list of filters relevant to the user")] = None
     user_filters: Annotated[Optional[List[UserFilter]], Field(description="A list of filters to apply when searching for the product")] = None
 
 class ShopResult(BaseModel):
     """Final Result of the shopping agent"""
-    products: List[Product] = Field(description="A list of products matching the user's query")
-    recommended: Product = Field(description="The best product matching the user's query")
-    message: Optional[str] = Field(description="A message indicating if no products were found")
+    products: List[Product] = Field(default=[], description="Filled in locally with the ranked candidates - leave empty")
+    recommended: Optional[Product] = Field(default=None, description="Filled in locally with the best ranked candidate - leave empty")
+    message: Optional[str] = Field(description="A short message to the user about the candidates found, or that no products were found")
     flow: List[str] = []
     steps: int = 0
+    local_steps: List[str] = Field(default=[], description="Steps answered locally without an LLM call")
+    time_to_first_product: Optional[float] = Field(default=None, description="Seconds from the user query to the first streamed product")
+    prefetch_hidden: float = Field(default=0.0, description="Seconds of searching done speculatively while the user answered prompts")
+    timings: Dict[str, float] = Field(default={}, description="Seconds spent per traced step (tools, LLM calls, navigations ...) & in total")
 
 # class SearchResult(BaseModel):
 #     """Final Result of the shopping agent"""
@@ -133,12 +138,17 @@ class ShopDeps(BaseModel):
     candidates : Annotated[Optional[List[Product]], Field(description="A list of candidate products")] = None
     flow: List[str] = []
     steps: int = 0
-    # playwright states
-    context_man : Any = None
-    playwright: Any = None
-    browser: Any = None
-    context: Any = None
-    page: Any = None 
+    local_steps: List[str] = []
+    # the session: Chatbot.CoachChatbot prompting the user over its websocket & the number of candidates wanted
+    coach: Any = None
+    top_k: int = 10
+    # async callback(event: dict) streaming step / product events while the agent runs
+    on_event: Any = None
+    started: float = 0.0
+    first_product_after: Optional[float] = None
+    # speculative search run while the user answers prompts (prefetch.Prefetcher)
+    prefetcher: Any = None
+    prefetch_hidden: float = 0.0
 
 
     @model_validator(mode='after')
@@ -0,0 +1,156 @@
+import re
+from typing import List, Optional, Dict, Tuple
+from pydantic import BaseModel
+from pydantic_models import ProductClass, CategoryEnum
+
+LOCAL_CONFIDENCE = 0.8      # below this the LLM is asked instead
+LINE_CONFIDENCE = 0.6       # class from a product line alone ('galaxy s24') - a hint for the LLM, never trusted locally
+MAX_QUERY_WORDS = 7
+
+# product type keyword -> (category, type). Longer phrases are matched first
+TYPE_LEXICON: Dict[str, Tuple[CategoryEnum, str]] = {
+    **{k: (CategoryEnum.ELECTRONICS, 'smartphone') for k in ('smartphone', 'smart phone', 'mobile phone', 'mobile', 'phone', 'iphone')},
+    **{k: (CategoryEnum.ELECTRONICS, 'laptop') for k in ('laptop', 'notebook', 'macbook', 'chromebook')},
+    **{k: (CategoryEnum.ELECTRONICS, 'tablet') for k in ('tablet', 'ipad', 'tab', 'galaxy tab', 'pixel tablet')},
+    **{k: (CategoryEnum.ELECTRONICS, 'headphones') for k in ('headphones', 'headphone', 'earbuds', 'earphones', 'airpods', 'headset', 'tws', 'buds')},
+    **{k: (CategoryEnum.ELECTRONICS, 'television') for k in ('television', 'smart tv', 'tv')},
+    **{k: (CategoryEnum.ELECTRONICS, 'smartwatch') for k in ('smartwatch', 'smart watch', 'apple watch', 'galaxy watch', 'pixel watch', 'fitness band')},
+    **{k: (CategoryEnum.ELECTRONICS, 'camera') for k in ('camera', 'dslr', 'mirrorless')},
+    **{k: (CategoryEnum.ELECTRONICS, 'speaker') for k in ('speaker', 'soundbar', 'bluetooth speaker')},
+    **{k: (CategoryEnum.ELECTRONICS, 'monitor') for k in ('monitor',)},
+    **{k: (CategoryEnum.ELECTRONICS, 'power bank') for k in ('power bank', 'powerbank')},
+    **{k: (CategoryEnum.FASHION, 't-shirt') for k in ('t-shirt', 't shirt', 'tshirt', 'tee')},
+    **{k: (CategoryEnum.FASHION, 'shirt') for k in ('shirt',)},
+    **{k: (CategoryEnum.FASHION, 'jersey') for k in ('jersey',)},
+    **{k: (CategoryEnum.FASHION, 'jeans') for k in ('jeans', 'denim')},
+    **{k: (CategoryEnum.FASHION, 'shoes') for k in ('shoes', 'sneakers', 'running shoes', 'boots', 'sandals', 'slippers')},
+    **{k: (CategoryEnum.FASHION, 'dress') for k in ('dress', 'gown')},
+    **{k: (CategoryEnum.FASHION, 'jacket') for k in ('jacket', 'hoodie', 'sweatshirt', 'sweater')},
+    **{k: (CategoryEnum.FASHION, 'kurta') for k in ('kurta', 'kurti', 'saree', 'sari')},
+    **{k: (CategoryEnum.FASHION, 'trousers') for k in ('trousers', 'pants', 'chinos', 'shorts', 'joggers')},
+    **{k: (CategoryEnum.BOOKS, 'book') for k in ('book', 'books', 'novel', 'textbook', 'paperback', 'hardcover')},
+    **{k: (CategoryEnum.HOME_APPLIANCES, 'refrigerator') for k in ('refrigerator', 'fridge')},
+    **{k: (CategoryEnum.HOME_APPLIANCES, 'washing machine') for k in ('washing machine',)},
+    **{k: (CategoryEnum.HOME_APPLIANCES, 'microwave') for k in ('microwave', 'oven', 'otg')},
+    **{k: (CategoryEnum.HOME_APPLIANCES, 'air conditioner') for k in ('air conditioner', 'split ac', 'window ac', 'ac')},
+    **{k: (CategoryEnum.HOME_APPLIANCES, 'vacuum cleaner') for k in ('vacuum cleaner', 'vacuum')},
+    **{k: (CategoryEnum.HOME_APPLIANCES, 'air fryer') for k in ('air fryer',)},
+    **{k: (CategoryEnum.HOME_APPLIANCES, 'water purifier') for k in ('water purifier', 'ro purifier')},
+    **{k: (CategoryEnum.HOME_APPLIANCES, 'mixer grinder') for k in ('mixer grinder', 'mixer', 'grinder', 'blender')},
+    **{k: (CategoryEnum.HOME_APPLIANCES, 'fan') for k in ('ceiling fan', 'table fan', 'fan')},
+}
+
+# product lines span product types ('galaxy tab', 'galaxy buds', 'pixel watch'): only a guess when no type word is found
+PRODUCT_LINES: Dict[str, Tuple[CategoryEnum, str]] = {
+    k: (CategoryEnum.ELECTRONICS, 'smartphone') for k in ('galaxy', 'pixel', 'redmi note', 'oneplus nord')
+}
+
+BRANDS = {
+    'apple', 'samsung', 'oneplus', 'xiaomi', 'redmi', 'poco', 'realme', 'vivo', 'oppo', 'iqoo', 'google', 'motorola', 'nokia',
+    'nothing', 'sony', 'lg', 'hp', 'dell', 'lenovo', 'asus', 'acer', 'msi', 'boat', 'jbl', 'bose', 'sennheiser', 'noise',
+    'nike', 'adidas', 'puma', 'reebok', 'levis', 'zara', 'h&m', 'allen solly', 'van heusen', 'whirlpool', 'haier', 'godrej',
+    'voltas', 'daikin', 'philips', 'bajaj', 'prestige', 'kent', 'dyson', 'canon', 'nikon', 'fujifilm', 'mi', 'tcl', 'panasonic',
+}
+
+COLORS = {
+    'black', 'white', 'blue', 'red', 'green', 'yellow', 'pink', 'purple', 'grey', 'gray', 'silver', 'gold', 'orange',
+    'brown', 'beige', 'navy', 'maroon', 'teal', 'titanium', 'graphite', 'midnight', 'starlight',
+}
+
+ATTRIBUTE_PATTERNS = [
+    re.compile(r'\b\d+(?:\.\d+)?\s?(?:gb|tb)\b'),                       # storage / ram
+    re.compile(r'\b\d+(?:\.\d+)?\s?(?:inch|inches|in|")(?=\s|$)'),      # screen size
+    re.compile(r'\b\d+\s?(?:mah|mp|hz|w|l|litre|litres|ton|kg)\b'),     # battery, camera, refresh rate, capacity
+    re.compile(r'\b(?:5g|4g|dual sim|esim|amoled|oled|qled|led|wifi|bluetooth|wireless|anc|inverter|front load|top load)\b'),
+    re.compile(r'\b(?:size\s?(?:xs|s|m|l|xl|xxl|\d+)|xs|xl|xxl|xxxl|uk\s?\d+)\b'),    # apparel & shoe sizes
+    re.compile(r'\b(?:men|mens|women|womens|boys|girls|kids|unisex)\b'),
+]
+
+# budgets are attributes but stay out of the search query - prices are filtered & ranked instead
+BUDGET_PATTERN = re.compile(r'\b(?:under|below|less than|upto|up to|within|max|budget)\s?(?:of\s)?(?:rs\.?|₹|inr)?\s?\d[\d,]*k?\b')
+
+# 'phone case', 'laptop bag' ... name the product type they belong to, not the product itself
+ACCESSORY_WORDS = {
+    'case', 'cover', 'charger', 'cable', 'protector', 'tempered', 'stand', 'strap', 'skin', 'adapter', 'holder', 'bag',
+    'sleeve', 'mount', 'remote', 'battery', 'screen guard', 'back cover', 'lens', 'tripod', 'refill', 'filter',
+}
+
+STOPWORDS = {
+    'i', 'im', 'want', 'wanna', 'need', 'a', 'an', 'the', 'looking', 'look', 'for', 'to', 'buy', 'get', 'please', 'me',
+    'show', 'some', 'find', 'with', 'and', 'of', 'in', 'that', 'has', 'have', 'is', 'it', 'my', 'good', 'new', 'latest',
+    'one', 'something', 'like', 'would', 'can', 'you', 'which', 'should', 'also', 'preferably', 'ideally', 'around',
+}
+
+class QueryAnalysis(BaseModel):
+    """Locally derived product class & search query with how much they can be trusted"""
+    pro_class: ProductClass = ProductClass()
+    query: str = ''
+    attributes: List[str] = []
+    brand: Optional[str] = None
+    class_confidence: float = 0.0
+    confidence: float = 0.0
+
+    @property
+    def class_is_local(self) -> bool:
+        return self.class_confidence >= LOCAL_CONFIDENCE
+
+    @property
+    def query_is_local(self) -> bool:
+        return self.confidence >= LOCAL_CONFIDENCE
+
+def _find_phrases(text: str, phrases) -> List[str]:
+    found = []
+    for phrase in sorted(phrases, key=len, reverse=True):
+        if re.search(r'(?<![\w-])' + re.escape(phrase) + r'(?![\w-])', text) and not any(phrase in f for f in found):
+            found.append(phrase)
+    return found
+
+def analyze_query(query: str) -> QueryAnalysis:
+    """Rule & lexicon based ProductClass and concise search query
+    - class_confidence: one unambiguous product type found, a product line alone stays below LOCAL_CONFIDENCE
+    - confidence (of the whole query): product type plus concrete attributes (brand, storage, colour, size, budget ...)
+    """
+    text = ' '.join(query.lower().replace('’', "'").split())
+    type_hits = _find_phrases(text, TYPE_LEXICON)
+    classes = {TYPE_LEXICON[hit] for hit in type_hits}
+    analysis = QueryAnalysis()
+    if len(classes) == 1:
+        category, pro_type = classes.pop()
+        analysis.pro_class = ProductClass(category=category, type=pro_type)
+        analysis.class_confidence = 0.9
+    elif classes:
+        category, pro_type = TYPE_LEXICON[type_hits[0]]
+        analysis.pro_class = ProductClass(category=category, type=pro_type)
+        analysis.class_confidence = 0.4
+    elif line_hits := _find_phrases(text, PRODUCT_LINES):
+        category, pro_type = PRODUCT_LINES[line_hits[0]]
+        analysis.pro_class = ProductClass(category=category, type=pro_type)
+        analysis.class_confidence = LINE_CONFIDENCE
+    if _find_phrases(text, ACCESSORY_WORDS):
+        # let the LLM decide what the product actually is
+        analysis.class_confidence = min(analysis.class_confidence, 0.4)
+
+    brands = _find_phrases(text, BRANDS)
+    analysis.brand = brands[0] if brands else None
+    attributes = [m.group(0).strip() for pattern in ATTRIBUTE_PATTERNS + [BUDGET_PATTERN] for m in pattern.finditer(text)]
+    attributes += _find_phrases(text, COLORS)
+    # model numbers: digits glued to letters or standing alone next to a brand / type ('iphone 16', 's24')
+    attributes += [t for t in re.findall(r'\b[a-z]*\d+[a-z]*\b', text)
+                   if not any(t in a for a in attributes) and t not in type_hits]
+    analysis.attributes = list(dict.fromkeys(attributes))
+
+    specificity = len(analysis.attributes) + (1 if analysis.brand else 0)
+    analysis.confidence = min(1.0, analysis.class_confidence * (0.6 + 0.15 * specificity)) if analysis.class_confidence else 0.0
+    analysis.query = normalize_search_query(BUDGET_PATTERN.sub(' ', text), keep=type_hits + brands + analysis.attributes)
+    return analysis
+
+def normalize_search_query(text: str, keep: List[str] = []) -> str:
+    """Short punctuation free search query: stop words dropped, recognised phrases kept whole, at most MAX_QUERY_WORDS words"""
+    text = re.sub(r"[^\w\s.&\-\"₹]", ' ', text.lower())
+    words = [w.strip('.') for w in text.split() if w.strip('.') and w not in STOPWORDS]
+    important = set(' '.join(keep).split())
+    # keep recognised words first when the query has to be cut
+    if len(words) > MAX_QUERY_WORDS:
+        ranked = sorted(range(len(words)), key=lambda i: (words[i] not in important, i))[:MAX_QUERY_WORDS]
+        words = [words[i] for i in sorted(ranked)]
+    return ' '.join(dict.fromkeys(words))
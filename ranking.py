@@ -0,0 +1,192 @@
+import os
+import re
+import math
+import logging
+import sys
+from functools import lru_cache
+from typing import List, Optional, Dict, Any, Tuple, Sequence
+import numpy as np
+from pydantic_models import UserFilter
+from records import ProductRecord
+from filter_matcher import parse_range, UNITS
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# score component -> weight, override with SHOP_RANK_WEIGHTS='price=1,rating=2,...'
+RANK_WEIGHTS = {
+    'price': 0.25,      # inside the budget (or cheaper among the candidates without one)
+    'rating': 0.35,     # bayesian average rating
+    'filters': 0.2,     # filters with a wanted option named in the title / highlights
+    'query': 0.2,       # query terms in the title / highlights
+}
+PRIOR_VOTES = 50.0          # bayesian prior weight, in ratings
+PRIOR_RATING = 3.5          # prior mean when no candidate is rated
+
+_TOKEN = re.compile(r'[a-z0-9]+(?:\.[0-9]+)?')
+_BUDGET_BELOW = re.compile(r'\b(?:under|below|less than|upto|up to|within|max|at most|budget(?: of)?)\s*(?:₹|rs\.?|inr)?\s*(\d[\d,]*(?:\.\d+)?)\s*(k)?\b', re.I)
+_BUDGET_ABOVE = re.compile(r'\b(?:above|over|more than|at least|min)\s*(?:₹|rs\.?|inr)?\s*(\d[\d,]*(?:\.\d+)?)\s*(k)?\b', re.I)
+
+def weights_from_env(spec: str = os.environ.get('SHOP_RANK_WEIGHTS', '')) -> Dict[str, float]:
+    weights = dict(RANK_WEIGHTS)
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        name, _, value = part.partition('=')
+        if name.strip() in weights:
+            weights[name.strip()] = float(value)
+        else:
+            logger.error(f'Unknown rank weight {name}')
+    return weights
+
+def _tokens(text: str) -> set:
+    return set(_TOKEN.findall(text.lower()))
+
+class _Separators(dict):
+    """str.translate table: everything but [a-z0-9.] & newlines becomes a space"""
+    def __missing__(self, code: int) -> int:
+        char = chr(code)
+        self[code] = code if char in '.\n' or ('a' <= char <= 'z') or ('0' <= char <= '9') else 32
+        return self[code]
+
+_SEPARATORS = _Separators()
+
+def term_hits(texts: List[str], terms: List[str]) -> np.ndarray:
+    """Candidates x terms: whether the text has the term as a whole token
+    - all texts are normalized in one translate over the joined corpus ('Black, 128 GB.' -> ' black  128 gb  '),
+      then each term is one vectorized np.char.find for ' term '
+    """
+    if not terms or not texts:
+        return np.zeros((len(texts), len(terms)), dtype=bool)
+    corpus = '\n'.join(text.replace('\n', ' ') for text in texts).lower().translate(_SEPARATORS).replace('. ', '  ')
+    padded = np.array((' ' + corpus.replace('\n', ' \n ') + ' ').split('\n'))
+    return np.stack([np.char.find(padded, f' {term} ') >= 0 for term in terms], axis=1)
+
+@lru_cache(maxsize=64)
+def _quantity_pattern(bases: Tuple[str, ...]) -> re.Pattern:
+    """A number followed by any unit of the given base units ('8 GB', '1 TB' for 'gb')"""
+    units = sorted((re.escape(u) for u, (base, _) in UNITS.items() if base in bases), key=len, reverse=True)
+    return re.compile(r'(\d+(?:\.\d+)?)\s*(' + '|'.join(units) + r')(?![a-z])')
+
+def quantities(texts: List[str], bases: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Every number with a unit of the wanted base units in the texts, converted (filter_matcher.UNITS): (text index, value, unit) arrays
+    - one regex pass over the joined corpus, text indices from the line offsets
+    """
+    corpus = '\n'.join(text.replace('\n', ' ') for text in texts).lower()
+    starts = np.fromiter((m.end() for m in re.finditer('\n', corpus)), dtype=np.int64)
+    positions, values, units = [], [], []
+    for m in _quantity_pattern(tuple(sorted(bases))).finditer(corpus):
+        base, factor = UNITS[m.group(2)]
+        positions.append(m.start())
+        values.append(float(m.group(1)) * factor)
+        units.append(base)
+    index = np.searchsorted(starts, np.asarray(positions, dtype=np.int64), side='right')
+    return index, np.asarray(values, dtype=np.float64), np.asarray(units, dtype=object)
+
+def _in_range(found: Tuple[np.ndarray, np.ndarray, np.ndarray], bounds: Tuple[float, float, str], rating: np.ndarray) -> np.ndarray:
+    """Candidates with a quantity inside the option's interval - '★' options compare the candidate's rating"""
+    low, high, unit = bounds
+    if unit == '★':
+        return (rating >= low) & (rating <= high)
+    index, values, units = found
+    inside = (units == unit) & (values >= low - 1e-9) & (values <= high + 1e-9)
+    return np.bincount(index[inside], minlength=len(rating)) > 0
+
+def _amount(number: str, thousands: Optional[str]) -> float:
+    return float(number.replace(',', '')) * (1000 if thousands else 1)
+
+def price_budget(query: str, user_filters: List[UserFilter] | None = None) -> Optional[Tuple[float, float]]:
+    """Price interval the user asked for: a price filter (range or its selected options), else 'under 20k' / 'above ₹500' in the query"""
+    for user_filter in user_filters or []:
+        if 'PRICE' not in user_filter.name.upper():
+            continue
+        if user_filter.range and any(bound is not None for bound in user_filter.range):
+            low, high = user_filter.range
+            return low or 0.0, high if high is not None else math.inf
+        bounds = [r for option in user_filter.selection or [] if (r := parse_range(option))]
+        if bounds:
+            return max(0.0, min(r[0] for r in bounds)), max(r[1] for r in bounds)
+    below, above = _BUDGET_BELOW.search(query or ''), _BUDGET_ABOVE.search(query or '')
+    if below or above:
+        return _amount(*above.groups()) if above else 0.0, _amount(*below.groups()) if below else math.inf
+    return None
+
+class Ranker:
+    """Deterministic candidate ranking: a weighted sum of per candidate scores in [0, 1], computed over numpy arrays
+    - price: 1 inside the budget, falling off with the relative distance outside it; without a budget cheaper is better
+    - rating: bayesian average (PRIOR_VOTES ratings at the candidates' mean) / 5, so 5★ from 3 ratings lands near the mean instead of on top
+    - filters: share of the user's filters with a wanted option in the title & highlights - all its tokens, or for numeric options
+      ('128 - 255.9 GB', '256 GB & Above') a quantity of that unit inside the interval
+    - query: share of the query terms found in the title & highlights
+    """
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None, prior_votes: float = PRIOR_VOTES):
+        self.weights = {**RANK_WEIGHTS, **(weights if weights is not None else weights_from_env())}
+        self.prior_votes = prior_votes
+
+    def scores(self, records: Sequence[ProductRecord], query: str = '', user_filters: List[UserFilter] | None = None,
+               budget: Optional[Tuple[float, float]] = None) -> Dict[str, np.ndarray]:
+        """Every score component per candidate & the weighted 'total'
+        - budget: price interval to score against, else price_budget(query, user_filters)
+        """
+        n = len(records)
+        price = np.fromiter((r.price for r in records), dtype=np.float64, count=n)
+        rating = np.fromiter((r.rating for r in records), dtype=np.float64, count=n)
+        votes = np.clip(np.fromiter((r.num_ratings for r in records), dtype=np.float64, count=n), 0, None)
+        texts = [' '.join([r.name, *r.details]) for r in records]
+
+        budget = budget or price_budget(query, user_filters)
+        if budget:
+            low, high = budget
+            below = np.where(price < low, (low - price) / max(low, 1.0), 0.0)
+            above = np.where(price > high, (price - high) / max(high, 1.0), 0.0) if math.isfinite(high) else 0.0
+            price_score = np.clip(1.0 - below - above, 0.0, 1.0)
+        elif n and price.max() > price.min():
+            price_score = 1.0 - (price - price.min()) / (price.max() - price.min())
+        else:
+            price_score = np.ones(n)
+
+        rated = votes > 0
+        mean = float((rating[rated] * votes[rated]).sum() / votes[rated].sum()) if rated.any() else PRIOR_RATING
+        rating_score = (self.prior_votes * mean + rating * votes) / (self.prior_votes + votes) / 5.0
+
+        # numeric options ('128 - 255.9 GB', '256 GB & Above', '4★ & above') are intervals, the rest token sets
+        groups = [[r if (r := parse_range(option)) and r[2] else sorted(_tokens(option)) for option in f.selection or [] if _tokens(option)]
+                  for f in user_filters or [] if 'PRICE' not in f.name.upper()]
+        groups = [group for group in groups if group]
+        # one term presence matrix (candidates x terms) for the wanted token options & the query
+        query_terms = sorted(_tokens(query or ''))
+        terms = sorted({term for group in groups for option in group if isinstance(option, list) for term in option} | set(query_terms))
+        column = {term: i for i, term in enumerate(terms)}
+        hits = term_hits(texts, terms)
+        # only the units the wanted options are in are looked for - '★' options read the rating instead
+        bases = {option[2] for group in groups for option in group if isinstance(option, tuple) and option[2] != '★'}
+        found = quantities(texts, bases) if bases else None
+        if groups:
+            # a token option is named when all its tokens are, an interval when a quantity in the text falls inside it;
+            # a filter is met when any of its wanted options is
+            met = [np.any([_in_range(found, option, rating) if isinstance(option, tuple) else hits[:, [column[t] for t in option]].all(axis=1)
+                           for option in group], axis=0) for group in groups]
+            filter_score = np.mean(met, axis=0)
+        else:
+            filter_score = np.ones(n)
+        query_score = hits[:, [column[t] for t in query_terms]].mean(axis=1) if query_terms else np.ones(n)
+
+        parts = {'price': price_score, 'rating': rating_score, 'filters': filter_score, 'query': query_score}
+        total = sum(self.weights.get(name, 0.0) * score for name, score in parts.items())
+        return {**parts, 'total': np.asarray(total, dtype=np.float64) + np.zeros(n)}
+
+    def rank(self, records: Sequence[ProductRecord], query: str = '', user_filters: List[UserFilter] | None = None,
+             budget: Optional[Tuple[float, float]] = None) -> List[ProductRecord]:
+        """Candidates best first - ties keep their search order"""
+        if not records:
+            return []
+        total = self.scores(records, query, user_filters, budget)['total']
+        order = np.argsort(-total, kind='stable')
+        return [records[i] for i in order]
+
+_ranker: Optional[Ranker] = None
+
+def get_ranker() -> Ranker:
+    global _ranker
+    if _ranker is None:
+        _ranker = Ranker()
+    return _ranker
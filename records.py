@@ -0,0 +1,117 @@
+import re
+import json
+import datetime
+import logging
+import sys
+from typing import List, Optional, Dict, Any
+from pydantic import BaseModel
+from pydantic_models import Product
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_NOT_DIGIT = re.compile(r'[^\d]')
+_COUNTS = re.compile(r'[\d,]+')
+
+class ProductRecord:
+    """A scraped product inside the scrape -> rank -> serialize pipeline: plain slots, parsed once, no pydantic
+    - from_raw: the extracted strings ('₹79,999', '1,234 Ratings & 56 Reviews') parsed with the same rules as Product / ProductReview
+    - to_dict: the exact Product.model_dump(mode='json') shape, for the websocket & the product cache
+    - to_product: the validated pydantic Product - only at the API boundary (agent tools, ShopResult)
+    """
+    __slots__ = ('name', 'price', 'url', 'image', 'rating', 'num_ratings', 'num_reviews', 'details')
+
+    def __init__(self, name: str, price: int, url: str, image: Optional[str] = None, rating: float = 0.0, num_ratings: int = -1,
+                 num_reviews: int = -1, details: Optional[List[str]] = None):
+        self.name = name
+        self.price = price
+        self.url = url
+        self.image = image
+        self.rating = rating
+        self.num_ratings = num_ratings
+        self.num_reviews = num_reviews
+        self.details = details or []
+
+    @classmethod
+    def from_raw(cls, raw: Dict[str, Any]) -> Optional['ProductRecord']:
+        """Record from an extracted item (EXTRACT_JS fields) - None when a value doesn't parse"""
+        try:
+            price = raw['price']
+            if isinstance(price, str):
+                price = int(_NOT_DIGIT.sub('', price))
+            rating = float(raw.get('rating') or 0.0)
+            if not 0.0 <= rating <= 5.0:
+                return None
+            num_ratings, num_reviews = -1, -1
+            if raw.get('rating') and raw.get('count'):
+                counts = _COUNTS.findall(raw['count'])
+                if counts:
+                    num_ratings = int(counts[0].replace(',', ''))
+                if len(counts) > 1:
+                    num_reviews = int(counts[1].replace(',', ''))
+            return cls(raw['name'], price, raw['href'], raw.get('image'), rating, num_ratings, num_reviews, raw.get('highlights') or [])
+        except (ValueError, TypeError, KeyError):
+            return None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ProductRecord':
+        """Record from a to_dict / Product.model_dump(mode='json') dict (trusted, e.g. the product cache)"""
+        review = data.get('review') or {}
+        return cls(data['name'], data['price'], data['url'], data.get('image'), review.get('ratings', 0.0), review.get('num_ratings', -1),
+                   review.get('num_reviews', -1), data.get('details') or [])
+
+    @classmethod
+    def from_product(cls, product: Product) -> 'ProductRecord':
+        return cls.from_dict(product.model_dump(mode='json'))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': None, 'pro_class': None, 'price': self.price, 'name': self.name, 'url': self.url, 'image': self.image,
+            'review': {'ratings': self.rating, 'num_ratings': self.num_ratings, 'num_reviews': self.num_reviews},
+            'details': self.details, 'delivery_date': None,
+        }
+
+    def to_product(self) -> Product:
+        return Product.model_validate(self.to_dict())
+
+    def __repr__(self) -> str:
+        return f'ProductRecord(name={self.name!r}, price={self.price}, url={self.url!r})'
+
+def records_from_raw(raws: List[Dict[str, Any]], require: tuple = ('name', 'price', 'href')) -> List[ProductRecord]:
+    """Records for the complete & valid extracted items, in order"""
+    records = []
+    for idx, raw in enumerate(raws):
+        if not all(raw.get(key) for key in require):
+            continue
+        record = ProductRecord.from_raw(raw)
+        if record is None:
+            logger.error(f'Error processing item {idx}: {raw}')
+            continue
+        records.append(record)
+    return records
+
+def to_products(records: List[ProductRecord]) -> List[Product]:
+    """Validate records into Products once, at the API boundary - invalid ones are dropped"""
+    products = []
+    for record in records:
+        try:
+            products.append(record.to_product())
+        except Exception as e:
+            logger.error(f'Invalid product {record}: {e}')
+    return products
+
+def _default(value: Any) -> Any:
+    if isinstance(value, ProductRecord):
+        return value.to_dict()
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode='json')
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+# compact, no circular reference walk - payloads are plain trees of dicts & lists
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), check_circular=False, default=_default)
+
+def encode_json(data: Any) -> str:
+    """JSON for the websocket: records & pydantic models are encoded inline, without a model_dump pass beforehand"""
+    return _encoder.encode(data)
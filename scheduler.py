@@ -0,0 +1,199 @@
+import os
+import asyncio
+import time
+import logging
+import sys
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, Callable
+from pydantic_ai.models.wrapper import WrapperModel
+from tracing import span
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAX_BROWSER = int(os.environ.get('SHOP_MAX_BROWSER', 4))    # concurrent browser bound stages (filters, site searches, refreshes)
+MAX_LLM = int(os.environ.get('SHOP_MAX_LLM', 8))            # concurrent LLM requests
+BACKLOG = int(os.environ.get('SHOP_BACKLOG', 32))           # queued stages per limiter before new work is rejected
+WAIT_WINDOW = 500                                           # recent queue waits kept for the stats
+
+# the connection (session) the current task works for & its async callback(stage, position) for queue events
+current_session: ContextVar[str] = ContextVar('current_session', default='-')
+current_listener: ContextVar[Optional[Callable]] = ContextVar('current_listener', default=None)
+
+class SchedulerBusy(Exception):
+    """The server is over its backlog - the request is rejected instead of queued"""
+
+class _Waiter:
+    def __init__(self, session: str):
+        self.session = session
+        self.granted = False
+        self.changed = asyncio.Event()
+        self.queued = time.monotonic()
+
+class FairLimiter:
+    """At most `limit` concurrent holders of a stage
+    - waiters are served round robin across sessions (FIFO within one session), so one busy connection can't starve the rest
+    - with `backlog` waiters queued further slot() calls raise SchedulerBusy
+    """
+
+    def __init__(self, name: str, limit: int, backlog: int = BACKLOG):
+        self.name = name
+        self.limit = max(1, limit)
+        self.backlog = backlog
+        self.active = 0
+        self.granted = 0
+        self.rejected = 0
+        self._queues: 'OrderedDict[str, deque]' = OrderedDict()
+        self._waits: deque = deque(maxlen=WAIT_WINDOW)
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def position(self, waiter: _Waiter) -> int:
+        """1 based place in line - sessions ahead in the rotation get one more turn than those behind"""
+        idx = self._queues[waiter.session].index(waiter)
+        sessions = list(self._queues)
+        start = sessions.index(waiter.session)
+        ahead = sum(min(len(self._queues[s]), idx + 1 if i < start else idx) for i, s in enumerate(sessions))
+        return ahead + 1
+
+    def _grant(self) -> None:
+        now = time.monotonic()
+        while self.active < self.limit and self._queues:
+            session, queue = self._queues.popitem(last=False)
+            waiter = queue.popleft()
+            if queue:
+                # served sessions go to the back of the rotation
+                self._queues[session] = queue
+            self.active += 1
+            self.granted += 1
+            self._waits.append(now - waiter.queued)
+            waiter.granted = True
+            waiter.changed.set()
+        for queue in self._queues.values():
+            for waiter in queue:
+                waiter.changed.set()
+
+    def _release(self) -> None:
+        self.active -= 1
+        self._grant()
+
+    def _drop(self, waiter: _Waiter) -> None:
+        queue = self._queues.get(waiter.session)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.session]
+        self._grant()
+
+    async def _notify(self, position: int) -> None:
+        listener = current_listener.get()
+        if not listener:
+            return
+        try:
+            await listener(self.name, position)
+        except Exception as e:
+            logger.error(f'Could not send queue position: {e}')
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.active < self.limit and not self._queues:
+            self.active += 1
+            self.granted += 1
+            self._waits.append(0.0)
+        else:
+            if self.waiting >= self.backlog:
+                self.rejected += 1
+                raise SchedulerBusy(f'Too many queued {self.name} requests ({self.waiting}), try again in a bit')
+            waiter = _Waiter(current_session.get())
+            self._queues.setdefault(waiter.session, deque()).append(waiter)
+            try:
+                with span(f'queue.{self.name}', position=self.position(waiter)):
+                    last = None
+                    while not waiter.granted:
+                        position = self.position(waiter)
+                        if position != last:
+                            last = position
+                            await self._notify(position)
+                            continue
+                        waiter.changed.clear()
+                        await waiter.changed.wait()
+            except BaseException:
+                if waiter.granted:
+                    self._release()
+                else:
+                    self._drop(waiter)
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        waits = list(self._waits)
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'waiting': self.waiting,
+            'sessions_waiting': len(self._queues),
+            'granted': self.granted,
+            'rejected': self.rejected,
+            'wait_avg': round(sum(waits) / len(waits), 3) if waits else 0.0,
+            'wait_max': round(max(waits), 3) if waits else 0.0,
+        }
+
+class Scheduler:
+    """Admission control for the chat server: separate fair limiters for browser bound stages & LLM calls"""
+
+    def __init__(self, max_browser: int = MAX_BROWSER, max_llm: int = MAX_LLM, backlog: int = BACKLOG):
+        self.backlog = backlog
+        self.browser = FairLimiter('browser', max_browser, backlog)
+        self.llm = FairLimiter('llm', max_llm, backlog)
+        self.rejected = 0
+
+    def admit(self) -> None:
+        """Reject a new chat right away when the queues are already over the backlog"""
+        if self.browser.waiting + self.llm.waiting >= self.backlog:
+            self.rejected += 1
+            raise SchedulerBusy('The shop assistant is busy right now, try again in a bit')
+
+    @contextmanager
+    def session(self, session_id: str, on_queued: Optional[Callable] = None):
+        """Run the enclosed work (& the tasks it starts) on behalf of a session"""
+        session_token = current_session.set(session_id)
+        listener_token = current_listener.set(on_queued)
+        try:
+            yield
+        finally:
+            current_session.reset(session_token)
+            current_listener.reset(listener_token)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'rejected_chats': self.rejected, 'browser': self.browser.stats(), 'llm': self.llm.stats()}
+
+_scheduler: Optional[Scheduler] = None
+
+def get_scheduler() -> Scheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+    return _scheduler
+
+class ScheduledModel(WrapperModel):
+    """Model whose requests wait for an 'llm' slot of the scheduler"""
+
+    async def request(self, *args: Any, **kwargs: Any) -> Any:
+        async with get_scheduler().llm.slot():
+            with span('llm.request', model=self.model_name) as request:
+                response = await super().request(*args, **kwargs)
+                request.set(input_tokens=response.usage.input_tokens, output_tokens=response.usage.output_tokens)
+                return response
+
+    @asynccontextmanager
+    async def request_stream(self, *args: Any, **kwargs: Any):
+        async with get_scheduler().llm.slot():
+            async with super().request_stream(*args, **kwargs) as response_stream:
+                yield response_stream
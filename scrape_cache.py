@@ -0,0 +1,226 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import logging
+import sys
+from typing import List, Optional, Dict, Any, Tuple
+import pydantic
+from pydantic_models import UserFilter, ProductClass
+from records import ProductRecord
+from product_urls import product_key, canonical_url
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get('SHOP_CACHE_DIR', '.cache')
+FACET_TTL = 7 * 24 * 3600.0         # s, site facets rarely change
+FACET_MAX_ENTRIES = 5000
+FACET_MAX_BYTES = 64 * 1024 * 1024
+PRODUCT_VOLATILE_TTL = 30 * 60.0     # s, price & rating counts
+PRODUCT_STABLE_TTL = 7 * 24 * 3600.0 # s, name, image & details
+PRODUCT_MAX_ENTRIES = 20000
+PRODUCT_MAX_BYTES = 256 * 1024 * 1024
+TOUCH_BATCH = 64                     # LRU access times buffered before one UPDATE + commit
+TOUCH_INTERVAL = 5.0                 # s, buffered access times are written at least this often
+
+UNITS = r'(gb|tb|mb|ghz|mhz|mah|mp|inch|inches|hz|w|kg|g|ml|l)'
+
+def normalize_query(query: str) -> str:
+    """Order & spacing insensitive form of a search query: 'iphone 256gb black' == 'iphone black 256 gb'"""
+    q = query.lower()
+    q = re.sub(r'(\d+(?:\.\d+)?)\s+' + UNITS + r'\b', r'\1\2', q)
+    tokens = re.findall(r'[a-z0-9.]+', q)
+    return ' '.join(sorted(set(t.strip('.') for t in tokens if t.strip('.'))))
+
+class SqliteCache:
+    """Small local key -> json cache with TTL, LRU eviction (entries & bytes) & hit/miss counters"""
+
+    def __init__(self, path: str, table: str, ttl: float, max_entries: int, max_bytes: int):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+        self._flushed = time.monotonic()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(f'CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL, size INTEGER)')
+        self._db.commit()
+
+    def get_raw(self, key: str, touch: bool = True) -> Optional[str]:
+        """Fresh value for `key` or None - expired entries are dropped. Callers count hits & misses
+        - touch: record the access for LRU eviction, buffered & written in batches (TOUCH_BATCH / TOUCH_INTERVAL)
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(f'SELECT value, created FROM {self.table} WHERE key = ?', (key,)).fetchone()
+            if row and now - row[1] <= self.ttl:
+                if touch:
+                    self._touched[key] = now
+                    if len(self._touched) >= TOUCH_BATCH or time.monotonic() - self._flushed > TOUCH_INTERVAL:
+                        self._flush_touches()
+                        self._db.commit()
+                return row[0]
+            if row:
+                self._db.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                self._db.commit()
+            return None
+
+    def put_raw(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute(f'INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?, ?)', (key, value, now, now, len(value)))
+            self._touched.pop(key, None)
+            # eviction needs the real access times
+            self._flush_touches()
+            self._evict()
+            self._db.commit()
+
+    def flush(self) -> None:
+        """Write the buffered access times now"""
+        with self._lock:
+            self._flush_touches()
+            self._db.commit()
+
+    def _flush_touches(self) -> None:
+        if self._touched:
+            self._db.executemany(f'UPDATE {self.table} SET accessed = ? WHERE key = ?', [(at, key) for key, at in self._touched.items()])
+            self._touched.clear()
+        self._flushed = time.monotonic()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._db.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+            self._db.commit()
+
+    def _evict(self) -> None:
+        count, size = self._db.execute(f'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}').fetchone()
+        while count > self.max_entries or size > self.max_bytes:
+            row = self._db.execute(f'SELECT key, size FROM {self.table} ORDER BY accessed ASC LIMIT 1').fetchone()
+            if not row:
+                break
+            self._db.execute(f'DELETE FROM {self.table} WHERE key = ?', (row[0],))
+            count, size = count - 1, size - row[1]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, size = self._db.execute(f'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}').fetchone()
+        total = self.hits + self.misses
+        return {'entries': count, 'bytes': size, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
+
+class FacetCache(SqliteCache):
+    """Site filters (List[UserFilter]) keyed by site + normalized query, with the ProductClass as a fallback key
+    - a hit on the class key alone is another query's facets: its options may be specific to that query (the brands of
+      'iphone 16' for 'samsung galaxy s24'), so it is served as stale & the caller should refresh it
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: float = FACET_TTL, max_entries: int = FACET_MAX_ENTRIES, max_bytes: int = FACET_MAX_BYTES):
+        super().__init__(path or os.path.join(CACHE_DIR, 'shop_cache.sqlite'), 'facets', ttl, max_entries, max_bytes)
+        self._adapter = pydantic.TypeAdapter(List[UserFilter])
+        self.class_hits = 0
+
+    @staticmethod
+    def keys(site: str, query: str, pro_class: Optional[ProductClass] = None) -> List[str]:
+        keys = [f'{site}|q:{normalize_query(query)}']
+        if pro_class and pro_class.type:
+            keys.append(f'{site}|class:{pro_class.category.value}:{normalize_query(pro_class.type)}')
+        return keys
+
+    def get(self, site: str, query: str, pro_class: Optional[ProductClass] = None) -> Tuple[Optional[List[UserFilter]], bool]:
+        """Cached filters for the query & whether they are stale (only found under the ProductClass key)"""
+        for i, key in enumerate(self.keys(site, query, pro_class)):
+            raw = self.get_raw(key)
+            if raw is not None:
+                self.hits += 1
+                self.class_hits += i > 0
+                return self._adapter.validate_json(raw), i > 0
+        self.misses += 1
+        return None, False
+
+    def put(self, site: str, query: str, site_filters: List[UserFilter], pro_class: Optional[ProductClass] = None) -> None:
+        raw = self._adapter.dump_json(site_filters).decode()
+        for key in self.keys(site, query, pro_class):
+            self.put_raw(key, raw)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), 'class_hits': self.class_hits}
+
+class ProductCache(SqliteCache):
+    """Scraped ProductRecords keyed by canonical product id
+    - entries older than stable_ttl are misses
+    - entries older than volatile_ttl are stale: still served, but the caller should refresh them
+    """
+
+    def __init__(self, path: Optional[str] = None, volatile_ttl: float = PRODUCT_VOLATILE_TTL, stable_ttl: float = PRODUCT_STABLE_TTL,
+                 max_entries: int = PRODUCT_MAX_ENTRIES, max_bytes: int = PRODUCT_MAX_BYTES):
+        super().__init__(path or os.path.join(CACHE_DIR, 'shop_cache.sqlite'), 'products', stable_ttl, max_entries, max_bytes)
+        self.volatile_ttl = volatile_ttl
+        self.stale_hits = 0
+        self.bytes_saved = 0
+        self.refreshes = 0
+
+    @staticmethod
+    def key(url: str) -> str:
+        return product_key(url)
+
+    def get(self, url: str) -> Tuple[Optional[ProductRecord], bool]:
+        """Cached product for `url` (with `url` as its url) & whether it is stale"""
+        raw = self.get_raw(self.key(url))
+        if raw is None:
+            self.misses += 1
+            return None, False
+        entry = json.loads(raw)
+        now = time.time()
+        if now - entry['stable_at'] > self.ttl:
+            self.misses += 1
+            return None, False
+        stale = now - entry['volatile_at'] > self.volatile_ttl
+        self.hits += 1
+        self.stale_hits += stale
+        self.bytes_saved += entry.get('page_bytes', 0)
+        product = ProductRecord.from_dict(entry['product'])
+        product.url = url
+        return product, stale
+
+    def put(self, url: str, product: ProductRecord, page_bytes: int = 0) -> None:
+        key = self.key(url)
+        now = time.time()
+        raw = self.get_raw(key, touch=False)
+        old = json.loads(raw) if raw else {}
+        entry = {
+            'product': product.to_dict(),
+            'volatile_at': now,
+            'stable_at': now,
+            'page_bytes': page_bytes or old.get('page_bytes', 0),
+        }
+        # a (re-)scrape reads the whole page, so the stable fields are as fresh as the volatile ones
+        entry['product']['url'] = canonical_url(url)
+        self.put_raw(key, json.dumps(entry))
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), 'stale_hits': self.stale_hits, 'bytes_saved': self.bytes_saved, 'refreshes': self.refreshes}
+
+_facet_cache: Optional[FacetCache] = None
+
+def get_facet_cache() -> FacetCache:
+    global _facet_cache
+    if _facet_cache is None:
+        _facet_cache = FacetCache()
+    return _facet_cache
+
+_product_cache: Optional[ProductCache] = None
+
+def get_product_cache() -> ProductCache:
+    global _product_cache
+    if _product_cache is None:
+        _product_cache = ProductCache()
+    return _product_cache
@@ -0,0 +1,220 @@
+import asyncio
+import time
+import logging
+import sys
+from abc import ABC, abstractmethod
+from urllib.parse import urlencode
+from typing import List, Optional, Dict, Any, Callable
+from pydantic_models import UserFilter, ProductClass, SearchSpecs
+from records import ProductRecord
+from product_urls import product_key, product_links
+from candidate_pool import CandidatePool, CandidateBudget
+from browser_pool import get_browser_pool
+from scheduler import get_scheduler, SchedulerBusy
+from tracing import span
+import site_scraper
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SITE_BUDGET = 45.0      # s, per site latency budget in the fan out - slower sites are cut off
+
+class SiteAdapter(ABC):
+    """Everything the agent needs from one shopping site"""
+    name: str
+    base_url: str
+
+    @abstractmethod
+    async def get_filters(self, page: Any, query: str, pro_class: Optional[ProductClass] = None, refresh: bool = False) -> List[UserFilter]:
+        """Filters available on the site for the query
+        - refresh: the caller already missed the facet cache - scrape without looking it up again (still storing)
+        """
+
+    @abstractmethod
+    async def search(self, page: Any, query: str, user_filters: List[UserFilter] | None = None) -> List[str]:
+        """Open the (filtered) results for the query & return the product links in rank order"""
+
+    @abstractmethod
+    async def get_tiles(self, page: Any) -> List[ProductRecord]:
+        """Products as shown on the currently open results page"""
+
+    @abstractmethod
+    async def get_product(self, url: str, page: Any, use_cache: bool = True) -> ProductRecord | None:
+        """Product from its product page"""
+
+    async def crawl(self, page: Any, pool: CandidatePool) -> None:
+        """Offer the product links of the result pages after the one `search` left open - none by default"""
+
+    async def get_candidates(self, page: Any, query: str, user_filters: List[UserFilter] | None = None, top_k: int = 10,
+                             on_product: Optional[Callable] = None, budget: Optional[CandidateBudget] = None) -> List[ProductRecord]:
+        """Up to `top_k` products, fetched while `crawl` still streams links from the later result pages
+        - budget: candidate links the whole search may fetch (shared across sites), a fresh CANDIDATE_BUDGET by default
+        """
+        pool = CandidatePool(top_k, budget)
+        for link in await self.search(page, query, user_filters):
+            pool.offer(link)
+        return await site_scraper.fetch_candidates(page.context, pool, self.crawl(page, pool), fetch_page=self.get_product,
+                                                   on_product=on_product)
+
+class FlipkartAdapter(SiteAdapter):
+    name = 'flipkart'
+    base_url = 'https://www.flipkart.com'
+
+    async def get_filters(self, page: Any, query: str, pro_class: Optional[ProductClass] = None, refresh: bool = False) -> List[UserFilter]:
+        return await site_scraper.get_filters(page, self.base_url, query, refresh=refresh, pro_class=pro_class) or []
+
+    async def search(self, page: Any, query: str, user_filters: List[UserFilter] | None = None) -> List[str]:
+        return await site_scraper.search_pro_links(page, self.base_url, query, user_filters)
+
+    async def crawl(self, page: Any, pool: CandidatePool) -> None:
+        await site_scraper.crawl_result_pages(page.context, page.url, self.base_url, pool)
+
+    async def get_tiles(self, page: Any) -> List[ProductRecord]:
+        return await site_scraper.get_products(self.base_url, page) or []
+
+    async def get_product(self, url: str, page: Any, use_cache: bool = True) -> ProductRecord | None:
+        return await site_scraper.get_product_page(url, page, use_cache)
+
+class FixtureAdapter(SiteAdapter):
+    """Adapter for the local fixture sites served by fixture_site.FixtureServer (see fixtures/site)"""
+
+    TILE_SPEC = {
+        'root': 'div.tile',
+        'fields': {
+            'href': {'selector': 'a.tile-link', 'attr': 'href'},
+            'name': {'selector': '.tile-name'},
+            'price': {'selector': '.tile-price'},
+            'image': {'selector': 'img', 'attr': 'src'},
+            'rating': {'selector': '.tile-rating'},
+            'count': {'selector': '.tile-count'},
+            'highlights': {'selector': 'li', 'many': True},
+        },
+    }
+    PRODUCT_SPEC = {
+        'root': 'body',
+        'ready': 'h1.product-name',
+        'fields': {
+            'image': {'selector': 'img.product-image', 'attr': 'src'},
+            'name': {'selector': 'h1.product-name'},
+            'price': {'selector': '.product-price'},
+            'rating': {'selector': '.product-rating'},
+            'count': {'selector': '.product-count'},
+            'highlights': {'selector': 'ul.highlights li', 'many': True},
+        },
+    }
+    FILTER_SPEC = {
+        'root': 'section.filter',
+        'fields': {
+            'name': {'selector': '.filter-name'},
+            'options': {'selector': 'label.option', 'many': True},
+        },
+    }
+
+    def __init__(self, name: str, base_url: str):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+
+    def search_url(self, query: str, user_filters: List[UserFilter] | None = None) -> str:
+        params = [('q', query)]
+        for user_filter in user_filters or []:
+            params += [('f', f'{user_filter.name}:{value}') for value in user_filter.selection or []]
+        return f'{self.base_url}/search?{urlencode(params)}'
+
+    async def get_filters(self, page: Any, query: str, pro_class: Optional[ProductClass] = None, refresh: bool = False) -> List[UserFilter]:
+        await site_scraper.navigate(page, self.search_url(query))
+        raws = await site_scraper.extract(page, self.FILTER_SPEC)
+        return [UserFilter(name=raw['name'], type='multiselect', selection=raw['options']) for raw in raws if raw.get('name')]
+
+    async def search(self, page: Any, query: str, user_filters: List[UserFilter] | None = None) -> List[str]:
+        await site_scraper.navigate(page, self.search_url(query, user_filters))
+        raws = await site_scraper.extract(page, {'root': 'div.tile a.tile-link', 'fields': {'href': {'attr': 'href'}}})
+        return product_links(self.base_url, (raw.get('href') for raw in raws))
+
+    async def get_tiles(self, page: Any) -> List[ProductRecord]:
+        raws = await site_scraper.extract(page, self.TILE_SPEC)
+        for raw in raws:
+            if raw.get('href'):
+                raw['href'] = self.base_url + raw['href']
+        return site_scraper.products_from_raw(raws)
+
+    async def get_product(self, url: str, page: Any, use_cache: bool = True) -> ProductRecord | None:
+        return await site_scraper.get_product_page(url, page, use_cache, spec=self.PRODUCT_SPEC)
+
+SITE_ADAPTERS: Dict[str, SiteAdapter] = {}
+
+def register_adapter(adapter: SiteAdapter) -> SiteAdapter:
+    SITE_ADAPTERS[adapter.base_url] = adapter
+    return adapter
+
+def get_adapter(site: str) -> SiteAdapter:
+    site = site.rstrip('/')
+    if site not in SITE_ADAPTERS:
+        raise KeyError(f'No site adapter registered for {site}')
+    return SITE_ADAPTERS[site]
+
+register_adapter(FlipkartAdapter())
+
+def merge_ranked(results: List[List[ProductRecord]]) -> List[ProductRecord]:
+    """Interleave per-site rankings (1st of every site, then 2nd, ...) dropping duplicate products"""
+    merged, seen = [], set()
+    for rank in range(max((len(r) for r in results), default=0)):
+        for products in results:
+            if rank < len(products):
+                product = products[rank]
+                key = product_key(product.url)
+                if key not in seen:
+                    seen.add(key)
+                    merged.append(product)
+    return merged
+
+async def search_sites(sites: List[str], specs: SearchSpecs, query: Optional[str] = None, top_k: int = 10, budget: float = SITE_BUDGET,
+                       on_product: Optional[Callable] = None) -> List[ProductRecord]:
+    """Query several site adapters concurrently for one SearchSpecs & merge their rankings
+    - each site runs on its own pool lease & browser slot & is cut off after `budget` seconds (queueing included)
+    - on_product: awaited once per distinct product as soon as any site resolves it
+    - all sites draw candidate links from one CandidateBudget, so a product id is fetched once per search
+    - a site cut off by its budget still contributes the products it had resolved (already streamed), in completion order
+    """
+    query = query or specs.query
+    streamed = set()
+    candidates = CandidateBudget()
+
+    async def stream(product: ProductRecord) -> None:
+        key = product_key(product.url)
+        if key not in streamed:
+            streamed.add(key)
+            await on_product(product)
+
+    async def search_site(site: str) -> List[ProductRecord]:
+        adapter = get_adapter(site)
+        # owned here, so a cut off site keeps what it resolved before the budget ran out
+        collected: List[ProductRecord] = []
+
+        async def collect(product: ProductRecord) -> None:
+            collected.append(product)
+            if on_product:
+                await stream(product)
+
+        async def run() -> List[ProductRecord]:
+            async with get_scheduler().browser.slot():
+                async with get_browser_pool().lease() as lease:
+                    return await adapter.get_candidates(lease.page, query, specs.user_filters, top_k, on_product=collect, budget=candidates)
+
+        start = time.monotonic()
+        try:
+            with span('site.search', site=adapter.name) as site_span:
+                products = await asyncio.wait_for(run(), budget)
+                site_span.set(products=len(products))
+        except asyncio.TimeoutError:
+            logger.error(f'{adapter.name} cut off after {budget}s, keeping {len(collected)} products')
+            return collected[:top_k]
+        except SchedulerBusy:
+            raise
+        except Exception as e:
+            logger.error(f'{adapter.name} search failed: {e}')
+            return collected[:top_k]
+        logger.info(f'{adapter.name}: {len(products)} products in {time.monotonic() - start:.2f}s')
+        return products
+
+    results = await asyncio.gather(*(search_site(site) for site in sites))
+    return merge_ranked(list(results))[:top_k]
@@ -1,3 +1,4 @@
+import os
 import json
 from os import name, wait
 from warnings import filters 
@@ -6,117 +7,308 @@ import asyncio
 import time 
 import re
 import random
-from typing import List, Optional, Dict, Any, Tuple
+from typing import List, Optional, Dict, Any, Tuple, Callable, Awaitable
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from playwright.async_api import async_playwright 
-from pydantic_models import ProductReview, UserFilter, Product, ProductClass
+from pydantic_models import UserFilter, ProductClass
+from records import ProductRecord, records_from_raw
+from browser_pool import BROWSER_ARGS, DEFAULT_TIMEOUT, get_browser_pool
+from scrape_cache import get_facet_cache, get_product_cache
+from scheduler import get_scheduler
+from tracing import span
+from waits import timed_op, add_waited, section_expanded
+from candidate_pool import CandidatePool, CandidateBudget
+from product_urls import product_links, product_key
+from facets import FACET_STATS, FacetPlan, learn_facet_key, click_batch, applied_facets, reclick_missing
 import logging
 import sys
 
 logging.basicConfig(stream=sys.stderr, level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-async def get_product_page(pro_url:str, page: Any) -> Product | None:
+FETCH_FANOUT = 4            # product pages fetched concurrently per search
+FETCH_ITEM_TIMEOUT = 20.0   # s, per product page
+CRAWL_PAGES = int(os.environ.get('SHOP_CRAWL_PAGES', 4))    # result pages read per search (1 = only the first)
+CRAWL_FANOUT = 2            # result pages 2..N read concurrently
+
+# Declarative selector specs - `root` matches one element per item, each field is read relative to it
+# selector: css selector (omit to read the root itself) | attr: read this attribute instead of innerText | many: list of all matches
+# ready (optional): selector to wait for before extracting
+SEARCH_TILE_SPEC = {
+    'root': 'div.cPHDOP',
+    'fields': {
+        'href': {'selector': 'a.CGtC98', 'attr': 'href'},
+        'name': {'selector': 'div.KzDlHZ'},
+        'price': {'selector': 'div.Nx9bqj._4b5DiR'},
+        'image': {'selector': 'img.DByuf4', 'attr': 'src'},
+        'rating': {'selector': 'div.XQDdHH'},
+        'count': {'selector': 'span.Wphh3N'},
+        'highlights': {'selector': 'li.J\\+igdf', 'many': True},
+    },
+}
+
+SEARCH_LINK_SPEC = {
+    'root': 'div.DOjaWF.gdgoEp div.cPHDOP a',
+    'fields': {
+        'href': {'attr': 'href'},
+    },
+}
+
+PRODUCT_PAGE_SPEC = {
+    'root': 'body',
+    'ready': 'div.C7fEHH h1._6EBuvT',
+    'fields': {
+        'image': {'selector': 'div.DOjaWF.gdgoEp.col-5-12.MfqIAz img', 'attr': 'src'},
+        'name': {'selector': 'div.C7fEHH h1._6EBuvT'},
+        'price': {'selector': 'div.C7fEHH div.Nx9bqj.CxhGGd'},
+        'rating': {'selector': 'div.C7fEHH div.XQDdHH'},
+        'count': {'selector': 'div.C7fEHH span.Wphh3N'},
+        'highlights': {'selector': 'div.xFVion li', 'many': True},
+    },
+}
+
+EXTRACT_JS = """
+({root, fields}) => Array.from(document.querySelectorAll(root)).map(el => {
+    const out = {};
+    for (const [key, f] of Object.entries(fields)) {
+        const read = n => f.attr ? n.getAttribute(f.attr) : (n.innerText || '').trim();
+        if (f.many) {
+            out[key] = Array.from(el.querySelectorAll(f.selector)).map(read).filter(v => v);
+        } else {
+            const n = f.selector ? el.querySelector(f.selector) : el;
+            out[key] = n ? read(n) : null;
+        }
+    }
+    return out;
+})
+"""
+
+async def navigate(page: Any, url: str) -> Any:
+    """page.goto inside a span with the response status, bytes transferred & requests blocked by the pool's RequestPolicy"""
+    policy = get_browser_pool().policy
+    if policy:
+        policy.begin(page)
+    with span('browser.goto', url=url) as nav:
+        response = await page.goto(url)
+        if response:
+            nav.set(status=response.status, bytes=int(response.headers.get('content-length') or 0))
+        if policy:
+            nav.set(blocked=policy.blocked_on(page))
+        return response
+
+async def wait_selector(page: Any, selector: str, **kwargs: Any) -> Any:
+    started, ok = time.perf_counter(), False
+    try:
+        with span('browser.wait', selector=selector):
+            element = await page.wait_for_selector(selector, **kwargs)
+            ok = True
+            return element
+    finally:
+        add_waited('selector', time.perf_counter() - started, ok)
+
+async def extract(page: Any, spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Extract every item matching `spec` with a single page.evaluate round-trip"""
+    if spec.get('ready'):
+        await wait_selector(page, spec['ready'])
+    with span('browser.extract', root=spec['root']) as ext:
+        raws = await page.evaluate(EXTRACT_JS, {'root': spec['root'], 'fields': spec['fields']})
+        ext.set(items=len(raws))
+    return raws
+
+def products_from_raw(raws: List[Dict[str, Any]], require: Tuple[str, ...] = ('name', 'price', 'href')) -> List[ProductRecord]:
+    """Parse raw extracted dicts into ProductRecords in one pass - incomplete or invalid items are skipped
+    - no pydantic here: records are validated into Products once, at the API boundary (records.to_products)
+    """
+    return records_from_raw(raws, require)
+
+def build_search_url(base_url: str, search_query: str, user_filters: List[UserFilter] | None = None) -> Tuple[str, List[UserFilter]]:
+    """Build the search results url with the query & facet parameters for the selected filters
+    - Returns the url & the filters that could not be mapped to a url parameter (yet)
+    """
+    plan = FacetPlan(user_filters)
+    return plan.url(base_url, search_query), plan.unmapped
+
+async def get_product_page(pro_url:str, page: Any, use_cache: bool = True, spec: Dict[str, Any] = PRODUCT_PAGE_SPEC) -> ProductRecord | None:
     try:
-        await page.goto(pro_url)
+        response = await navigate(page, pro_url)
         # await page.wait_for_selector('div._39kFie.N3De93.JxFEK3._48O0EI')
-        pro_visuals = page.locator('div.DOjaWF.gdgoEp.col-5-12.MfqIAz')
-        # await pro_visuals.first.wait_for(state='attached', timeout=1000)
-        # img_ele = pro_visuals.locator('img.DByuf4.IZexXJ.jLEJ7H')
-        img_ele = pro_visuals.locator('img').first
-        img = await img_ele.get_attribute('src') if await img_ele.count() else None
-        pro_desc = page.locator('div.DOjaWF.gdgoEp.col-8-12')
-        pro_intro = page.locator('div.C7fEHH')
-        name_ele = pro_intro.locator('h1._6EBuvT')
-        name = await name_ele.inner_text()
-        price_ele = pro_intro.locator('div.Nx9bqj.CxhGGd')
-        price = await price_ele.inner_text() if price_ele else None
-        rat_ele = pro_intro.locator('div.XQDdHH') # span.Y1HWO0 
-        if await rat_ele.count():
-            rat = await rat_ele.inner_text() 
-            num_ele = pro_intro.locator('span.Wphh3N')
-            if await num_ele.count():
-                num_rat, num_rev = re.findall(r'[\d,]+', await num_ele.inner_text()) 
-            else:
-                num_rat, num_rev = '-1', '-1'
-        else:
-            rat = '0.0'
-            num_rat, num_rev = '-1', '-1'
-        prod_rev = ProductReview.model_validate({'ratings':rat , 'num_ratings': num_rat, 'num_reviews': num_rev})
-        high = []
-        product = Product.model_validate({'name': name, 'price': price, 'url': pro_url, 'image': img, 'review': prod_rev, 'details': high})
-        return product
+        raws = await extract(page, spec)
+        if not raws:
+            logger.error(f'Nothing extracted from {pro_url}')
+            return None
+        raws[0]['href'] = pro_url
+        products = products_from_raw(raws, require=('name', 'price'))
+        if products and use_cache:
+            # the header, not the body - reading it back would cost one more round trip per product page
+            page_bytes = int(response.headers.get('content-length') or 0) if response else 0
+            # sqlite write & commit off the event loop
+            await asyncio.to_thread(get_product_cache().put, pro_url, products[0], page_bytes)
+        return products[0] if products else None
     except Exception as e:
         logger.error(f"Error while fetching {pro_url} deets: {e}")
 
-async def get_products(base_url: str , page: Any) -> List[Product] | None:
+async def fetch_pool(context: Any, pool: CandidatePool, fanout: int = FETCH_FANOUT, item_timeout: float = FETCH_ITEM_TIMEOUT,
+                     use_cache: bool = True, refresh: bool = False, fetch_page: Optional[Callable] = None,
+                     on_product: Optional[Callable] = None) -> List[ProductRecord]:
+    """Fetch the product pages of a candidate pool as its links stream in, on up to `fanout` pages of the same context
+    - workers take links while result pages are still being read & stop once the pool has enough products
+    - Results keep the order the links were offered in (search rank, then result page order)
+    - Failed or timed out products are dropped, the rest are still returned
+    - Cached products are returned right away, stale ones are refreshed in the background
+    - refresh: skip the cache lookup & re-scrape, still storing the results
+    - fetch_page: `(url, page, use_cache) -> ProductRecord | None`, defaults to the flipkart get_product_page
+    - on_product: awaited with every product as soon as it is resolved (completion order, not rank order)
+    """
+    fetch_page = fetch_page or get_product_page
+    results: Dict[int, ProductRecord] = {}
+    stale, opened = [], []
+    counts = {'cached': 0, 'fetched': 0, 'failed': 0}
+
+    async def worker() -> None:
+        worker_page = None
+        while (item := await pool.next()) is not None:
+            idx, pro_link = item
+            # sqlite read off the event loop, like the put
+            product, is_stale = await asyncio.to_thread(get_product_cache().get, pro_link) if use_cache and not refresh else (None, False)
+            if product:
+                counts['cached'] += 1
+                if is_stale:
+                    stale.append(pro_link)
+            else:
+                try:
+                    if worker_page is None:
+                        worker_page = await context.new_page()
+                        opened.append(worker_page)
+                    with span('scrape.product', url=pro_link):
+                        product = await asyncio.wait_for(fetch_page(pro_link, worker_page, use_cache), item_timeout)
+                except asyncio.TimeoutError:
+                    logger.error(f'Timed out after {item_timeout}s fetching {pro_link}')
+                except Exception as e:
+                    # one broken product page (or adapter) never costs the other results
+                    logger.error(f'Failed fetching {pro_link}: {e}')
+                counts['fetched' if product else 'failed'] += 1
+            if product and pool.accept(product):
+                results[idx] = product
+                if on_product:
+                    await on_product(product)
+
     try:
-        tiles = await page.query_selector_all("div.cPHDOP")
-        logger.info(f'Tiles: {len(tiles)} | {tiles}')
-        products = []
-        for idx,tile in enumerate(tiles):
+        await asyncio.gather(*(worker() for _ in range(max(1, fanout))))
+    finally:
+        for worker_page in opened:
             try:
-                link_ele = await tile.query_selector("a.CGtC98")
-                link = await link_ele.get_attribute("href") if link_ele else None
-                if link:
-                    link = base_url + link
-                logger.info('link:', link)
-                # Product name
-                name_ele = await tile.query_selector("div.KzDlHZ")
-                name = await name_ele.inner_text() if name_ele else None
-                logger.info('name:', name)
-                # Price
-                price_ele = await tile.query_selector("div.Nx9bqj._4b5DiR")
-                price = await price_ele.inner_text() if price_ele else None
-                logger.info('price:', price)
-                # Image
-                img_ele = await tile.query_selector("img.DByuf4")
-                image = await img_ele.get_attribute("src") if img_ele else None
-                logger.info('image:', image)
-                #Ratings
-                rat_ele = await tile.query_selector('div.XQDdHH')
-                rat = await rat_ele.inner_text() if rat_ele else 0.0
-                num_ele = await tile.query_selector('span.Wphh3N')
-                num_rat, num_rev = re.findall(r'[\d,]+', await num_ele.inner_text()) if num_ele else ('-1', '-1')
-                logger.info('ratings:', rat, num_rat, num_rev)
-                #Highlights
-                # ul_ele = await tile.query_selector('ul.G4BRas')
-                # if ul_ele:
-                li_ele = await tile.query_selector_all('li.J\\+igdf')
-                high = []
-                for li in li_ele:
-                    if li:
-                        high.append(await li.inner_text())
-                logger.info('high:', high)
-                # logger.info(f"{idx}. {name} | {price} | {link} | {image} | {rat} | {num_rat} | {num_rev} | {high}")
-                if name and price and link and image:
-                    # logger.info({'name': name, 'price': price, 'link': link, 'image': image, 'ratings': rat, 'num_ratings': num_rat, 'num_reviews': num_rev, 'mini_deets': high})
-                    prod_rev = ProductReview.model_validate(
-                        {'ratings':rat , 'num_ratings': num_rat, 'num_reviews': num_rev}
-                    )
-                    product = Product.model_validate(
-                        {'name': name, 'price': price, 'url': link, 'image': image, 'review': prod_rev, 'details': high}
-                    )
-                    products.append(product)
-            except Exception as e: 
-                logger.error(f'Error processing tile {idx}: {e}')
-        return products
+                await worker_page.close()
+            except Exception as e:
+                logger.error(f'Could not close worker page: {e}')
+    if stale:
+        refresh_in_background(stale, fetch_page)
+    products = [results[idx] for idx in sorted(results)]
+    logger.info(f"Fetched {len(products)}/{pool.offered} product pages ({counts['cached']} cached, {len(stale)} stale, "
+                f"{counts['failed']} failed, fanout={fanout})")
+    return products
+
+async def fetch_product_pages(context: Any, pro_links: List[str], fanout: int = FETCH_FANOUT, item_timeout: float = FETCH_ITEM_TIMEOUT,
+                              use_cache: bool = True, refresh: bool = False, fetch_page: Optional[Callable] = None,
+                              on_product: Optional[Callable] = None) -> List[ProductRecord]:
+    """Fetch a fixed list of product pages concurrently (see fetch_pool) - results keep the order of `pro_links`"""
+    if not pro_links:
+        return []
+    pool = CandidatePool(len(pro_links), CandidateBudget(len(pro_links)))
+    for pro_link in pro_links:
+        pool.offer(pro_link)
+    pool.close()
+    return await fetch_pool(context, pool, fanout=min(fanout, len(pro_links)), item_timeout=item_timeout, use_cache=use_cache,
+                            refresh=refresh, fetch_page=fetch_page, on_product=on_product)
+
+_refresh_tasks: set = set()
+_refreshing: set = set()        # product keys with a background refresh in flight
+
+def refresh_in_background(pro_links: List[str], fetch_page: Optional[Callable] = None) -> None:
+    """Re-scrape stale cached products on a separate pool lease without blocking the caller
+    - a product already being refreshed (e.g. by a concurrent session) is not refreshed twice
+    """
+    keyed = {product_key(pro_link): pro_link for pro_link in pro_links}
+    keyed = {key: pro_link for key, pro_link in keyed.items() if key not in _refreshing}
+    if not keyed:
+        return
+    _refreshing.update(keyed)
+
+    async def refresh() -> None:
+        try:
+            async with get_scheduler().browser.slot():
+                async with get_browser_pool().lease() as lease:
+                    products = await fetch_product_pages(lease.context, list(keyed.values()), refresh=True, fetch_page=fetch_page)
+                    get_product_cache().refreshes += len(products)
+        except Exception as e:
+            logger.error(f'Background refresh failed: {e}')
+        finally:
+            _refreshing.difference_update(keyed)
+    task = asyncio.create_task(refresh())
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+_refreshing_facets: set = set()     # facet cache keys with a background refresh in flight
+
+def refresh_facets_in_background(base_url: str, search_query: str, pro_class: Optional[ProductClass] = None,
+                                 fetch_filters: Optional[Callable[[Any], Awaitable]] = None) -> None:
+    """Re-scrape the facets of a query that was served another query's (class key) facets, storing them under its own key
+    - fetch_filters(page): the site adapter's scrape, get_filters(refresh=True) by default
+    """
+    key = get_facet_cache().keys(base_url, search_query)[0]
+    if key in _refreshing_facets:
+        return
+    _refreshing_facets.add(key)
+
+    async def refresh() -> None:
+        try:
+            async with get_scheduler().browser.slot():
+                async with get_browser_pool().lease() as lease:
+                    if fetch_filters:
+                        await fetch_filters(lease.page)
+                    else:
+                        await get_filters(lease.page, base_url, search_query, refresh=True, pro_class=pro_class)
+        except Exception as e:
+            logger.error(f'Background facet refresh failed: {e}')
+        finally:
+            _refreshing_facets.discard(key)
+    task = asyncio.create_task(refresh())
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+async def get_products(base_url: str , page: Any) -> List[ProductRecord] | None:
+    try:
+        raws = await extract(page, SEARCH_TILE_SPEC)
+        logger.info(f'Tiles: {len(raws)}')
+        for raw in raws:
+            if raw.get('href'):
+                raw['href'] = base_url + raw['href']
+        return products_from_raw(raws, require=('name', 'price', 'href', 'image'))
 
     except Exception as e:
         logger.error(f"Error during browser setup or navigation: {e}")
-        await page.screenshot(path="error_screenshot.png")
-        await page.pause()
 
-async def get_filters(page: Any, base_url: str, search_query:str) -> List[UserFilter] | None:
+@timed_op('get_filters')
+async def get_filters(page: Any, base_url: str, search_query:str, use_cache: bool = True, refresh: bool = False,
+                      pro_class: Optional[ProductClass] = None) -> List[UserFilter] | None:
+        """Scrape the filter sidebar for the search query
+        - use_cache: serve from / store into the facet cache (page is not touched on a hit)
+        - refresh: skip the cache lookup & re-scrape, still storing the result
+        """
     # async with async_playwright() as p:
+        if use_cache and not refresh:
+            cached, stale = get_facet_cache().get(base_url, search_query, pro_class)
+            # another query's facets (class key) are no answer when the page is at hand
+            if cached is not None and not stale:
+                logger.info(f'Facet cache hit for {search_query}: {len(cached)} filters')
+                return cached
         try:
             # browser = await p.chromium.launch(headless=False)
             # context = await browser.new_context()
             # page = await context.new_page()
 
-            await page.goto(base_url)
-            await page.fill("input[name='q']", search_query)
-            await page.press("input[name='q']", "Enter")
-            await page.wait_for_selector('section._2OLUF3')
+            search_url, _ = build_search_url(base_url, search_query)
+            await navigate(page, search_url)
+            await wait_selector(page, 'section._2OLUF3')
 
             # filters = await page.query_selector_all('section._2OLUF3')
             filters = page.locator('section._2OLUF3')
@@ -140,7 +332,7 @@ async def get_filters(page: Any, base_url: str, search_query:str) -> List[UserFi
                         header_toggle = filter.locator('svg.ukzDZP')
                         await header_toggle.click()
                         # await toggles.nth(i).click()
-                        await page.wait_for_timeout(500)
+                        await section_expanded(filter)
                     sel = filter.locator('div.ewzVkT._3DvUAf')
                     rang = filter.locator('div._0vP2OD')
                     if sel:
@@ -165,6 +357,8 @@ async def get_filters(page: Any, base_url: str, search_query:str) -> List[UserFi
                     site_filters.append(site_filter)
                 except Exception as e:
                     logger.error(f'Oops !!: {e}')
+            if use_cache and site_filters:
+                await asyncio.to_thread(get_facet_cache().put, base_url, search_query, site_filters, pro_class)
             return site_filters
                 # all_texts = await filter.evaluate("""
                 #     (element) => {
@@ -188,132 +382,144 @@ async def get_filters(page: Any, base_url: str, search_query:str) -> List[UserFi
                 # For Range : _0vP2OD , Selection : ewzVkT _3DvUAf  
         except Exception as e:
             logger.error(f"Error during browser setup or navigation: {e}")
-            await page.screenshot(path="error_screenshot.png")
-            await page.pause()
             return []
 
-async def get_filtered_products(page: Any, base_url: str, search_query: str, user_filters: List[UserFilter] | None, top_k:int = 10) -> List[Product] | None:
-    # async with async_playwright() as p:
+RESULTS_GRID = 'div.DOjaWF.gdgoEp'
+
+@timed_op('search_pro_links')
+async def search_pro_links(page: Any, base_url: str, search_query: str, user_filters: List[UserFilter] | None) -> List[str]:
+    """Open the filtered search results & return the product links in rank order
+    - every facet with a known (or earlier learned) url key is in the first navigation
+    - filters without a key get it learned from one option click, once per filter & process; the click applies the option too,
+      so the results are only reloaded again when the learned facets still miss values
+    - filters whose key can't be learned are remembered & clicked in one batch with a single settle wait
+    - the applied facets are checked against the page & missing options are clicked once more
+    """
+    plan = FacetPlan(user_filters)
+    with span('facets.apply', filters=len(plan.filters), unmapped=len(plan.unmapped)) as apply:
+        await navigate(page, plan.url(base_url, search_query))
+        await wait_selector(page, RESULTS_GRID)
+        FACET_STATS['reloads'] += 1
+        if plan.learnable:
+            for user_filter in plan.learnable:
+                await learn_facet_key(page, user_filter)
+            plan = FacetPlan(user_filters)
+            if not plan.in_url(page.url):
+                await navigate(page, plan.url(base_url, search_query))
+                await wait_selector(page, RESULTS_GRID)
+                FACET_STATS['reloads'] += 1
+        if plan.unmapped:
+            logger.info(f'Clicking {len(plan.unmapped)} filters without url facets: {[f.name for f in plan.unmapped]}')
+            await click_batch(page, plan.unmapped)
+        if plan.filters:
+            check = await applied_facets(page, plan)
+            if check['missing']:
+                check = await reclick_missing(page, plan, check)
+            apply.set(missing=len(check['missing']))
+            if check['missing']:
+                logger.error(f"Filters not applied: {check['missing']}")
+        FACET_STATS['applied'] += 1
+    return await get_pro_links(base_url, page)
+
+def results_page_url(url: str, number: int) -> str:
+    """The same (filtered) search on result page `number`"""
+    parts = urlsplit(url)
+    params = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key != 'page']
+    return urlunsplit(parts._replace(query=urlencode(params + [('page', str(number))])))
+
+async def crawl_result_pages(context: Any, search_url: str, base_url: str, pool: CandidatePool, pages: int = CRAWL_PAGES,
+                             fanout: int = CRAWL_FANOUT) -> int:
+    """Read result pages 2..`pages` of a search concurrently, streaming their product links into the pool as each page is read
+    - search_url: the first results page as loaded (facets included), so every page shows the same filtered results
+    - no new page is opened once the pool has enough products or the candidate budget is spent, or past the last page
+    - always closes the pool; returns the number of pages read
+    """
+    numbers = iter(range(2, pages + 1))
+    read = 0
+    last = pages
+
+    async def worker() -> None:
+        nonlocal read, last
+        worker_page = None
         try:
-            await page.goto(base_url)
-            # search_url = base_url + f'search?q={search_query.replace(" ", "+")}'
-            # await page.goto(search_url)
-            await page.fill("input[name='q']", search_query)
-            await page.press("input[name='q']", "Enter")
-            await page.wait_for_selector("div.DOjaWF.gdgoEp")
-
-            if user_filters:
-                filters = page.locator('section._2OLUF3')
-                fcount = await filters.count()
-                user_fnames = [ f.name for f in user_filters]
-                user_fn2vals = {f.name: f.selection for f in user_filters}
-                for i in range(2, fcount):
-                    try:
-                        filter = filters.nth(i)
-                        fname = filter.locator('div.fxf7w6.rgHxCQ')
-                        fname_count = await fname.count() 
-                        if not fname or fname_count < 1:
-                            continue
-                        fname = (await fname.inner_text()).strip()
-                        logger.info(f'Applying {fname} filter')
-                        if fname not in user_fnames:
-                            continue
-                        logger.info(f'Applying filter {fname} ...')
-                        is_exp = filter.locator('div.SDsN9S')
-                        if await is_exp.count() < 1:
-                            logger.info(f'click click click ...')
-                            header_toggle = filter.locator('svg.ukzDZP')
-                            await header_toggle.click()
-                            # await toggles.nth(i).click()
-                            # await page.wait_for_timeout(500)
-                        # when you know desired values:
-                        vals = user_fn2vals.get(fname, None)
-                        if vals:
-                            for wanted in vals:
-                                try:
-                                    # restrict the search to this filter's option elements
-                                    locator = filter.locator('div.ewzVkT._3DvUAf', has_text=wanted)
-                                    # small wait — the locator will throw quickly if not found
-                                    await locator.first.wait_for(state='attached', timeout=1000)
-                                    await locator.first.scroll_into_view_if_needed()
-                                    await locator.first.click(timeout=1000)
-                                    logger.info(f"Selected {wanted} in {fname}")
-                                except Exception as e:
-                                    logger.error(f"couldn't select {wanted} in {fname}: {e}")
-
-                        # sel = filter.locator('div.ewzVkT._3DvUAf')
-                        # rang = filter.locator('div._0vP2OD')
-                        # if sel:
-                        #     ocount = await sel.count()
-                        #     for e in range(ocount):
-                        #         try: 
-                        #             # filtername = (await sel.nth(e).inner_text()).strip() 
-                        #             filtername = await sel.nth(e).text_content(timeout=1000)
-                        #             filtername = filtername.strip() if filtername else ''
-                        #             logger.info(f'Trying {filtername} uwu')
-                        #         except Exception as e:
-                        #             logger.info(f'f: {e}')
-                        #             continue
-                        #         # locator = filter.locator('div.ewzVkT._3DvUAf', has_text=filtername)
-                        #         # await locator.wait_for(timeout=5000)
-                        #         # await locator.click()
-                        #         # logger.info(f"Selected {filtername} in {fname} ...")
-                        #         if user_fn2vals[fname] and filtername in user_fn2vals[fname]:
-                        #             await sel.nth(e).scroll_into_view_if_needed()
-                        #             await sel.nth(e).click()
-                        #             # await page.wait_for_timeout(500)
-                        #             logger.info(f'Selected {filtername} in {fname} ...')
-                        # elif rang:
-                        #     opt = [(await rang.nth(e).inner_text()).strip() for e in range(await rang.count())]
-                        #     filterval = {
-                        #         'type': 'range',
-                        #         'range': opt
-                        #     }
-                        # await page.wait_for_timeout(1000)
-                    except Exception as e:
-                        logger.error(f'Oops !!: {e}')
-            pro_links = await get_pro_links(base_url, page)
-            products = []
-            for pro_link in pro_links[:top_k]:
-                products.append( await get_product_page(pro_link, page))
-            return products
+            for number in numbers:
+                if pool.stopped or number > last:
+                    return
+                worker_page = worker_page or await context.new_page()
+                with span('scrape.results_page', page=number) as page_span:
+                    await navigate(worker_page, results_page_url(search_url, number))
+                    await wait_selector(worker_page, RESULTS_GRID)
+                    links = await get_pro_links(base_url, worker_page)
+                    offered = sum(pool.offer(link) for link in links)
+                    page_span.set(links=len(links), offered=offered)
+                read += 1
+                if not links:
+                    last = min(last, number)
+        except Exception as e:
+            logger.error(f'Results page crawl stopped: {e}')
+        finally:
+            if worker_page is not None:
+                try:
+                    await worker_page.close()
+                except Exception as e:
+                    logger.error(f'Could not close results page: {e}')
+
+    try:
+        if pages > 1 and not pool.stopped:
+            await asyncio.gather(*(worker() for _ in range(max(1, fanout))))
+    finally:
+        pool.close()
+    logger.info(f'Read {read} more result pages, {pool.offered} candidate links')
+    return read
+
+async def fetch_candidates(context: Any, pool: CandidatePool, crawl: Optional[Awaitable] = None, **fetch_kwargs: Any) -> List[ProductRecord]:
+    """Fetch the pool's product pages (fetch_pool) while `crawl` is still offering links from more result pages
+    - the crawl is cancelled once the fetch is done (enough products), the pool is closed either way
+    """
+    crawl_task = asyncio.create_task(crawl) if crawl is not None else None
+    if crawl_task is None:
+        pool.close()
+    try:
+        return await fetch_pool(context, pool, **fetch_kwargs)
+    finally:
+        if crawl_task is not None:
+            crawl_task.cancel()
+            try:
+                await crawl_task
+            except asyncio.CancelledError:
+                pass
+            pool.close()
+
+async def get_filtered_products(page: Any, base_url: str, search_query: str, user_filters: List[UserFilter] | None, top_k:int = 10,
+                                fanout: int = FETCH_FANOUT, item_timeout: float = FETCH_ITEM_TIMEOUT, on_product: Optional[Callable] = None,
+                                use_cache: bool = True, budget: Optional[CandidateBudget] = None) -> List[ProductRecord] | None:
+        try:
+            pool = CandidatePool(top_k, budget)
+            for pro_link in await search_pro_links(page, base_url, search_query, user_filters):
+                pool.offer(pro_link)
+            return await fetch_candidates(page.context, pool, crawl_result_pages(page.context, page.url, base_url, pool), fanout=fanout,
+                                          item_timeout=item_timeout, on_product=on_product, use_cache=use_cache)
             # return await get_products(base_url, page) 
         except Exception as e:
             logger.error(f'Oopsie ! {e}')
 
 async def get_pro_links(base_url: str, page:Any) -> List[str]:
+    """Distinct product links of the open results page, canonical & in rank order (see product_urls.product_links)"""
     await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-    link_eles = await page.locator("div.DOjaWF.gdgoEp div.cPHDOP a").all()
-    # link_eles = await page.locator("a.CGtC98").all()
-    # link_count = await link_eles.count()
-    # if link_count < 1:
-    #     link_eles = page.locator("a.CGtC98")
-    #     link_count = await link_eles.count()
-    logger.info(f'{len(link_eles)} product links fetched !')
-    links = []
-    for i,link_ele in enumerate(link_eles):
-        try:
-            # link = await link_eles.nth(e).get_attribute("href")
-            link = await link_ele.get_attribute("href")
-            if link and 'page=' not in link and 'search?' not in link and len(link) > 150:
-                link = base_url + link
-                # logger.info(f'{e}. {link}')
-                if link not in links:
-                    links.append(link)
-        except Exception as e:
-            logger.error(f'Oopsie in get_pro_links: {e}')
+    raws = await extract(page, SEARCH_LINK_SPEC)
+    logger.info(f'{len(raws)} product links fetched !')
+    links = product_links(base_url, (raw.get('href') for raw in raws))
     logger.info(f'links: {len(links)}')
-    return links[1:]
+    return links
 
 async def playwright_enter() -> Tuple:
     context_man = async_playwright()
     playwright = await context_man.__aenter__()
-    browser = await playwright.chromium.launch(headless=True,
-                                              args=["--no-sandbox", "--disable-setuid-sandbox", "--disable-dev-shm-usage"]) #False for browser
+    browser = await playwright.chromium.launch(headless=True, args=BROWSER_ARGS) #False for browser
     context = await browser.new_context()
     page = await context.new_page()
-    page.set_default_timeout(15000)          # 6 seconds for all waits
-    page.set_default_navigation_timeout(15000)  
+    page.set_default_timeout(DEFAULT_TIMEOUT)
+    page.set_default_navigation_timeout(DEFAULT_TIMEOUT)
     return context_man, playwright, browser, context, page
 
 async def playwright_exit(context_man) -> None:
@@ -0,0 +1,72 @@
+import pytest
+from pydantic_models import UserFilter
+from filter_matcher import match_answer, match_query, trim_filters, form_answer, MATCH_CONFIDENCE
+
+BRAND = UserFilter(name='BRAND', type='multiselect', selection=['Apple', 'Samsung', 'Nothing', 'Google', 'Motorola'])
+RAM = UserFilter(name='RAM', type='multiselect', selection=['4 GB', '6 GB', '8 GB', '12 GB & Above'])
+STORAGE = UserFilter(name='INTERNAL STORAGE', type='multiselect', selection=['8 - 15.9 GB', '64 - 127.9 GB', '128 - 255.9 GB', '256 GB & Above'])
+RATINGS = UserFilter(name='CUSTOMER RATINGS', type='multiselect', selection=['4★ & above', '3★ & above'])
+
+def selection(result):
+    user_filter, _ = result
+    return user_filter.selection if user_filter else None
+
+@pytest.mark.parametrize('answer, expected', [
+    ('apple', ['Apple']),
+    ('Samsung or Google', ['Samsung', 'Google']),
+    ('apple but not samsung', ['Apple']),
+    ('anything but apple', ['Samsung', 'Nothing', 'Google', 'Motorola']),
+    ('anything except apple', ['Samsung', 'Nothing', 'Google', 'Motorola']),
+    ('samsung, google, not apple', ['Samsung', 'Google']),
+])
+def test_answer_selects_named_options(answer, expected):
+    user_filter, confidence = match_answer(BRAND, answer)
+    assert user_filter.selection == expected
+    assert confidence >= MATCH_CONFIDENCE
+
+@pytest.mark.parametrize('answer', ['not apple', 'no apple'])
+def test_answer_that_only_rejects_goes_to_the_llm(answer):
+    assert match_answer(BRAND, answer) == (None, 0.0)
+
+@pytest.mark.parametrize('answer', ['anything', 'nothin', 'samsng'])
+def test_fuzzy_similarity_alone_stays_below_confidence(answer):
+    user_filter, confidence = match_answer(BRAND, answer)
+    assert confidence < MATCH_CONFIDENCE
+
+@pytest.mark.parametrize('answer', ['skip', 'no preference', ''])
+def test_skip_answers(answer):
+    assert match_answer(BRAND, answer) == (None, 1.0)
+
+@pytest.mark.parametrize('filter_, answer, expected', [
+    (STORAGE, '256', ['256 GB & Above']),
+    (STORAGE, '100 - 200 gb', ['64 - 127.9 GB', '128 - 255.9 GB']),
+    (RATINGS, '4', ['4★ & above']),
+    (RAM, 'at least 8 gb', ['8 GB', '12 GB & Above']),
+])
+def test_answer_numbers_select_overlapping_options(filter_, answer, expected):
+    assert selection(match_answer(filter_, answer)) == expected
+
+def test_form_range_keeps_the_range_and_the_overlapping_options():
+    user_filter, text = form_answer(STORAGE, {'range': [100, None]})
+    assert user_filter.selection == ['64 - 127.9 GB', '128 - 255.9 GB', '256 GB & Above']
+    assert user_filter.range == (100, None) and text is None
+    assert form_answer(RAM, {'range': [None, 2]}) == (None, None)
+
+@pytest.mark.parametrize('query, ram, storage', [
+    ('samsung phone 8gb ram', ['8 GB'], None),
+    ('samsung phone ram 8gb', ['8 GB'], None),
+    ('8gb ram 256gb storage phone', ['8 GB'], ['256 GB & Above']),
+    ('phone 8 gb ram 128 gb rom', ['8 GB'], ['128 - 255.9 GB']),
+    ('iphone 256gb', None, ['256 GB & Above']),
+    ('samsung phone 8gb', None, None),
+])
+def test_query_quantities_go_to_the_filter_they_name(query, ram, storage):
+    site_filters = [RAM, STORAGE]
+    assert selection((match_query(RAM, query, site_filters), 1.0)) == ram
+    assert selection((match_query(STORAGE, query, site_filters), 1.0)) == storage
+
+def test_trim_filters_asks_about_ambiguous_quantities():
+    ask, answered = trim_filters([STORAGE, RAM, BRAND], 'samsung phone 8gb ram')
+    assert [f.name for f in answered] == ['RAM', 'BRAND']
+    assert answered[0].selection == ['8 GB'] and answered[1].selection == ['Samsung']
+    assert [f.name for f in ask] == ['INTERNAL STORAGE']
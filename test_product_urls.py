@@ -0,0 +1,48 @@
+import os
+import json
+from urllib.parse import urljoin
+import pytest
+from product_urls import product_key, canonical_url, is_product_link, product_links, registrable_host, ProductIndex
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'urls.jsonl')
+
+def load_corpus(path: str = CORPUS):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def absolute(case) -> str:
+    return urljoin(case['base'] + '/', case['url'].strip()) if 'base' in case else case['url']
+
+CASES = load_corpus()
+
+@pytest.mark.parametrize('case', CASES, ids=[case['note'] for case in CASES])
+def test_corpus(case):
+    url = absolute(case)
+    assert product_key(url) == case['key']
+    assert canonical_url(url) == case['canonical']
+    assert is_product_link(url) is case['product']
+
+def test_index_dedups_to_distinct_products():
+    urls = [absolute(case) for case in CASES if case['product']]
+    index = ProductIndex(urls)
+    assert len(index) == len({case['key'] for case in CASES if case['product']})
+    assert index.duplicates == len(urls) - len(index)
+    assert all(url in index for url in urls)
+
+def test_same_pid_on_two_sites_is_two_products():
+    index = ProductIndex()
+    assert index.add('https://www.flipkart.com/x/p/itm1?pid=ABC&iid=1')
+    assert not index.add('https://dl.flipkart.com/x/p/itm1?pid=abc&ssid=2')
+    assert index.add('https://www.amazon.in/dp/B01?pid=ABC')
+
+def test_product_links_keeps_page_order_and_drops_non_products():
+    hrefs = ['/search?q=phone&page=2', '/a/p/itm1?pid=A&iid=1', None, '/b/p/itm2?pid=B', '/a/p/itm1?pid=A&iid=2', '/helpcentre']
+    assert product_links('https://www.flipkart.com', hrefs) == [
+        'https://www.flipkart.com/a/p/itm1?pid=A', 'https://www.flipkart.com/b/p/itm2?pid=B']
+
+@pytest.mark.parametrize('netloc, host', [
+    ('www.flipkart.com', 'flipkart.com'), ('WWW.Flipkart.COM', 'flipkart.com'), ('flipkart.com', 'flipkart.com'),
+    ('www.amazon.co.in', 'amazon.co.in'), ('127.0.0.1:8765', '127.0.0.1'), ('localhost:8000', 'localhost'),
+])
+def test_registrable_host(netloc, host):
+    assert registrable_host(netloc) == host
@@ -0,0 +1,30 @@
+import pytest
+from query_rules import analyze_query
+
+@pytest.mark.parametrize('query, pro_type', [
+    ('samsung galaxy tab s9 128gb', 'tablet'),
+    ('galaxy buds 2 pro', 'headphones'),
+    ('pixel watch 2', 'smartwatch'),
+    ('google pixel 8 phone', 'smartphone'),
+    ('iphone 16 128gb black', 'smartphone'),
+    ('hp laptop 16gb ram', 'laptop'),
+])
+def test_type_words_win_over_product_lines(query, pro_type):
+    analysis = analyze_query(query)
+    assert analysis.pro_class.type == pro_type
+    assert analysis.class_is_local
+
+@pytest.mark.parametrize('query', ['samsung galaxy s24 256gb black', 'redmi note 13 pro', 'pixel 8a'])
+def test_product_line_alone_is_left_to_the_llm(query):
+    analysis = analyze_query(query)
+    assert analysis.pro_class.type == 'smartphone'
+    assert not analysis.class_is_local and not analysis.query_is_local
+
+@pytest.mark.parametrize('query', ['phone case for iphone 15', 'laptop bag'])
+def test_accessories_are_left_to_the_llm(query):
+    assert not analyze_query(query).class_is_local
+
+def test_budget_stays_out_of_the_search_query():
+    analysis = analyze_query('i want a black phone under 30k')
+    assert analysis.query == 'black phone'
+    assert 'under 30k' in analysis.attributes
@@ -0,0 +1,99 @@
+import asyncio
+from contextlib import asynccontextmanager
+import pytest
+import scrape_cache
+import site_adapters
+from browser_pool import BrowserPool
+from fixture_site import FixtureServer
+from pydantic_models import SearchSpecs
+from records import ProductRecord
+from scrape_cache import ProductCache
+from site_adapters import SiteAdapter, FixtureAdapter, register_adapter, search_sites, SITE_ADAPTERS
+
+class FakePool:
+    """Browserless stand-in for the BrowserPool: leases without a page"""
+
+    @asynccontextmanager
+    async def lease(self, timeout=None):
+        class Lease:
+            page = None
+        yield Lease()
+
+class StreamingAdapter(SiteAdapter):
+    """Resolves `count` products, then takes `hang` seconds to finish the search"""
+
+    def __init__(self, base_url: str, count: int, hang: float):
+        self.name, self.base_url, self.count, self.hang = base_url, base_url, count, hang
+
+    async def get_filters(self, page, query, pro_class=None, refresh=False):
+        return []
+
+    async def search(self, page, query, user_filters=None):
+        return []
+
+    async def get_tiles(self, page):
+        return []
+
+    async def get_product(self, url, page, use_cache=True):
+        return None
+
+    async def get_candidates(self, page, query, user_filters=None, top_k=10, on_product=None, budget=None):
+        products = [ProductRecord(f'{self.name} phone {i}', 1000 + i, f'{self.base_url}/p/itm{i}?pid={self.name.upper()}{i}') for i in range(self.count)]
+        for product in products:
+            await on_product(product)
+        await asyncio.sleep(self.hang)
+        return products
+
+@pytest.fixture
+def adapters(monkeypatch):
+    monkeypatch.setattr(site_adapters, 'get_browser_pool', lambda: FakePool())
+    registered = dict(SITE_ADAPTERS)
+    yield
+    SITE_ADAPTERS.clear()
+    SITE_ADAPTERS.update(registered)
+
+def test_cut_off_site_keeps_its_streamed_products(adapters):
+    register_adapter(StreamingAdapter('http://slow.test', count=2, hang=30.0))
+    register_adapter(StreamingAdapter('http://fast.test', count=2, hang=0.0))
+    streamed = []
+
+    async def on_product(product):
+        streamed.append(product)
+
+    products = asyncio.run(search_sites(['http://slow.test', 'http://fast.test'], SearchSpecs(query='phone'), top_k=10, budget=0.5,
+                                        on_product=on_product))
+    names = [p.name for p in products]
+    assert names == ['http://slow.test phone 0', 'http://fast.test phone 0', 'http://slow.test phone 1', 'http://fast.test phone 1']
+    assert sorted(p.name for p in streamed) == sorted(names)
+
+def _chromium_missing() -> bool:
+    async def launch():
+        pool = BrowserPool(reap_interval=3600)
+        try:
+            await pool.start()
+        finally:
+            await pool.close()
+    try:
+        asyncio.run(launch())
+        return False
+    except Exception:
+        return True
+
+def test_search_sites_against_fixture_site(adapters, monkeypatch):
+    if _chromium_missing():
+        pytest.skip('chromium is not installed')
+    monkeypatch.setattr(scrape_cache, '_product_cache', ProductCache(':memory:'))
+    pool = BrowserPool()
+    monkeypatch.setattr(site_adapters, 'get_browser_pool', lambda: pool)
+
+    async def run(base_url):
+        try:
+            return await search_sites([base_url], SearchSpecs(query='phone'), top_k=3)
+        finally:
+            await pool.close()
+
+    with FixtureServer() as server:
+        register_adapter(FixtureAdapter('fixture', server.base_url))
+        products = asyncio.run(run(server.base_url))
+    assert [p.name for p in products] == ['Phone X (Black, 256 GB)', 'Phone X (Blue, 128 GB)', 'Phone Y (White, 256 GB)']
+    assert all(p.url.startswith(server.base_url) for p in products)
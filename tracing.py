@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import functools
+import threading
+import logging
+import sys
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Dict, Any, Iterator, Callable
+from records import encode_json
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTERS = os.environ.get('SHOP_TRACE', '')     # comma separated: jsonl, otel
+TRACE_FILE = os.environ.get('SHOP_TRACE_FILE', os.path.join(os.environ.get('SHOP_CACHE_DIR', '.cache'), 'traces.jsonl'))
+
+class Span:
+    """One timed operation of a chat: duration, attributes (tokens, bytes, ...) & error status"""
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = 0.0
+        self.status = 'ok'
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name, 'trace_id': self.trace_id, 'span_id': self.span_id, 'parent_id': self.parent_id,
+            'start': self.start, 'duration': round(self.duration, 6), 'status': self.status, 'error': self.error,
+            'attributes': self.attributes,
+        }
+
+class JsonlExporter:
+    """Finished spans appended to a JSON lines file"""
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line + '\n')
+
+class MemoryExporter:
+    """Finished spans kept in a list - for checks & benchmarks"""
+
+    def __init__(self):
+        self.spans: List[Span] = []
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+
+    def names(self) -> List[str]:
+        return [span.name for span in self.spans]
+
+    def clear(self) -> None:
+        self.spans.clear()
+
+class OtelExporter:
+    """Finished spans re-emitted through the OpenTelemetry API (needs opentelemetry-api & a configured SDK)"""
+
+    def __init__(self, name: str = 'shop-assistant'):
+        from opentelemetry import trace
+        self._trace = trace
+        self._tracer = trace.get_tracer(name)
+
+    def export(self, span: Span) -> None:
+        attributes = {key: value if isinstance(value, (str, bool, int, float)) else str(value) for key, value in span.attributes.items()}
+        attributes.update({'shop.trace_id': span.trace_id, 'shop.span_id': span.span_id, 'shop.parent_id': span.parent_id or ''})
+        otel_span = self._tracer.start_span(span.name, start_time=int(span.start * 1e9), attributes=attributes)
+        if span.status == 'error':
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time=int((span.start + span.duration) * 1e9))
+
+current_span: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+# per chat: span name -> [count, total seconds], shared by every task of the chat
+current_summary: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar('current_summary', default=None)
+
+class Tracer:
+    """Nested spans through contextvars, handed to every exporter when they end"""
+
+    def __init__(self, exporters: Optional[List[Any]] = None):
+        self.exporters = list(exporters or [])
+
+    def add_exporter(self, exporter: Any) -> Any:
+        self.exporters.append(exporter)
+        return exporter
+
+    def remove_exporter(self, exporter: Any) -> None:
+        self.exporters.remove(exporter)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        parent = current_span.get()
+        span = Span(name, parent.trace_id if parent else uuid.uuid4().hex, parent.span_id if parent else None, attributes)
+        span_token = current_span.set(span)
+        summary_token = current_summary.set({}) if parent is None else None
+        summary = current_summary.get()
+        started = time.perf_counter()
+        try:
+            yield span
+        except asyncio.CancelledError:
+            span.status = 'cancelled'
+            raise
+        except BaseException as e:
+            span.status, span.error = 'error', f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            current_span.reset(span_token)
+            if summary_token:
+                current_summary.reset(summary_token)
+            if summary is not None:
+                entry = summary.setdefault(name, [0, 0.0])
+                entry[0] += 1
+                entry[1] += span.duration
+            for exporter in self.exporters:
+                try:
+                    exporter.export(span)
+                except Exception as e:
+                    logger.error(f'Span export failed: {e}')
+
+_tracer: Optional[Tracer] = None
+
+def get_tracer() -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+        for kind in filter(None, TRACE_EXPORTERS.split(',')):
+            try:
+                _tracer.add_exporter({'jsonl': JsonlExporter, 'otel': OtelExporter}[kind.strip()]())
+            except Exception as e:
+                logger.error(f'Could not set up {kind} trace exporter: {e}')
+    return _tracer
+
+def span(name: str, **attributes: Any):
+    return get_tracer().span(name, **attributes)
+
+def traced(name: str) -> Callable:
+    """Run an async function inside a span"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def timing_summary(summary: Optional[Dict[str, List[float]]] = None) -> Dict[str, float]:
+    """Seconds spent per span name in the current chat (nested spans overlap - these don't add up)"""
+    summary = summary if summary is not None else current_summary.get() or {}
+    return {name: round(total, 3) for name, (count, total) in sorted(summary.items(), key=lambda item: -item[1][1])}
+
+async def send_json(ws: Any, data: Dict[str, Any]) -> None:
+    """Encode once (records.encode_json) & send the text inside a span"""
+    text = encode_json(data)
+    with span('ws.send', type=data.get('type'), bytes=len(text)):
+        await ws.send_text(text)
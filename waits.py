@@ -0,0 +1,263 @@
+import os
+import time
+import asyncio
+import weakref
+import functools
+import logging
+import sys
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Dict, Any, Iterator, Callable
+from browser_pool import DEFAULT_TIMEOUT
+from tracing import span
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WAIT_WINDOW = 200               # recent latencies kept per wait kind
+WAIT_MIN_SAMPLES = 5            # below this the default timeout is used
+WAIT_FACTOR = 3.0               # adaptive timeout = p95 of observed latencies x this
+WAIT_MIN = 0.25                 # s, adaptive timeouts never go below ...
+WAIT_MAX = DEFAULT_TIMEOUT / 1000   # s, ... or above this
+NETWORK_QUIET = float(os.environ.get('SHOP_NETWORK_QUIET', 0.15))    # s without xhr/fetch activity that counts as settled
+NETWORK_TYPES = ('xhr', 'fetch')
+# default timeouts (s) per wait kind, until enough latencies were seen
+WAIT_DEFAULTS = {
+    'expand': 2.0,      # filter section opened
+    'option': 2.0,      # filter option attached
+    'network': 3.0,     # facet xhr settled
+    'grid': 5.0,        # result grid re-rendered
+}
+
+EXPANDED_SELECTOR = 'div.SDsN9S'
+GRID_SELECTOR = 'div.DOjaWF.gdgoEp'
+GRID_TILE_SELECTOR = 'div.cPHDOP a[href]'
+GRID_SIGNATURE_JS = """
+([grid, tile]) => Array.from(document.querySelectorAll(grid + ' ' + tile)).slice(0, 8).map(a => a.getAttribute('href')).join('|')
+"""
+GRID_CHANGED_JS = """
+([grid, tile, before]) => {
+    const now = Array.from(document.querySelectorAll(grid + ' ' + tile)).slice(0, 8).map(a => a.getAttribute('href')).join('|');
+    return now !== before;
+}
+"""
+
+# per scraper operation: [seconds spent in waits] - filled by the waits that run inside it
+current_waited: ContextVar[Optional[List[float]]] = ContextVar('current_waited', default=None)
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+class WaitStats:
+    """Observed wait latencies per kind (-> adaptive timeouts) & waiting vs working time per scraper operation"""
+
+    def __init__(self, window: int = WAIT_WINDOW):
+        self.latencies: Dict[str, deque] = {}
+        self.counts: Dict[str, List[int]] = {}     # kind -> [waits, timeouts]
+        self.ops: Dict[str, List[float]] = {}      # op -> [runs, waiting s, working s]
+        self.window = window
+
+    def timeout(self, kind: str) -> float:
+        """Seconds to wait for `kind`: a multiple of its p95 latency, the default until there are enough samples"""
+        seen = self.latencies.get(kind)
+        if not seen or len(seen) < WAIT_MIN_SAMPLES:
+            return WAIT_DEFAULTS.get(kind, WAIT_MAX)
+        return min(WAIT_MAX, max(WAIT_MIN, _percentile(list(seen), 0.95) * WAIT_FACTOR))
+
+    def record(self, kind: str, seconds: float, ok: bool) -> None:
+        # timeouts are kept as samples too, so a slow site pushes its timeouts up
+        self.latencies.setdefault(kind, deque(maxlen=self.window)).append(seconds)
+        counts = self.counts.setdefault(kind, [0, 0])
+        counts[0] += 1
+        counts[1] += not ok
+        waited = current_waited.get()
+        if waited is not None:
+            waited[0] += seconds
+
+    def record_op(self, op: str, waiting: float, working: float) -> None:
+        entry = self.ops.setdefault(op, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += waiting
+        entry[2] += working
+
+    def stats(self) -> Dict[str, Any]:
+        kinds = {}
+        for kind, (waits, timeouts) in self.counts.items():
+            seen = list(self.latencies[kind])
+            kinds[kind] = {'waits': waits, 'timeouts': timeouts, 'p50': round(_percentile(seen, 0.5), 3),
+                           'p95': round(_percentile(seen, 0.95), 3), 'timeout': round(self.timeout(kind), 3)}
+        ops = {op: {'runs': runs, 'waiting': round(waiting, 3), 'working': round(working, 3)} for op, (runs, waiting, working) in self.ops.items()}
+        return {
+            'kinds': kinds,
+            'ops': ops,
+            'waiting': round(sum(op['waiting'] for op in ops.values()), 3),
+            'working': round(sum(op['working'] for op in ops.values()), 3),
+        }
+
+_wait_stats: Optional[WaitStats] = None
+
+def get_wait_stats() -> WaitStats:
+    global _wait_stats
+    if _wait_stats is None:
+        _wait_stats = WaitStats()
+    return _wait_stats
+
+@contextmanager
+def timed(op: str) -> Iterator[None]:
+    """Split the enclosed scraper operation into time spent in waits & the rest (working)"""
+    waited = [0.0]
+    token = current_waited.set(waited)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        current_waited.reset(token)
+        elapsed = time.perf_counter() - started
+        get_wait_stats().record_op(op, waited[0], max(0.0, elapsed - waited[0]))
+        outer = current_waited.get()
+        if outer is not None:
+            outer[0] += waited[0]
+
+def timed_op(op: str) -> Callable:
+    """Run an async scraper function inside timed(op)"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with timed(op):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def add_waited(kind: str, seconds: float, ok: bool = True) -> None:
+    """Count a wait that doesn't go through this module (a plain wait_for_selector) as waiting time"""
+    get_wait_stats().record(kind, seconds, ok)
+
+@contextmanager
+def _wait(kind: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+    """Time one wait of `kind` against its adaptive timeout - the body sets state['ok']"""
+    stats = get_wait_stats()
+    state = {'timeout': stats.timeout(kind), 'ok': False}
+    started = time.perf_counter()
+    with span(f'wait.{kind}', timeout=round(state['timeout'], 3), **attributes) as wait_span:
+        try:
+            yield state
+        finally:
+            seconds = time.perf_counter() - started
+            stats.record(kind, seconds, state['ok'])
+            wait_span.set(ok=state['ok'])
+    if not state['ok']:
+        logger.info(f'{kind} wait gave up after {seconds:.2f}s')
+
+class NetworkTracker:
+    """In-flight xhr/fetch requests of one page, from its request events"""
+
+    def __init__(self, page: Any):
+        self.inflight = set()
+        self.started = 0
+        self.last_activity = time.monotonic()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        page.on('request', self._started)
+        page.on('requestfinished', self._finished)
+        page.on('requestfailed', self._finished)
+
+    def _started(self, request: Any) -> None:
+        if request.resource_type in NETWORK_TYPES:
+            self.inflight.add(request)
+            self.started += 1
+            self.last_activity = time.monotonic()
+            self.idle.clear()
+
+    def _finished(self, request: Any) -> None:
+        if request in self.inflight:
+            self.inflight.discard(request)
+            self.last_activity = time.monotonic()
+            if not self.inflight:
+                self.idle.set()
+
+    def mark(self) -> int:
+        """Count an action (click) as activity, so settling waits for the requests it is about to start
+        - returns the requests started so far, for results_settled
+        """
+        self.last_activity = time.monotonic()
+        return self.started
+
+    async def settled(self, timeout: float, quiet: float = NETWORK_QUIET) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self.inflight:
+                try:
+                    await asyncio.wait_for(self.idle.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return False
+                continue
+            left = self.last_activity + quiet - time.monotonic()
+            if left <= 0:
+                return True
+            await asyncio.sleep(min(left, remaining))
+
+_trackers: 'weakref.WeakKeyDictionary[Any, NetworkTracker]' = weakref.WeakKeyDictionary()
+
+def network(page: Any) -> NetworkTracker:
+    """The page's request tracker, attached on first use"""
+    if page not in _trackers:
+        _trackers[page] = NetworkTracker(page)
+    return _trackers[page]
+
+async def section_expanded(section: Any, selector: str = EXPANDED_SELECTOR) -> bool:
+    """Wait for a collapsed filter section to show its options"""
+    with _wait('expand') as state:
+        try:
+            await section.locator(selector).first.wait_for(state='attached', timeout=state['timeout'] * 1000)
+            state['ok'] = True
+        except Exception:
+            pass
+    return state['ok']
+
+async def option_ready(locator: Any) -> bool:
+    """Wait for a filter option to be attached"""
+    with _wait('option') as state:
+        try:
+            await locator.wait_for(state='attached', timeout=state['timeout'] * 1000)
+            state['ok'] = True
+        except Exception:
+            pass
+    return state['ok']
+
+async def network_settled(page: Any) -> bool:
+    """Wait for the page's xhr/fetch traffic (the facet update) to go quiet"""
+    with _wait('network') as state:
+        state['ok'] = await network(page).settled(state['timeout'])
+    return state['ok']
+
+async def grid_signature(page: Any, grid: str = GRID_SELECTOR, tile: str = GRID_TILE_SELECTOR) -> str:
+    """The first result links - compared against after an action to tell the grid was re-rendered"""
+    try:
+        return await page.evaluate(GRID_SIGNATURE_JS, [grid, tile])
+    except Exception:
+        return ''
+
+async def grid_rerendered(page: Any, before: str, grid: str = GRID_SELECTOR, tile: str = GRID_TILE_SELECTOR) -> bool:
+    """Wait until the result grid shows other results than `before` (from grid_signature)"""
+    with _wait('grid') as state:
+        try:
+            await page.wait_for_function(GRID_CHANGED_JS, arg=[grid, tile, before], timeout=state['timeout'] * 1000)
+            state['ok'] = True
+        except Exception:
+            pass
+    return state['ok']
+
+async def results_settled(page: Any, before: str, started: int) -> bool:
+    """After a filter click: the facet xhr settled & the grid re-rendered
+    - before: grid_signature & started: network(page).mark(), both taken just before the click
+    - no request since the click means nothing to re-render, so the grid wait is skipped
+    """
+    settled = await network_settled(page)
+    if network(page).started == started:
+        return settled
+    return await grid_rerendered(page, before) and settled